@@ -0,0 +1,146 @@
+"""
+Nightly precompute of outfit recommendations (``python batch.py``).
+
+Walks every user with a wardrobe (``wardrobes/*``) or a profile (``users/*``)
+in paged scans, asks the LLM for each one's default structured
+recommendation with bounded concurrency, and stores it in
+``users/{uid}/profile/precomputedOutfits``. ``/api/recommend`` serves that
+result until the wardrobe or profile changes or it is older than
+``PRECOMPUTED_MAX_AGE_HOURS``, so the morning peak does not wait on the LLM.
+
+Progress is checkpointed in ``jobs/precomputeOutfits``: rerunning with the
+same ``--run-id`` (default: today's UTC date) resumes after the last user
+whose turn, and every earlier one, finished.
+"""
+
+import argparse
+import asyncio
+import datetime
+import heapq
+import os
+import time
+from collections import Counter, deque
+from typing import Iterator, Optional
+
+import main
+
+
+def user_ids(db, page_size: int) -> Iterator[str]:
+    """Ids of users with a wardrobe or a profile, ascending and without duplicates, read a page at a time."""
+    wardrobes = (ref.id for ref in db.collection("wardrobes").list_documents(page_size=page_size))
+    users = (ref.id for ref in db.collection("users").list_documents(page_size=page_size))
+    last = None
+    for userId in heapq.merge(wardrobes, users):
+        if userId != last:
+            last = userId
+            yield userId
+
+
+async def precompute_all(
+    concurrency: int = 8,
+    page_size: int = 300,
+    run_id: Optional[str] = None,
+    restart: bool = False,
+    refresh_after_hours: float = 20,
+    checkpoint_every: int = 50,
+    limit: Optional[int] = None,
+) -> dict:
+    """
+    Precompute recommendations for every user, resuming an unfinished run with the same id.
+
+    Args:
+        concurrency: Users processed (LLM calls) at once
+        page_size: Document ids fetched per scan page
+        run_id: Checkpoint id; defaults to today's UTC date
+        restart: Ignore an existing checkpoint for ``run_id``
+        refresh_after_hours: Keep results for unchanged users until they are this old
+        checkpoint_every: Users finished between checkpoint writes
+        limit: Stop after this many users (for trial runs; the run can then be resumed)
+
+    Returns:
+        Counts of ``written``, ``skipped`` and ``failed`` users, plus the run id
+    """
+    db = main.get_db()
+    run_id = run_id or datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+    checkpoint_ref = db.collection("jobs").document("precomputeOutfits")
+    snapshot = await asyncio.to_thread(checkpoint_ref.get)
+    state = snapshot.to_dict() if snapshot.exists else {}
+    resume = not restart and state.get("runId") == run_id and not state.get("finishedAt")
+    resume_after = state.get("lastUserId") if resume else None
+    stats = Counter({k: state.get(k, 0) for k in ("written", "skipped", "failed")} if resume else {})
+    if resume_after:
+        print(f"↩️  Resuming run {run_id} after {resume_after}")
+
+    async def save(**extra) -> None:
+        record = {"runId": run_id, "lastUserId": resume_after, "updatedAt": datetime.datetime.now(datetime.timezone.utc), **stats, **extra}
+        await asyncio.to_thread(checkpoint_ref.set, record)
+
+    async def process(userId: str) -> str:
+        try:
+            return await main.precompute_recommendation(userId, refresh_after_hours)
+        except Exception as e:
+            print(f"[ERROR precompute {userId}]", e)
+            return "failed"
+
+    # Users in scan order; the checkpoint only moves past a user once it and everyone before it finished
+    pending: deque = deque()
+    unsaved = 0
+
+    async def advance() -> None:
+        nonlocal resume_after, unsaved
+        while pending and pending[0][1].done():
+            userId, task = pending.popleft()
+            stats[task.result()] += 1
+            resume_after, unsaved = userId, unsaved + 1
+        if unsaved >= checkpoint_every:
+            unsaved = 0
+            await save()
+
+    started = time.monotonic()
+    scan = user_ids(db, page_size)
+    seen, exhausted = 0, False
+    while limit is None or seen < limit:
+        # The scan pages through Firestore synchronously; keep it off the event loop
+        userId = await asyncio.to_thread(next, scan, None)
+        if userId is None:
+            exhausted = True
+            break
+        if resume_after is not None and userId <= resume_after:
+            continue
+        seen += 1
+        pending.append((userId, asyncio.ensure_future(process(userId))))
+        while sum(1 for _, task in pending if not task.done()) >= concurrency:
+            await asyncio.wait([task for _, task in pending if not task.done()], return_when=asyncio.FIRST_COMPLETED)
+            await advance()
+        await advance()
+    if pending:
+        await asyncio.wait([task for _, task in pending])
+    await advance()
+    # A run stopped by --limit stays resumable
+    await save(**({"finishedAt": datetime.datetime.now(datetime.timezone.utc)} if exhausted else {}))
+    await main.llm_client.aclose()
+    print(f"✅ Run {run_id}: {dict(stats)} in {time.monotonic() - started:.0f}s")
+    return {"runId": run_id, **stats}
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser(description="Precompute outfit recommendations for every user")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("PRECOMPUTE_CONCURRENCY", "8")))
+    parser.add_argument("--page-size", type=int, default=300)
+    parser.add_argument("--run-id", help="checkpoint id (default: today's UTC date)")
+    parser.add_argument("--restart", action="store_true", help="start over instead of resuming the run's checkpoint")
+    parser.add_argument("--refresh-after", type=float, default=20, help="hours before an unchanged user's result is regenerated")
+    parser.add_argument("--limit", type=int, help="stop after this many users")
+    args = parser.parse_args()
+    asyncio.run(precompute_all(
+        concurrency=args.concurrency,
+        page_size=args.page_size,
+        run_id=args.run_id,
+        restart=args.restart,
+        refresh_after_hours=args.refresh_after,
+        limit=args.limit,
+    ))
+
+
+if __name__ == "__main__":
+    run()
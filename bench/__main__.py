@@ -0,0 +1,255 @@
+"""
+Offline load test for the Stylo API.
+
+Starts a fake OpenRouter server and main.app (in a subprocess, on the
+in-memory Firestore stand-in seeded with ``--users`` users), then drives
+each scenario with ``--concurrency`` concurrent clients for ``--requests``
+requests and prints per-scenario latency percentiles and throughput as JSON.
+
+    python -m bench --wardrobe-size 200 --history-depth 20 --out before.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from bench.openrouter import FakeOpenRouter
+from bench.server import item_id, user_id, wardrobe_item
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Scenario:
+    """
+    One endpoint under load.
+
+    ``build(n)`` returns ``(method, path, kwargs)`` for the n-th request;
+    statuses in ``ok`` count as successes. Streaming scenarios also record
+    time to first byte.
+    """
+
+    def __init__(self, name: str, build: Callable[[int], tuple], ok=(200,), stream: bool = False):
+        self.name = name
+        self.build = build
+        self.ok = set(ok)
+        self.stream = stream
+
+
+def scenarios(users: int, wardrobe_size: int) -> List[Scenario]:
+    def uid(n: int) -> str:
+        return user_id(n % users)
+
+    def auth(n: int) -> dict:
+        return {"Authorization": f"Bearer mock-token-{uid(n)}"}
+
+    created: List[tuple] = []
+
+    def add_item(n: int) -> tuple:
+        body = wardrobe_item(n % users, wardrobe_size + n)
+        return "POST", "/api/wardrobe", {"json": body, "_record": lambda r: created.append((body["userId"], r.json()["id"]))}
+
+    def delete_item(n: int) -> tuple:
+        if created:
+            owner, itemId = created.pop()
+        else:
+            owner, itemId = uid(n), item_id(n % users, n % max(wardrobe_size, 1))
+        return "DELETE", f"/api/wardrobe/{owner}/{itemId}", {}
+
+    def bulk(n: int) -> tuple:
+        items = [wardrobe_item(n % users, 100000 + n * 50 + i) for i in range(50)]
+        return "POST", "/api/wardrobe/bulk", {"json": items}
+
+    voice_texts = ["What should I wear to a dinner party?", "Does my navy shirt go with beige pants?", "Pick shoes for a business meeting"]
+
+    return [
+        Scenario("wardrobe_list", lambda n: ("GET", f"/api/wardrobe/{uid(n)}", {})),
+        Scenario("wardrobe_page", lambda n: ("GET", f"/api/wardrobe/{uid(n)}", {"params": {"limit": 20, "fields": "type,color,nature"}})),
+        Scenario("wardrobe_filter", lambda n: ("GET", f"/api/wardrobe/{uid(n)}", {"params": {"type": "shirt", "limit": 20}})),
+        Scenario("wardrobe_add", add_item),
+        Scenario("wardrobe_delete", delete_item),
+        Scenario("wardrobe_bulk", bulk),
+        Scenario("wardrobe_similar", lambda n: ("GET", f"/api/wardrobe/{uid(n)}/{item_id(n % users, 0)}/similar", {}), ok=(200, 404)),
+        Scenario("questionnaire_get", lambda n: ("GET", f"/api/questionnaire/{uid(n)}", {"headers": auth(n)})),
+        Scenario("recommend_fast", lambda n: ("POST", "/api/recommend", {"json": {"userId": uid(n), "mode": "fast"}})),
+        Scenario("recommend", lambda n: ("POST", "/api/recommend", {"json": {"userId": uid(n)}})),
+        Scenario("recommend_hybrid", lambda n: ("POST", "/api/recommend", {"json": {"userId": uid(n), "mode": "hybrid"}})),
+        Scenario("recommend_stream", lambda n: ("POST", "/api/recommend", {"json": {"userId": uid(n), "stream": True, "occasion": "party"}}), stream=True),
+        Scenario("voice", lambda n: ("POST", "/api/voice", {"json": {"userId": uid(n), "text": voice_texts[n % len(voice_texts)]}})),
+        Scenario("voice_stream", lambda n: ("POST", "/api/voice", {"json": {"userId": uid(n), "text": voice_texts[n % len(voice_texts)], "stream": True}}), stream=True),
+        Scenario("metrics", lambda n: ("GET", "/metrics", {})),
+    ]
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: List[float], ttfb: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    stats = {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "max_ms": ms(values[-1]) if values else None,
+    }
+    if ttfb:
+        first = sorted(ttfb)
+        stats.update(ttfb_p50_ms=ms(percentile(first, 0.50)), ttfb_p95_ms=ms(percentile(first, 0.95)))
+    return stats
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int) -> Dict[str, Any]:
+    counter = itertools.count()
+    latencies: List[float] = []
+    ttfb: List[float] = []
+    errors = 0
+    first_error: Optional[str] = None
+
+    async def worker():
+        nonlocal errors, first_error
+        while True:
+            n = next(counter)
+            if n >= requests:
+                return
+            method, path, kwargs = scenario.build(n)
+            record = kwargs.pop("_record", None)
+            start = time.perf_counter()
+            try:
+                if scenario.stream:
+                    async with client.stream(method, path, **kwargs) as response:
+                        first = None
+                        async for _ in response.aiter_bytes():
+                            if first is None:
+                                first = time.perf_counter() - start
+                    if first is not None:
+                        ttfb.append(first)
+                else:
+                    response = await client.request(method, path, **kwargs)
+                elapsed = time.perf_counter() - start
+                if response.status_code not in scenario.ok:
+                    raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+                if record is not None:
+                    record(response)
+                latencies.append(elapsed)
+            except Exception as e:
+                errors += 1
+                first_error = first_error or f"{type(e).__name__}: {e}"
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats = summarize(latencies, ttfb, errors, time.perf_counter() - start)
+    if first_error:
+        stats["first_error"] = first_error
+    return stats
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if (await client.get("/metrics")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start in time")
+
+
+async def bench(args) -> Dict[str, Any]:
+    llm = FakeOpenRouter(latency=args.llm_latency, tokens_per_sec=args.tokens_per_sec, tokens=args.reply_tokens, error_rate=args.llm_error_rate)
+    openrouter_url = llm.start(args.llm_port)
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "bench.server",
+            "--port", str(args.port),
+            "--openrouter-url", openrouter_url,
+            "--firestore-latency", str(args.firestore_latency),
+            "--users", str(args.users),
+            "--wardrobe-size", str(args.wardrobe_size),
+            "--history-depth", str(args.history_depth),
+        ],
+        cwd=ROOT,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    results: Dict[str, Any] = {}
+    try:
+        await wait_ready(base_url, server)
+        selected = set(args.scenarios.split(",")) if args.scenarios else None
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            for scenario in scenarios(args.users, args.wardrobe_size):
+                if selected is not None and scenario.name not in selected:
+                    continue
+                results[scenario.name] = await run_scenario(client, scenario, args.requests, args.concurrency)
+                print(f"{scenario.name}: {json.dumps(results[scenario.name])}", file=sys.stderr)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        llm.stop()
+    return {
+        "commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "port", "llm_port")},
+        "llm_requests": llm.requests,
+        "scenarios": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--users", type=int, default=20, help="seeded users the load is spread over")
+    parser.add_argument("--wardrobe-size", type=int, default=100, help="items per seeded wardrobe")
+    parser.add_argument("--history-depth", type=int, default=10, help="chat turns per seeded user")
+    parser.add_argument("--firestore-latency", type=float, default=0.005, help="seconds per Firestore round trip")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds until the first LLM token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80, help="LLM generation speed")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="tokens per LLM reply")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of LLM calls that fail")
+    parser.add_argument("--scenarios", default="", help="comma-separated scenario names (default: all)")
+    parser.add_argument("--timeout", type=float, default=60, help="client timeout in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(bench(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+In-memory stand-in for the subset of the Firestore client API used by main.py.
+
+Documents live in one dict keyed by path tuple. Every round trip (document
+get/set/update/delete, query stream, batch commit) sleeps for ``latency``
+seconds so benchmarks can model a remote database.
+"""
+
+import copy
+import datetime
+import itertools
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+
+Path = Tuple[str, ...]
+
+_ids = itertools.count(1)
+
+
+def _resolve(data: Dict[str, Any]) -> Dict[str, Any]:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {k: now if v is SERVER_TIMESTAMP else copy.deepcopy(v) for k, v in data.items()}
+
+
+def _dig(data: Dict[str, Any], field_path: str) -> Any:
+    for part in field_path.split("."):
+        data = data.get(part) if isinstance(data, dict) else None
+    return data
+
+
+class DocumentSnapshot:
+    def __init__(self, reference: "DocumentReference", data: Optional[Dict[str, Any]], update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str) -> Any:
+        return _dig(self._data or {}, field_path)
+
+
+class DocumentReference:
+    def __init__(self, client: "InMemoryFirestore", path: Path):
+        self._client = client
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name: str) -> "CollectionReference":
+        return CollectionReference(self._client, self.path + (name,))
+
+    def get(self, *args, **kwargs) -> DocumentSnapshot:
+        self._client.round_trip()
+        with self._client.lock:
+            return DocumentSnapshot(self, copy.deepcopy(self._client.docs.get(self.path)), self._client.update_times.get(self.path))
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._client.round_trip()
+        self._client.apply([("set", self, data, merge)])
+
+    def create(self, data: Dict[str, Any]) -> None:
+        self._client.round_trip()
+        self._client.apply([("create", self, data, None)])
+
+    def update(self, data: Dict[str, Any], option: Optional[dict] = None) -> None:
+        self._client.round_trip()
+        self._client.apply([("update", self, data, option)])
+
+    def delete(self) -> None:
+        self._client.round_trip()
+        self._client.apply([("delete", self, None, None)])
+
+
+class Query:
+    def __init__(self, collection: "CollectionReference", filters=(), orders=(), limit=None, fields=None, after=None):
+        self._collection = collection
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._fields = fields
+        self._after = after
+
+    def _copy(self, **changes) -> "Query":
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit, fields=self._fields, after=self._after)
+        state.update(changes)
+        return Query(self._collection, **state)
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, filter=None) -> "Query":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string != "==":
+            raise NotImplementedError(f"Unsupported operator {op_string}")
+        return self._copy(filters=self._filters + ((field_path, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "Query":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "Query":
+        return self._copy(limit=count)
+
+    def select(self, field_paths) -> "Query":
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, values) -> "Query":
+        return self._copy(after=values)
+
+    def stream(self, *args, **kwargs) -> Iterator[DocumentSnapshot]:
+        client = self._collection._client
+        client.round_trip()
+        parent = self._collection.path
+        with client.lock:
+            rows = [(path, copy.deepcopy(data)) for path, data in client.docs.items()
+                    if len(path) == len(parent) + 1 and path[:-1] == parent]
+        for field_path, value in self._filters:
+            rows = [row for row in rows if _dig(row[1], field_path) == value]
+        for field_path, direction in reversed(self._orders or (("__name__", "ASCENDING"),)):
+            if field_path == "__name__":
+                key = lambda row: row[0][-1]
+            else:
+                key = lambda row, f=field_path: (_dig(row[1], f) is None, _dig(row[1], f))
+            rows.sort(key=key, reverse=direction == "DESCENDING")
+        if self._after is not None:
+            after = self._after.get("__name__") if isinstance(self._after, dict) else self._after.id
+            rows = [row for row in rows if row[0][-1] > after]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        for path, data in rows:
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            yield DocumentSnapshot(DocumentReference(client, path), data, client.update_times.get(path))
+
+    def get(self, *args, **kwargs) -> List[DocumentSnapshot]:
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, client: "InMemoryFirestore", path: Path):
+        super().__init__(self)
+        self._client = client
+        self.path = path
+        self.id = path[-1]
+
+    def document(self, document_id: Optional[str] = None) -> DocumentReference:
+        return DocumentReference(self._client, self.path + (document_id or f"doc{next(_ids):010d}",))
+
+    def add(self, data: Dict[str, Any]):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+    def list_documents(self, page_size: Optional[int] = None) -> List[DocumentReference]:
+        with self._client.lock:
+            ids = sorted({p[len(self.path)] for p in self._client.docs if len(p) > len(self.path) and p[: len(self.path)] == self.path})
+        return [self.document(i) for i in ids]
+
+
+class WriteBatch:
+    def __init__(self, client: "InMemoryFirestore"):
+        self._client = client
+        self._ops: list = []
+
+    def set(self, reference: DocumentReference, data: Dict[str, Any], merge: bool = False) -> None:
+        self._ops.append(("set", reference, data, merge))
+
+    def create(self, reference: DocumentReference, data: Dict[str, Any]) -> None:
+        self._ops.append(("create", reference, data, None))
+
+    def update(self, reference: DocumentReference, data: Dict[str, Any], option: Optional[dict] = None) -> None:
+        self._ops.append(("update", reference, data, option))
+
+    def delete(self, reference: DocumentReference) -> None:
+        self._ops.append(("delete", reference, None, None))
+
+    def commit(self) -> list:
+        if len(self._ops) > 500:
+            raise ValueError("maximum 500 writes allowed per request")
+        self._client.round_trip()
+        self._client.apply(self._ops)
+        return []
+
+
+class InMemoryFirestore:
+    """
+    Process-local Firestore client stand-in.
+
+    Args:
+        latency: Seconds slept per round trip
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs: Dict[Path, Dict[str, Any]] = {}
+        self.update_times: Dict[Path, datetime.datetime] = {}
+        self.lock = threading.Lock()
+
+    def round_trip(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def write_option(**kwargs) -> dict:
+        return kwargs
+
+    def apply(self, ops: list) -> None:
+        """Apply writes atomically: preconditions are checked for every op before any is applied."""
+        with self.lock:
+            for op, ref, data, arg in ops:
+                name = "/".join(ref.path)
+                if op == "create" and ref.path in self.docs:
+                    raise AlreadyExists(f"Document already exists: {name}")
+                if op == "update":
+                    if ref.path not in self.docs:
+                        raise NotFound(f"No document to update: {name}")
+                    if arg and "last_update_time" in arg and self.update_times.get(ref.path) != arg["last_update_time"]:
+                        raise FailedPrecondition(f"Document was modified: {name}")
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for op, ref, data, arg in ops:
+                if op == "delete":
+                    self.docs.pop(ref.path, None)
+                    self.update_times.pop(ref.path, None)
+                    continue
+                if op == "update" or (op == "set" and arg and ref.path in self.docs):
+                    self.docs[ref.path].update(_resolve(data))
+                else:
+                    self.docs[ref.path] = _resolve(data)
+                self.update_times[ref.path] = now
+
+    def collection(self, name: str) -> CollectionReference:
+        return CollectionReference(self, (name,))
+
+    def document(self, path: str) -> DocumentReference:
+        return DocumentReference(self, tuple(path.split("/")))
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
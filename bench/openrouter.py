@@ -0,0 +1,79 @@
+"""
+Fake OpenRouter chat-completions server for benchmarks.
+
+Replies take ``latency`` seconds before the first token and then produce
+``tokens`` tokens at ``tokens_per_sec``. Streaming requests get SSE deltas
+as the tokens are "generated"; non-streaming ones wait for the whole reply.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+REPLY_WORDS = "Pair the navy shirt with light chinos and white sneakers for an easy smart casual look".split()
+
+
+class FakeOpenRouter:
+    """
+    Args:
+        latency: Seconds until the first token
+        tokens_per_sec: Generation speed after the first token
+        tokens: Tokens (words) per reply
+        error_rate: Fraction of requests answered with HTTP 500
+    """
+
+    def __init__(self, latency: float = 0.5, tokens_per_sec: float = 50.0, tokens: int = 120, error_rate: float = 0.0):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.requests = 0
+        self._rng = random.Random(0)
+        self.app = Starlette(routes=[Route("/api/v1/chat/completions", self.completions, methods=["POST"])])
+        self._server = None
+
+    def _words(self):
+        return [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(self.tokens)]
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return JSONResponse({"error": {"message": "fake upstream error"}}, status_code=500)
+        step = 1 / self.tokens_per_sec if self.tokens_per_sec else 0
+        words = self._words()
+        if body.get("stream"):
+            async def events():
+                for word in words:
+                    yield "data: " + json.dumps({"choices": [{"delta": {"content": word + " "}}]}) + "\n\n"
+                    if step:
+                        await asyncio.sleep(step)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+        await asyncio.sleep(step * len(words))
+        return JSONResponse({
+            "model": body.get("model"),
+            "choices": [{"message": {"role": "assistant", "content": " ".join(words)}}],
+        })
+
+    def start(self, port: int) -> str:
+        """Serve on 127.0.0.1:``port`` from a background thread; returns the completions URL."""
+        import uvicorn
+
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=self._server.run, name="fake-openrouter", daemon=True).start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{port}/api/v1/chat/completions"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
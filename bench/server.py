@@ -0,0 +1,123 @@
+"""
+Boot main.app against the in-memory Firestore stand-in, seeded with benchmark users.
+
+Run by the harness in its own process (``python -m bench.server``) so the
+load generator does not share a GIL with the server under test.
+"""
+
+import argparse
+import datetime
+import os
+
+from bench.firestore import InMemoryFirestore
+
+ITEM_TYPES = ["shirt", "pants", "dress", "skirt", "jacket", "sweater", "shoes", "accessory"]
+ITEM_COLORS = ["black", "white", "navy", "blue", "red", "green", "beige", "grey", "pink", "brown"]
+ITEM_NATURES = ["casual", "formal", "business", "party", "sport", "elegant"]
+ITEM_MATERIALS = ["cotton", "wool", "denim", "leather", "silk", "linen"]
+ITEM_BRANDS = ["Zara", "H&M", "Uniqlo", "Nike", "Levi's", "Mango", "COS"]
+
+
+def user_id(index: int) -> str:
+    return f"bench-user-{index}"
+
+
+def item_id(user_index: int, index: int) -> str:
+    return f"item-{user_index}-{index}"
+
+
+def wardrobe_item(user_index: int, index: int) -> dict:
+    """Deterministic wardrobe item; the harness uses the same function to build request bodies."""
+    n = user_index * 7919 + index
+    return {
+        "userId": user_id(user_index),
+        "type": ITEM_TYPES[n % len(ITEM_TYPES)],
+        "color": ITEM_COLORS[(n // 3) % len(ITEM_COLORS)],
+        "nature": ITEM_NATURES[(n // 5) % len(ITEM_NATURES)],
+        "imageUrl": f"https://example.com/{user_index}/{index}.jpg",
+        "material": ITEM_MATERIALS[(n // 7) % len(ITEM_MATERIALS)],
+        "brand": ITEM_BRANDS[(n // 11) % len(ITEM_BRANDS)],
+        "size": "M",
+    }
+
+
+def questionnaire(user_index: int) -> dict:
+    return {
+        "userId": user_id(user_index),
+        "gender": "female" if user_index % 2 else "male",
+        "age": "25-34",
+        "skinColor": "medium",
+        "faceType": "oval",
+        "bodyType": "athletic",
+        "hairStyle": "short",
+        "favoriteBrand": ITEM_BRANDS[user_index % len(ITEM_BRANDS)],
+        "nationality": "IN",
+        "favoriteColors": ["navy", "white"],
+        "favoriteAccessories": "watch",
+        "favoriteStyle": ITEM_NATURES[user_index % len(ITEM_NATURES)],
+        "occupation": "engineer",
+    }
+
+
+def seed(db: InMemoryFirestore, users: int, wardrobe_size: int, history_depth: int) -> None:
+    from utils import normalize_wardrobe_facets
+
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for u in range(users):
+        uid = user_id(u)
+        for i in range(wardrobe_size):
+            item = wardrobe_item(u, i)
+            db.docs[("wardrobes", uid, "items", item_id(u, i))] = {**item, "normalized": normalize_wardrobe_facets(item)}
+        db.docs[("users", uid, "profile", "questionnaire")] = questionnaire(u)
+        for t in range(history_depth):
+            created = start + datetime.timedelta(minutes=t)
+            for offset, role in enumerate(("user", "assistant")):
+                content = f"What should I wear today? ({t})" if role == "user" else f"Try the navy shirt with beige chinos. ({t})"
+                db.docs[("users", uid, "chatHistory", f"msg-{t:05d}-{offset}")] = {
+                    "role": role, "content": content, "createdAt": created, "seq": t * 2 + offset,
+                }
+
+
+def load_app(db: InMemoryFirestore, openrouter_url: str):
+    """Import main with Firebase initialization routed to ``db``."""
+    os.environ.update({
+        "FIREBASE_CREDENTIALS": "{}",
+        "ALLOW_MOCK_TOKENS": "true",
+        "OPENROUTER_URL": openrouter_url,
+        "OPENROUTER_API_KEY": "bench",
+    })
+    # Benchmarks drive a few users hard; per-user and per-IP limits would turn most requests into 429s
+    os.environ.setdefault("RATE_LIMIT_USER_PER_MIN", "0")
+    os.environ.setdefault("RATE_LIMIT_IP_PER_MIN", "0")
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: firebase_admin._apps.setdefault("[DEFAULT]", object())
+    firestore.client = lambda *args, **kwargs: db
+    import main
+
+    return main.app
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--openrouter-url", required=True)
+    parser.add_argument("--firestore-latency", type=float, default=0.005)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--wardrobe-size", type=int, default=100)
+    parser.add_argument("--history-depth", type=int, default=10)
+    args = parser.parse_args()
+
+    db = InMemoryFirestore(latency=args.firestore_latency)
+    seed(db, args.users, args.wardrobe_size, args.history_depth)
+    app = load_app(db, args.openrouter_url)
+
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+
+class CacheBackend:
+    """
+    Minimal async key/value interface shared by every cache backend.
+
+    Values must be JSON-serializable so that in-process and shared backends
+    are interchangeable. Keys written with a ``group`` can be dropped
+    together with ``delete_group``, without scanning the keyspace.
+    """
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, group: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def delete_group(self, group: str) -> int:
+        raise NotImplementedError
+
+
+class InMemoryCache(CacheBackend):
+    """
+    Process-local LRU cache with per-entry TTL.
+
+    Args:
+        max_entries: Number of entries kept before the least recently used is evicted
+        default_ttl: TTL in seconds used when ``set`` is called without one
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._groups: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _drop(self, key: str) -> None:
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            members = self._groups.get(entry[2])
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._groups[entry[2]]
+
+    def _set(self, key: str, value: Any, ttl: Optional[float] = None, group: Optional[str] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (value, expires_at, group)
+            if group is not None:
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self._get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, group: Optional[str] = None) -> None:
+        self._set(key, value, ttl, group)
+
+    async def delete(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    async def delete_group(self, group: str) -> int:
+        with self._lock:
+            keys = list(self._groups.get(group, ()))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    """
+    Shared cache backed by Redis, so every worker and replica sees the same entries.
+
+    Requires the optional ``redis`` package (``pip install redis``). Each
+    group is a Redis set of its member keys, so ``delete_group`` costs one
+    ``SMEMBERS`` and one ``DEL`` however large the shared keyspace is. The set
+    expires with its newest member; members that expired on their own are
+    simply skipped by the ``DEL``.
+
+    Args:
+        url: Redis connection URL, e.g. ``redis://localhost:6379/0``
+        namespace: Prefix applied to every key written by this backend
+        default_ttl: TTL in seconds used when ``set`` is called without one
+    """
+
+    def __init__(self, url: str, namespace: str = "stylo:", default_ttl: Optional[float] = None):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RedisCache requires the 'redis' package: pip install redis") from e
+        self._redis = redis.from_url(url)
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._redis.get(self.namespace + key)
+        return json.loads(raw) if raw is not None else None
+
+    def _group_key(self, group: str) -> str:
+        return f"{self.namespace}group:{group}"
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, group: Optional[str] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        px = int(ttl * 1000) if ttl else None
+        if group is None:
+            await self._redis.set(self.namespace + key, json.dumps(value), px=px)
+            return
+        group_key = self._group_key(group)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.namespace + key, json.dumps(value), px=px)
+            pipe.sadd(group_key, self.namespace + key)
+            if px:
+                # Each new member pushes the set's expiry out to its own; members of a group share a TTL
+                pipe.pexpire(group_key, px)
+            await pipe.execute()
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self.namespace + key)
+
+    async def delete_group(self, group: str) -> int:
+        group_key = self._group_key(group)
+        keys = list(await self._redis.smembers(group_key))
+        await self._redis.delete(*keys, group_key)
+        return len(keys)
+
+
+def cache_from_url(url: Optional[str], max_entries: int = 1024, default_ttl: Optional[float] = None) -> CacheBackend:
+    """
+    Build a cache backend from a URL.
+
+    Args:
+        url: ``memory://`` (or empty) for an in-process cache, ``redis://...`` for a shared one
+        max_entries: LRU bound for the in-process backend
+        default_ttl: Default TTL in seconds
+
+    Returns:
+        The configured backend
+    """
+    if not url or url.startswith("memory://"):
+        return InMemoryCache(max_entries=max_entries, default_ttl=default_ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url, default_ttl=default_ttl)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+
+def wardrobe_digest(wardrobe_items: List[Dict[str, Any]], model: str, questionnaire: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Stable content hash of a cleaned wardrobe, the user's questionnaire and the model that will read it.
+
+    Item order and key order do not affect the digest, so the same wardrobe
+    always maps to the same cache entry regardless of how Firestore streams it.
+    """
+    items = sorted(json.dumps(item, sort_keys=True, separators=(",", ":")) for item in wardrobe_items)
+    payload = json.dumps({"model": model, "items": items, "questionnaire": questionnaire}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RecommendationCache:
+    """
+    Caches outfit recommendations per user, keyed on the wardrobe content hash.
+
+    Entries are stored as ``recommend:{userId}:{digest}`` in the group
+    ``recommend:{userId}``, so a user's entries can be dropped together when
+    their wardrobe changes.
+    A recommendation is either reply text or a list of structured outfit dicts.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: Optional[float] = 3600):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def key(userId: str, digest: str) -> str:
+        return f"recommend:{userId}:{digest}"
+
+    async def get(self, userId: str, digest: str) -> Optional[Any]:
+        return await self.backend.get(self.key(userId, digest))
+
+    async def set(self, userId: str, digest: str, recommendation: Any) -> None:
+        await self.backend.set(self.key(userId, digest), recommendation, ttl=self.ttl, group=f"recommend:{userId}")
+
+    async def invalidate(self, userId: str) -> None:
+        await self.backend.delete_group(f"recommend:{userId}")
+
+
+class UserContext:
+    """Cached per-user prompt context. ``None`` means "not loaded yet"."""
+
+    __slots__ = ("wardrobe", "questionnaire", "questionnaire_loaded", "history", "summary", "summary_loaded", "expires_at")
+
+    def __init__(self, expires_at: Optional[float]):
+        self.wardrobe: Optional[List[Dict[str, Any]]] = None
+        self.questionnaire: Optional[Dict[str, Any]] = None
+        self.questionnaire_loaded = False
+        self.history: Optional[deque] = None
+        self.summary: Optional[str] = None
+        self.summary_loaded = False
+        self.expires_at = expires_at
+
+
+class UserContextCache:
+    """
+    Bounded, write-through cache of the context ``ai_voice`` needs per user.
+
+    Holds the cleaned wardrobe (with item ids), the questionnaire, the rolling
+    chat summary and a window of the latest chat messages. Users are evicted LRU beyond ``max_users`` and
+    expire after ``ttl`` seconds, which also bounds staleness when another
+    worker writes the same user. Wardrobes larger than ``max_items`` are not
+    cached at all so one huge wardrobe cannot dominate memory.
+
+    Every wardrobe write bumps the user's wardrobe version. A loader takes
+    ``wardrobe_version`` before reading Firestore and passes it to
+    ``set_wardrobe``, which drops the snapshot if a write landed in between.
+
+    Getters return copies; callers may mutate what they receive.
+    """
+
+    def __init__(self, max_users: int = 1000, ttl: Optional[float] = 300, history_window: int = 10, max_items: int = 500):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.history_window = history_window
+        self.max_items = max_items
+        self._users: "OrderedDict[str, UserContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Sequence number of each user's last wardrobe write, kept apart from the entries so
+        # invalidation and eviction do not forget it; forgotten users fall back to _write_floor
+        self._write_seq = 0
+        self._write_floor = 0
+        self._writes: "OrderedDict[str, int]" = OrderedDict()
+
+    def _entry(self, userId: str, create: bool = False) -> Optional[UserContext]:
+        # Caller holds the lock
+        ctx = self._users.get(userId)
+        if ctx is not None and ctx.expires_at is not None and ctx.expires_at <= time.monotonic():
+            del self._users[userId]
+            ctx = None
+        if ctx is None:
+            if not create:
+                return None
+            ctx = UserContext(time.monotonic() + self.ttl if self.ttl else None)
+            self._users[userId] = ctx
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(userId)
+        return ctx
+
+    def _wardrobe_written(self, userId: str) -> None:
+        # Caller holds the lock
+        self._write_seq += 1
+        self._writes[userId] = self._write_seq
+        self._writes.move_to_end(userId)
+        while len(self._writes) > self.max_users * 4:
+            _, seq = self._writes.popitem(last=False)
+            self._write_floor = max(self._write_floor, seq)
+
+    def wardrobe_version(self, userId: str) -> int:
+        """Token to pass to ``set_wardrobe`` for a wardrobe read that starts now."""
+        with self._lock:
+            return self._write_seq
+
+    def get_wardrobe(self, userId: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            ctx = self._entry(userId)
+            if ctx is None or ctx.wardrobe is None:
+                return None
+            return [dict(item) for item in ctx.wardrobe]
+
+    def set_wardrobe(self, userId: str, items: List[Dict[str, Any]], version: Optional[int] = None) -> None:
+        """Cache ``items``, unless ``version`` (from ``wardrobe_version``) predates a write to this wardrobe."""
+        with self._lock:
+            if version is not None and self._writes.get(userId, self._write_floor) > version:
+                return
+            ctx = self._entry(userId, create=True)
+            ctx.wardrobe = [dict(item) for item in items] if len(items) <= self.max_items else None
+
+    def add_wardrobe_item(self, userId: str, item: Dict[str, Any]) -> None:
+        with self._lock:
+            self._wardrobe_written(userId)
+            ctx = self._entry(userId)
+            if ctx is None or ctx.wardrobe is None:
+                return
+            if len(ctx.wardrobe) >= self.max_items:
+                ctx.wardrobe = None
+            else:
+                ctx.wardrobe.append(dict(item))
+
+    def remove_wardrobe_item(self, userId: str, itemId: str) -> None:
+        with self._lock:
+            self._wardrobe_written(userId)
+            ctx = self._entry(userId)
+            if ctx is not None and ctx.wardrobe is not None:
+                ctx.wardrobe = [item for item in ctx.wardrobe if item.get("id") != itemId]
+
+    def get_questionnaire(self, userId: str) -> tuple:
+        """Return ``(loaded, questionnaire)``; a loaded questionnaire may be ``None`` if the user has none."""
+        with self._lock:
+            ctx = self._entry(userId)
+            if ctx is None or not ctx.questionnaire_loaded:
+                return False, None
+            return True, dict(ctx.questionnaire) if ctx.questionnaire is not None else None
+
+    def set_questionnaire(self, userId: str, questionnaire: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            ctx = self._entry(userId, create=True)
+            ctx.questionnaire = dict(questionnaire) if questionnaire is not None else None
+            ctx.questionnaire_loaded = True
+
+    def get_history(self, userId: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            ctx = self._entry(userId)
+            if ctx is None or ctx.history is None:
+                return None
+            return [dict(m) for m in ctx.history]
+
+    def set_history(self, userId: str, messages: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            ctx = self._entry(userId, create=True)
+            ctx.history = deque((dict(m) for m in messages), maxlen=self.history_window)
+
+    def append_history(self, userId: str, messages: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            ctx = self._entry(userId)
+            if ctx is not None and ctx.history is not None:
+                ctx.history.extend(dict(m) for m in messages)
+
+    def get_summary(self, userId: str) -> tuple:
+        """Return ``(loaded, summary)``; a loaded summary is ``None`` until the first compaction."""
+        with self._lock:
+            ctx = self._entry(userId)
+            if ctx is None or not ctx.summary_loaded:
+                return False, None
+            return True, ctx.summary
+
+    def set_summary(self, userId: str, summary: Optional[str]) -> None:
+        with self._lock:
+            ctx = self._entry(userId, create=True)
+            ctx.summary = summary
+            ctx.summary_loaded = True
+
+    def invalidate(self, userId: str) -> None:
+        with self._lock:
+            self._wardrobe_written(userId)
+            self._users.pop(userId, None)
+
+    def __len__(self) -> int:
+        return len(self._users)
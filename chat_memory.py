@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from prompting import estimate_tokens
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain the long-term memory of Stylo, an AI fashion stylist, for one user. "
+    "Merge the earlier summary (if any) with the new messages into one updated summary. "
+    "Keep durable facts: style preferences and dislikes, sizes and fit issues, colours, budget, "
+    "occasions and plans they mentioned, items they own or want, and advice they accepted or rejected. "
+    "Drop greetings, small talk and outfit details that no longer matter. "
+    "Write plain third-person notes, at most {max_words} words. Reply with the summary only."
+)
+
+
+def message_key(message: Dict[str, Any]) -> Tuple[Any, int]:
+    """Chronological sort key: both messages of a turn share ``createdAt``, ``seq`` orders them."""
+    return message.get("createdAt"), message.get("seq", 0)
+
+
+def messages_to_fold(oldest_first: Sequence[Dict[str, Any]], tail: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Select the stored messages a compaction may fold into the summary.
+
+    Args:
+        oldest_first: Oldest stored messages, ascending
+        tail: Newest messages, which stay raw because prompts send them verbatim
+
+    Returns:
+        Messages from ``oldest_first`` that are older than every tail message
+    """
+    if not tail:
+        return []
+    boundary = min(message_key(m) for m in tail)
+    return [m for m in oldest_first if message_key(m) < boundary]
+
+
+def clip_summary(summary: str, max_tokens: int) -> str:
+    """Cut a summary to ``max_tokens`` (estimated) on a word boundary."""
+    summary = summary.strip()
+    if estimate_tokens(summary) <= max_tokens:
+        return summary
+    return summary[: max_tokens * 4].rsplit(" ", 1)[0].rstrip(",;:") + " …"
+
+
+def summary_prompt(previous: Optional[str], messages: Sequence[Dict[str, Any]], max_tokens: int) -> List[Dict[str, str]]:
+    """
+    Chat messages asking the LLM to fold ``messages`` into ``previous``.
+
+    Args:
+        previous: Current rolling summary, or None
+        messages: Messages being folded, oldest first
+        max_tokens: Size the new summary should stay under
+
+    Returns:
+        ``[system, user]`` messages
+    """
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages if m.get("role") and m.get("content"))
+    parts = [f"Earlier summary:\n{previous}" if previous else "Earlier summary: (none)", f"New messages:\n{transcript}"]
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_words=max(20, int(max_tokens * 0.75)))},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
+
+
+class CompactionTracker:
+    """
+    Decides which users' chat histories are worth checking for compaction.
+
+    Each saved turn is recorded; a user becomes due after ``every`` turns in
+    this process, or straight away when ``mark`` is called (e.g. the first
+    time a worker loads their history, so long legacy histories are caught).
+    ``due`` hands out each pending user once. At most ``max_users`` users are
+    tracked; the least recently active are forgotten first.
+
+    Args:
+        every: Turns between compaction checks for a user
+        max_users: Users tracked at once
+    """
+
+    def __init__(self, every: int = 5, max_users: int = 10000):
+        self.every = every
+        self.max_users = max_users
+        self._turns: "OrderedDict[str, int]" = OrderedDict()
+        self._pending: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, userId: str, turns: int = 1) -> None:
+        with self._lock:
+            count = self._turns.pop(userId, 0) + turns
+            if count >= self.every:
+                self._pending[userId] = None
+                count = 0
+            self._turns[userId] = count
+            while len(self._turns) > self.max_users:
+                self._turns.popitem(last=False)
+
+    def mark(self, userId: str) -> None:
+        with self._lock:
+            self._pending[userId] = None
+            while len(self._pending) > self.max_users:
+                self._pending.popitem(last=False)
+
+    def due(self, limit: Optional[int] = None) -> List[str]:
+        """Remove and return up to ``limit`` pending users, oldest first."""
+        with self._lock:
+            users = []
+            while self._pending and (limit is None or len(users) < limit):
+                users.append(self._pending.popitem(last=False)[0])
+            return users
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,38 @@
+"""
+Shared pytest fixtures.
+
+``api`` boots main.app once per session against the in-memory Firestore from
+``bench/`` (see ``bench.server.load_app``). Module-level caches in main
+persist between tests, so each test should use its own user ids.
+"""
+
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def api():
+    from bench.firestore import InMemoryFirestore
+    from bench.server import load_app
+
+    # load_app configures main through the environment; restore it so subprocess checks see a clean one
+    saved = dict(os.environ)
+    db = InMemoryFirestore()
+    try:
+        # Nothing listens on the discard port: tests that reach the LLM get connection errors
+        app = load_app(db, "http://127.0.0.1:9/api/v1/chat/completions")
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    import main
+
+    return main, app, db
+
+
+@pytest.fixture
+def client(api):
+    from fastapi.testclient import TestClient
+
+    with TestClient(api[1]) as test_client:
+        yield test_client
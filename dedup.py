@@ -0,0 +1,268 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """
+    Difference hash of a PIL image.
+
+    The image is reduced to ``(hash_size + 1) x hash_size`` grayscale pixels
+    and each bit records whether a pixel is brighter than its right-hand
+    neighbour, so re-encodes, resizes and small crops of the same photo land
+    within a few bits of each other.
+
+    Args:
+        image: PIL image
+        hash_size: Bits per row; the hash has ``hash_size ** 2`` bits
+
+    Returns:
+        The hash as an integer
+    """
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(path: str, hash_size: int = 8) -> int:
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return dhash(img, hash_size)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes under Hamming distance.
+
+    Lookups within a small radius only descend into children whose edge
+    distance is within ``radius`` of the query's distance to the node, so a
+    search touches a small fraction of the tree. Removal leaves a tombstone;
+    the owner rebuilds once tombstones dominate.
+    """
+
+    __slots__ = ("root", "size", "removed")
+
+    def __init__(self):
+        # node = [hash, keys, children{distance: node}]
+        self.root: Optional[list] = None
+        self.size = 0
+        self.removed = 0
+
+    def add(self, value: int, key: str) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [value, {key}, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].add(key)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, {key}, {}]
+                return
+            node = child
+
+    def discard(self, key: str) -> bool:
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            if key in node[1]:
+                node[1].discard(key)
+                self.removed += 1
+                return True
+            stack.extend(node[2].values())
+        return False
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, str]]:
+        """Return ``(distance, key)`` pairs within ``radius``, closest first."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, key) for key in node[1])
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        found.sort()
+        return found
+
+    def items(self) -> Iterable[Tuple[int, str]]:
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            for key in node[1]:
+                yield node[0], key
+            stack.extend(node[2].values())
+
+
+class ImageHashIndex:
+    """
+    Per-user perceptual-hash index for near-duplicate image detection.
+
+    Each user's hashes live in their own BK-tree, loaded lazily through
+    ``loader(userId) -> [(hash, key), ...]`` (normally the ``imageHash``
+    field of their wardrobe items) and evicted LRU beyond ``max_users``.
+    The loader runs without the index lock, so one user's Firestore read
+    does not hold up lookups for everyone else; a load that overlapped a
+    ``remove`` or ``invalidate`` for the same user is discarded and retried,
+    so a deleted item cannot come back from a stale snapshot.
+
+    Hashes added with ``temporary=True`` (uploads not yet attached to a
+    wardrobe item) expire after ``claim_ttl`` seconds unless ``attach``
+    moves them to the item's id first.
+
+    Args:
+        loader: Returns the existing hashes for a user
+        max_users: Trees kept in memory
+        claim_ttl: Seconds a temporary hash is kept
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Iterable[Tuple[int, str]]],
+        max_users: int = 1000,
+        claim_ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.loader = loader
+        self.max_users = max_users
+        self.claim_ttl = claim_ttl
+        self.clock = clock
+        self._trees: "OrderedDict[str, BKTree]" = OrderedDict()
+        # userId -> {key: (hash, expires_at)} for temporary hashes
+        self._temporary: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        self._lock = threading.Lock()
+        # Sequence number of each user's last remove/invalidate, as in UserContextCache;
+        # users dropped from the bounded history fall back to _write_floor
+        self._write_seq = 0
+        self._write_floor = 0
+        self._writes: "OrderedDict[str, int]" = OrderedDict()
+
+    @contextmanager
+    def _tree(self, userId: str) -> Iterator[BKTree]:
+        """Hold the lock with the user's tree loaded."""
+        loaded, version = None, None
+        while True:
+            with self._lock:
+                tree = self._trees.get(userId)
+                if loaded is not None and self._writes.get(userId, self._write_floor) > version:
+                    # A remove raced with the load: the snapshot may still hold the removed item
+                    loaded = None
+                if tree is None and loaded is not None:
+                    tree = BKTree()
+                    for value, key in loaded:
+                        tree.add(value, key)
+                    self._trees[userId] = tree
+                    while len(self._trees) > self.max_users:
+                        evicted, _ = self._trees.popitem(last=False)
+                        self._temporary.pop(evicted, None)
+                if tree is not None:
+                    self._trees.move_to_end(userId)
+                    yield self._expire(userId, tree)
+                    return
+                version = self._write_seq
+            # Another thread may load the same user meanwhile; whichever finishes first is kept
+            loaded = list(self.loader(userId))
+
+    def _written(self, userId: str) -> None:
+        # Caller holds the lock
+        self._write_seq += 1
+        self._writes[userId] = self._write_seq
+        self._writes.move_to_end(userId)
+        while len(self._writes) > self.max_users * 4:
+            _, seq = self._writes.popitem(last=False)
+            self._write_floor = max(self._write_floor, seq)
+
+    def _expire(self, userId: str, tree: BKTree) -> BKTree:
+        # Caller holds the lock
+        temporary = self._temporary.get(userId)
+        if temporary:
+            now = self.clock()
+            for key in [k for k, (_, expires_at) in temporary.items() if expires_at <= now]:
+                del temporary[key]
+                tree.discard(key)
+            tree = self._compact(userId, tree)
+        return tree
+
+    def _track(self, userId: str, value: int, key: str, temporary: bool) -> None:
+        # Caller holds the lock
+        if temporary:
+            self._temporary.setdefault(userId, {})[key] = (value, self.clock() + self.claim_ttl)
+
+    def find(self, userId: str, value: int, max_distance: int) -> List[Tuple[int, str]]:
+        with self._tree(userId) as tree:
+            return tree.search(value, max_distance)
+
+    def claim(self, userId: str, value: int, key: str, max_distance: int, temporary: bool = False) -> List[Tuple[int, str]]:
+        """
+        Atomically look up near-duplicates and, if there are none, index ``value`` under ``key``.
+
+        Claiming before the upload starts stops two concurrent uploads of the
+        same photo from both passing the check.
+
+        Returns:
+            Matches other than ``key`` itself; empty if the hash was added
+        """
+        with self._tree(userId) as tree:
+            matches = [m for m in tree.search(value, max_distance) if m[1] != key]
+            if not matches:
+                tree.add(value, key)
+                self._track(userId, value, key, temporary)
+            return matches
+
+    def add(self, userId: str, value: int, key: str, temporary: bool = False) -> None:
+        with self._tree(userId) as tree:
+            tree.add(value, key)
+            self._track(userId, value, key, temporary)
+
+    def attach(self, userId: str, value: int, key: str) -> None:
+        """Index ``value`` under wardrobe item ``key``, replacing the temporary claims the upload left for it."""
+        with self._tree(userId) as tree:
+            temporary = self._temporary.get(userId, {})
+            for claim in [k for k, (v, _) in temporary.items() if v == value]:
+                del temporary[claim]
+                tree.discard(claim)
+            tree.add(value, key)
+            self._compact(userId, tree)
+
+    def remove(self, userId: str, key: str) -> None:
+        with self._lock:
+            self._written(userId)
+            self._temporary.get(userId, {}).pop(key, None)
+            tree = self._trees.get(userId)
+            if tree is not None and tree.discard(key):
+                self._compact(userId, tree)
+
+    def _compact(self, userId: str, tree: BKTree) -> BKTree:
+        # Rebuild without tombstoned nodes once they are more than half the tree
+        if tree.removed * 2 > tree.size:
+            fresh = BKTree()
+            for value, key in list(tree.items()):
+                fresh.add(value, key)
+            self._trees[userId] = tree = fresh
+        return tree
+
+    def invalidate(self, userId: str) -> None:
+        with self._lock:
+            self._written(userId)
+            self._trees.pop(userId, None)
+            self._temporary.pop(userId, None)
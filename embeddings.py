@@ -0,0 +1,194 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Item fields that describe what a piece looks like; ids, URLs and sizes carry no similarity signal
+EMBEDDING_FIELDS = ("type", "color", "nature", "material", "brand")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _features(text: str) -> Iterable[Tuple[str, float]]:
+    # Whole words, plus character trigrams so "shirts" still lands near "shirt"
+    for word in _WORD_RE.findall(text.lower()):
+        yield "w:" + word, 1.0
+        padded = f"^{word}$"
+        for i in range(len(padded) - 2):
+            yield "g:" + padded[i:i + 3], 0.5
+
+
+def embed_text(text: str, dim: int = 512) -> np.ndarray:
+    """
+    Embed free text with signed feature hashing over words and character trigrams.
+
+    Args:
+        text: Text to embed
+        dim: Vector size
+
+    Returns:
+        L2-normalized float32 vector (all zeros for text with no words)
+    """
+    slots, weights = [], []
+    for feature, weight in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        slots.append(h % dim)
+        weights.append(weight if h & 0x80000000 else -weight)
+    vec = np.bincount(slots, weights=weights, minlength=dim).astype(np.float32) if slots else np.zeros(dim, np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def embed_item(item: Dict[str, Any], dim: int = 512) -> np.ndarray:
+    """Embed a wardrobe item from its descriptive fields."""
+    return embed_text(" ".join(str(item.get(f) or "") for f in EMBEDDING_FIELDS), dim)
+
+
+class _UserVectors:
+    """One user's item vectors as rows of a contiguous matrix; row i belongs to ids[i]."""
+
+    __slots__ = ("ids", "rows", "matrix")
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+
+    def add(self, itemId: str, vec: np.ndarray) -> None:
+        row = self.rows.get(itemId)
+        if row is None:
+            row = len(self.ids)
+            if row == self.matrix.shape[0]:
+                # Grow geometrically so appends stay amortized O(dim)
+                grown = np.zeros((row * 2, self.matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self.matrix
+                self.matrix = grown
+            self.ids.append(itemId)
+            self.rows[itemId] = row
+        self.matrix[row] = vec
+
+    def remove(self, itemId: str) -> None:
+        row = self.rows.pop(itemId, None)
+        if row is None:
+            return
+        # Move the last row into the hole to keep the live rows contiguous
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+        self.ids.pop()
+
+    def top_k(self, queries: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        n = len(self.ids)
+        if not n:
+            return [[] for _ in range(len(queries))]
+        scores = queries @ self.matrix[:n].T  # (queries, items) cosine similarities
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q in range(len(queries)):
+            order = top[q][np.argsort(-scores[q, top[q]], kind="stable")]
+            results.append([(self.ids[i], float(scores[q, i])) for i in order])
+        return results
+
+
+class WardrobeEmbeddingIndex:
+    """
+    Per-user embedding index over wardrobe items for similarity search.
+
+    Vectors are local hashed word/trigram features (no model, no network),
+    so building an index costs about as much as reading the wardrobe. Each
+    user's vectors live in one contiguous NumPy matrix and every search is a
+    single matrix product. ``sync`` builds or rebuilds from a full wardrobe;
+    ``add`` and ``remove`` keep an already built index current. Users are
+    evicted LRU beyond ``max_users``.
+
+    Args:
+        dim: Embedding size
+        max_users: Users whose matrices are kept in memory
+    """
+
+    def __init__(self, dim: int = 512, max_users: int = 1000):
+        self.dim = dim
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sync(self, userId: str, items: Sequence[Dict[str, Any]]) -> None:
+        """
+        Make the user's index match ``items``, rebuilding only if the item ids differ.
+
+        Args:
+            userId: Wardrobe owner
+            items: Full wardrobe, each item with an ``id``
+        """
+        ids = {item["id"] for item in items}
+        with self._lock:
+            current = self._users.get(userId)
+            if current is not None and current.rows.keys() == ids:
+                self._users.move_to_end(userId)
+                return
+        vectors = _UserVectors(self.dim, capacity=max(16, len(items)))
+        for item in items:
+            vectors.add(item["id"], embed_item(item, self.dim))
+        with self._lock:
+            self._users[userId] = vectors
+            self._users.move_to_end(userId)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def add(self, userId: str, item: Dict[str, Any]) -> None:
+        vec = embed_item(item, self.dim)
+        with self._lock:
+            vectors = self._users.get(userId)
+            # Unbuilt users are indexed on their next sync
+            if vectors is not None:
+                vectors.add(item["id"], vec)
+
+    def remove(self, userId: str, itemId: str) -> None:
+        with self._lock:
+            vectors = self._users.get(userId)
+            if vectors is not None:
+                vectors.remove(itemId)
+
+    def invalidate(self, userId: str) -> None:
+        with self._lock:
+            self._users.pop(userId, None)
+
+    def search(self, userId: str, text: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Items most relevant to ``text``.
+
+        Returns:
+            ``(itemId, cosine)`` pairs, best first; empty if the user is not indexed
+        """
+        return self.search_many(userId, [text], k)[0]
+
+    def search_many(self, userId: str, texts: Sequence[str], k: int = 10) -> List[List[Tuple[str, float]]]:
+        """Batched ``search``: one matrix product for all queries."""
+        queries = np.stack([embed_text(t, self.dim) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        with self._lock:
+            vectors = self._users.get(userId)
+            if vectors is None:
+                return [[] for _ in texts]
+            return vectors.top_k(queries, k)
+
+    def similar(self, userId: str, itemId: str, k: int = 5) -> Optional[List[Tuple[str, float]]]:
+        """
+        Items most similar to one of the user's items, excluding the item itself.
+
+        Returns:
+            ``(itemId, cosine)`` pairs, best first; None if the item is not indexed
+        """
+        with self._lock:
+            vectors = self._users.get(userId)
+            row = vectors.rows.get(itemId) if vectors is not None else None
+            if row is None:
+                return None
+            matches = vectors.top_k(vectors.matrix[row:row + 1], k + 1)[0]
+        return [(other, score) for other, score in matches if other != itemId][:k]
@@ -0,0 +1,246 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from dedup import ImageHashIndex, dhash_file
+from utils import upload_image_to_cloudinary
+
+
+class IngestQueueFull(Exception):
+    """Raised when the ingest pool already holds its maximum number of pending jobs."""
+
+
+def prepare_image(src_path: str, max_side: int = 1600, thumb_side: int = 320) -> tuple:
+    """
+    Normalize an uploaded photo locally before it is sent to Cloudinary.
+
+    Applies the EXIF orientation, converts to RGB, downsizes to ``max_side``
+    and re-encodes as JPEG without metadata (GPS, camera serials). A
+    ``thumb_side`` thumbnail is written next to it.
+
+    Args:
+        src_path: Path of the spooled upload
+        max_side: Longest edge of the main image in pixels
+        thumb_side: Longest edge of the thumbnail in pixels
+
+    Returns:
+        ``(image_path, thumbnail_path)`` temporary JPEG files owned by the caller
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_side, max_side))
+        image_path = src_path + ".jpg"
+        img.save(image_path, "JPEG", quality=85, optimize=True)
+        img.thumbnail((thumb_side, thumb_side))
+        thumb_path = src_path + ".thumb.jpg"
+        img.save(thumb_path, "JPEG", quality=80, optimize=True)
+    return image_path, thumb_path
+
+
+class ImageIngestPool:
+    """
+    Bounded background pool that prepares, uploads and attaches wardrobe photos.
+
+    Uploads are spooled to temporary files by the request handler and handed
+    to ``submit``; request workers return immediately with a job id while at
+    most ``max_workers`` uploads run at once and at most ``max_pending`` wait.
+    Job state lives in a bounded in-memory registry and is mirrored through
+    ``persist_job`` so any worker can answer a status poll.
+
+    With a ``hash_index``, each prepared image is perceptual-hashed before
+    upload; near-duplicates of the user's existing images (within
+    ``duplicate_distance`` bits) are rejected or flagged per job.
+
+    Args:
+        max_workers: Concurrent prepare/upload workers
+        max_pending: Jobs accepted (queued + running) before submit raises IngestQueueFull
+        max_jobs: Finished jobs remembered in memory for polling
+        patch_item: ``(userId, itemId, image)`` callback run after a successful upload
+        persist_job: ``(job)`` callback run on every job state change
+        hash_index: Per-user perceptual-hash index used for duplicate detection
+        duplicate_distance: Largest Hamming distance treated as a duplicate
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_pending: int = 64,
+        max_jobs: int = 1000,
+        patch_item: Optional[Callable[[str, str, Dict[str, Any]], None]] = None,
+        persist_job: Optional[Callable[[Dict[str, Any]], None]] = None,
+        hash_index: Optional[ImageHashIndex] = None,
+        duplicate_distance: int = 6,
+    ):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.patch_item = patch_item
+        self.persist_job = persist_job
+        self.hash_index = hash_index
+        self.duplicate_distance = duplicate_distance
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-ingest")
+        return self._executor
+
+    @staticmethod
+    def spool(fileobj, max_bytes: int, chunk_size: int = 1024 * 1024) -> str:
+        """
+        Copy an upload stream to a temporary file in fixed-size chunks.
+
+        Args:
+            fileobj: Readable binary file object
+            max_bytes: Largest accepted upload
+            chunk_size: Bytes copied per read
+
+        Returns:
+            Path of the temporary file (removed by the job once processed)
+
+        Raises:
+            ValueError: If the upload is larger than ``max_bytes``
+        """
+        fd, path = tempfile.mkstemp(prefix="stylo-upload-")
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise ValueError(f"Image exceeds {max_bytes} bytes")
+                    out.write(chunk)
+        except Exception:
+            os.unlink(path)
+            raise
+        return path
+
+    def submit(
+        self,
+        path: str,
+        userId: str,
+        itemId: Optional[str] = None,
+        filename: Optional[str] = None,
+        on_duplicate: str = "reject",
+    ) -> Dict[str, Any]:
+        """
+        Queue a spooled upload for processing.
+
+        Args:
+            path: Temporary file produced by ``spool``; the pool takes ownership
+            userId: Owner of the wardrobe
+            itemId: Wardrobe item whose ``imageUrl`` should be patched when done
+            filename: Original client filename, informational
+            on_duplicate: ``reject`` (skip the upload), ``flag`` (upload, report matches) or ``allow``
+
+        Returns:
+            The new job record
+
+        Raises:
+            IngestQueueFull: If ``max_pending`` jobs are already queued or running
+        """
+        if not self._slots.acquire(blocking=False):
+            os.unlink(path)
+            raise IngestQueueFull("Image ingest queue is full")
+        job = {
+            "jobId": uuid.uuid4().hex,
+            "userId": userId,
+            "itemId": itemId,
+            "filename": filename,
+            "onDuplicate": on_duplicate,
+            "status": "queued",
+            "createdAt": time.time(),
+        }
+        self._update(job)
+        snapshot = dict(job)
+        try:
+            self.executor.submit(self._run, job, path)
+        except Exception:
+            self._slots.release()
+            os.unlink(path)
+            raise
+        return snapshot
+
+    def get(self, jobId: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(jobId)
+            return dict(job) if job is not None else None
+
+    def _update(self, job: Dict[str, Any], **changes: Any) -> None:
+        job.update(changes, updatedAt=time.time())
+        with self._lock:
+            self._jobs[job["jobId"]] = job
+            self._jobs.move_to_end(job["jobId"])
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        if self.persist_job is not None:
+            try:
+                self.persist_job(dict(job))
+            except Exception as e:
+                print("[ERROR image ingest] persisting job", job["jobId"], e)
+
+    def _run(self, job: Dict[str, Any], path: str) -> None:
+        temp_paths = [path]
+        claimed_key = None
+        try:
+            self._update(job, status="processing")
+            image_path, thumb_path = prepare_image(path)
+            temp_paths += [image_path, thumb_path]
+            image_hash = None
+            if self.hash_index is not None:
+                image_hash = dhash_file(image_path)
+                # Without an item the hash is claimed under the job until POST /api/wardrobe attaches it (or it expires)
+                hash_key = job["itemId"] or f"job:{job['jobId']}"
+                temporary = not job["itemId"]
+                if job["onDuplicate"] == "allow":
+                    self.hash_index.add(job["userId"], image_hash, hash_key, temporary)
+                    matches = []
+                else:
+                    matches = self.hash_index.claim(job["userId"], image_hash, hash_key, self.duplicate_distance, temporary)
+                if matches:
+                    duplicates = [{"duplicateOf": key, "distance": d} for d, key in matches[:5]]
+                    if job["onDuplicate"] == "reject":
+                        self._update(job, status="duplicate", duplicates=duplicates)
+                        return
+                    self.hash_index.add(job["userId"], image_hash, hash_key, temporary)
+                    job["duplicates"] = duplicates
+                claimed_key = hash_key
+            image = upload_image_to_cloudinary(image_path, folder="wardrobe")
+            thumbnail = upload_image_to_cloudinary(thumb_path, folder="wardrobe/thumbnails")
+            result = {**image, "thumbnailUrl": thumbnail["url"]}
+            if image_hash is not None:
+                result["imageHash"] = f"{image_hash:016x}"
+            if job["itemId"] and self.patch_item is not None:
+                self.patch_item(job["userId"], job["itemId"], result)
+            self._update(job, status="done", result=result)
+            claimed_key = None
+        except Exception as e:
+            print("[ERROR image ingest]", job["jobId"], e)
+            if claimed_key is not None:
+                self.hash_index.remove(job["userId"], claimed_key)
+            self._update(job, status="failed", error=str(e))
+        finally:
+            for p in temp_paths:
+                try:
+                    os.unlink(p)
+                except OSError:
+                    pass
+            self._slots.release()
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
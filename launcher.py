@@ -0,0 +1,126 @@
+"""
+Production server for the Stylo API (``python start.py --production``).
+
+Gunicorn supervises one uvicorn worker per available CPU. The app is imported
+once in the master before it forks (``preload_app``), so module code, route
+tables and ``main.preload_shared_data()`` are shared copy-on-write by every
+worker. Clients holding sockets or threads (Firestore, the OpenRouter pool)
+are created lazily, so each worker still opens its own.
+"""
+
+import gc
+import math
+import os
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on: its scheduler affinity, capped by a cgroup v2 CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def event_loop_settings() -> Dict[str, str]:
+    """uvloop and httptools when installed (uvicorn[standard]), else the pure-Python defaults."""
+    return {
+        "loop": "uvloop" if find_spec("uvloop") else "asyncio",
+        "http": "httptools" if find_spec("httptools") else "h11",
+    }
+
+
+class ProductionWorker(UvicornWorker):
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, **event_loop_settings()}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Stop waiting for open connections (e.g. SSE streams) with time left for the lifespan
+        # shutdown (closing pools, finishing accepted uploads) before gunicorn kills the worker
+        self.config.timeout_graceful_shutdown = max(1, int(self.cfg.graceful_timeout * 0.8))
+
+
+def production_settings(host: str, port: int, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Gunicorn settings, tunable through the environment.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind
+        workers: Worker processes; defaults to WEB_CONCURRENCY, then the available CPUs
+
+    Returns:
+        Settings for ``ProductionServer``
+    """
+    return {
+        "bind": f"{host}:{port}",
+        "workers": workers or int(os.getenv("WEB_CONCURRENCY", "0")) or available_cpus(),
+        "worker_class": "launcher.ProductionWorker",
+        "preload_app": True,
+        # Longer than the load balancer's idle timeout, so the proxy (not us) closes idle connections
+        "keepalive": int(os.getenv("KEEP_ALIVE", "65")),
+        "graceful_timeout": int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        # Heartbeat timeout for workers whose event loop is stuck
+        "timeout": int(os.getenv("WORKER_TIMEOUT", "60")),
+        "backlog": int(os.getenv("BACKLOG", "2048")),
+        # Recycle workers after this many requests (0 = never), jittered so they don't restart together
+        "max_requests": int(os.getenv("MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("MAX_REQUESTS_JITTER", "0")),
+        # Proxies whose X-Forwarded-* headers are trusted for client address and scheme
+        "forwarded_allow_ips": os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        "accesslog": "-" if os.getenv("ACCESS_LOG", "false").lower() == "true" else None,
+        "errorlog": "-",
+        "loglevel": os.getenv("LOG_LEVEL", "info"),
+    }
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import main
+
+        main.preload_shared_data()
+        # Keep the collector from touching (and so copying) the preloaded objects in every worker
+        gc.freeze()
+        return main.app
+
+
+def check_ip_rate_limit() -> None:
+    """
+    Turn the per-IP rate limit off when client addresses cannot be trusted.
+
+    Behind a platform proxy every request arrives from the proxy's address
+    unless ``FORWARDED_ALLOW_IPS`` lists it, so one IP bucket would throttle
+    every anonymous client of the worker together. Runs before ``main`` is imported.
+    """
+    if os.getenv("FORWARDED_ALLOW_IPS") is None and float(os.getenv("RATE_LIMIT_IP_PER_MIN", "60")) > 0:
+        print("⚠️  FORWARDED_ALLOW_IPS is not set: client IPs would all be the proxy's, so the per-IP rate limit is off. "
+              "Set it to your proxy range (or '*' if only the proxy can reach this port) to enable it.")
+        os.environ["RATE_LIMIT_IP_PER_MIN"] = "0"
+
+
+def run(host: str, port: int, workers: Optional[int] = None) -> None:
+    check_ip_rate_limit()
+    settings = production_settings(host, port, workers)
+    loop = event_loop_settings()
+    print(f"🏭 {settings['workers']} workers on {settings['bind']} ({loop['loop']} + {loop['http']})")
+    ProductionServer(settings).run()
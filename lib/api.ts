@@ -58,8 +58,40 @@ export const apiClient = {
     return response.data;
   },
 
-  getWardrobe: async (userId: string) => {
-    const response = await api.get(`/api/wardrobe/${userId}`);
+  // Omit `limit` to fetch the whole wardrobe; otherwise follow `nextCursor` until it is null.
+  getWardrobe: async (userId: string, params?: { limit?: number; cursor?: string; fields?: string[] }) => {
+    const response = await api.get(`/api/wardrobe/${userId}`, {
+      params: params && {
+        limit: params.limit,
+        cursor: params.cursor,
+        fields: params.fields?.join(','),
+      },
+    });
+    return response.data;
+  },
+
+  // Server-side photo ingest: returns job ids immediately; poll getImageJob until status is done/failed.
+  uploadWardrobeImages: async (
+    userId: string,
+    files: File[],
+    itemIds: string[] = [],
+    onDuplicate: 'reject' | 'flag' | 'allow' = 'reject',
+  ) => {
+    const form = new FormData();
+    form.append('userId', userId);
+    form.append('onDuplicate', onDuplicate);
+    files.forEach((file, i) => {
+      form.append('files', file);
+      form.append('itemIds', itemIds[i] || '');
+    });
+    const response = await api.post('/api/wardrobe/images', form, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+    });
+    return response.data;
+  },
+
+  getImageJob: async (jobId: string) => {
+    const response = await api.get(`/api/wardrobe/images/${jobId}`);
     return response.data;
   },
 
@@ -70,9 +102,13 @@ export const apiClient = {
   },
 
   // Recommendations
-  getRecommendations: async (userId: string) => {
+  // mode: 'llm' (default), 'fast' (instant rule-based outfits) or 'hybrid' (AI ranks rule-based candidates)
+  getRecommendations: async (
+    userId: string,
+    options: { mode?: 'llm' | 'fast' | 'hybrid'; occasion?: string } = {},
+  ) => {
     // Backend will fetch questionnaire + wardrobe by userId
-    const response = await api.post('/api/recommend', { userId });
+    const response = await api.post('/api/recommend', { userId, ...options });
     return response.data;
   },
 
@@ -81,6 +117,53 @@ export const apiClient = {
     const response = await api.post('/api/voice', { text, userId });
     return response.data;
   },
+
+  // Streams the reply as server-sent events, calling onDelta for each token chunk.
+  // Resolves with the final text once the backend has persisted the turn.
+  streamVoiceMessage: async (text: string, userId: string, onDelta: (delta: string) => void) => {
+    return streamSSE('/api/voice', { text, userId, stream: true }, 'response', onDelta);
+  },
+
+  streamRecommendations: async (userId: string, onDelta: (delta: string) => void) => {
+    return streamSSE('/api/recommend', { userId, stream: true }, 'recommendation', onDelta);
+  },
 };
 
+async function streamSSE(path: string, body: object, resultKey: string, onDelta: (delta: string) => void): Promise<string> {
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  const user = auth.currentUser;
+  if (user && typeof user.getIdToken === 'function') {
+    headers.Authorization = `Bearer ${await user.getIdToken()}`;
+  }
+  const response = await fetch(`${API_BASE_URL}${path}`, { method: 'POST', headers, body: JSON.stringify(body) });
+  if (!response.ok || !response.body) {
+    throw new Error(`Streaming request failed: ${response.status}`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop() || '';
+    for (const raw of events) {
+      let event = 'message';
+      let data = '';
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'error') throw new Error(payload.detail);
+      if (event === 'done') result = payload[resultKey];
+      else if (payload.delta) onDelta(payload.delta);
+    }
+  }
+  return result;
+}
+
 export default api;
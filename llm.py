@@ -0,0 +1,172 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+DEFAULT_OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+
+class LLMError(Exception):
+    """
+    Raised when an OpenRouter completion could not be produced.
+
+    Args:
+        message: What went wrong
+        status: HTTP status of the failed response; None for transport errors and timeouts
+        retry_after: Seconds the upstream asked us to wait (``Retry-After``), if given
+    """
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Transport errors, timeouts, rate limits and upstream failures may succeed on another attempt."""
+        return self.status is None or self.status in (408, 429) or self.status >= 500
+
+
+def response_error(status: int, body: str, headers: httpx.Headers) -> LLMError:
+    try:
+        retry_after = float(headers.get("retry-after", ""))
+    except ValueError:
+        retry_after = None
+    return LLMError(f"OpenRouter returned {status}: {body}", status=status, retry_after=retry_after)
+
+
+class OpenRouterClient:
+    """
+    Async OpenRouter client backed by one pooled, keep-alive HTTP connection pool.
+
+    A single instance is shared by the whole app. The underlying
+    ``httpx.AsyncClient`` is created on first use, so constructing the client
+    at import time costs nothing, and ``max_concurrency`` caps how many
+    completions may be in flight at once.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        model: str,
+        url: str = DEFAULT_OPENROUTER_URL,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        max_concurrency: int = 64,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.url = url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+            )
+        return self._client
+
+    async def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **params: Any,
+    ) -> str:
+        """
+        Request a chat completion and return the assistant message content.
+
+        Args:
+            messages: OpenAI-style chat messages
+            model: Model override, defaults to the client's model
+            timeout: Per-request timeout override in seconds
+            **params: Extra completion parameters (temperature, max_tokens, ...)
+
+        Returns:
+            The assistant reply text
+
+        Raises:
+            LLMError: On transport errors, non-2xx responses or malformed payloads
+        """
+        data = {"model": model or self.model, "messages": messages, **params}
+        request_timeout = httpx.Timeout(timeout, connect=self.connect_timeout) if timeout else httpx.USE_CLIENT_DEFAULT
+        async with self._semaphore:
+            try:
+                resp = await self.client.post(self.url, json=data, timeout=request_timeout)
+            except httpx.HTTPError as e:
+                raise LLMError(f"request to OpenRouter failed: {e!r}") from e
+        if resp.is_error:
+            raise response_error(resp.status_code, resp.text, resp.headers)
+        try:
+            return resp.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMError(f"unexpected OpenRouter response: {resp.text}", status=resp.status_code) from e
+
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **params: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Request a streamed chat completion and yield content deltas as they arrive.
+
+        Args:
+            messages: OpenAI-style chat messages
+            model: Model override, defaults to the client's model
+            timeout: Per-request timeout override in seconds
+            **params: Extra completion parameters (temperature, max_tokens, ...)
+
+        Yields:
+            Non-empty assistant content fragments, in order
+
+        Raises:
+            LLMError: On transport errors, non-2xx responses or malformed events
+        """
+        data = {"model": model or self.model, "messages": messages, "stream": True, **params}
+        request_timeout = httpx.Timeout(timeout, connect=self.connect_timeout) if timeout else httpx.USE_CLIENT_DEFAULT
+        async with self._semaphore:
+            try:
+                async with self.client.stream("POST", self.url, json=data, timeout=request_timeout) as resp:
+                    if resp.is_error:
+                        body = (await resp.aread()).decode(errors="replace")
+                        raise response_error(resp.status_code, body, resp.headers)
+                    async for line in resp.aiter_lines():
+                        # SSE comments (": OPENROUTER PROCESSING") and blank separators carry no data
+                        if not line.startswith("data:"):
+                            continue
+                        payload = line[len("data:"):].strip()
+                        if payload == "[DONE]":
+                            break
+                        try:
+                            delta = json.loads(payload)["choices"][0].get("delta", {}).get("content")
+                        except (ValueError, KeyError, IndexError, TypeError) as e:
+                            raise LLMError(f"unexpected OpenRouter stream event: {payload}", status=resp.status_code) from e
+                        if delta:
+                            yield delta
+            except httpx.HTTPError as e:
+                raise LLMError(f"request to OpenRouter failed: {e!r}") from e
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
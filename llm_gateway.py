@@ -0,0 +1,366 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llm import LLMError, OpenRouterClient
+
+
+class AttemptTimeout(LLMError):
+    """
+    An attempt ran past the gateway's own timeout.
+
+    The model may just be slow on a long completion, so this is not counted
+    as a breaker failure and the same model is not retried.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream keeps failing.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds. It then lets a single probe
+    through (half-open): success closes it, failure opens it again.
+
+    Args:
+        failure_threshold: Consecutive failures that open the breaker
+        reset_timeout: Seconds to stay open before probing
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through (0 when closed)."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def release(self) -> None:
+        """Give back a probe slot taken by ``allow`` for a call that never reached the upstream."""
+        self._probing = False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._probing = False
+
+
+class LatencyWindow:
+    """Latencies of the last ``size`` successful calls, for the hedging threshold."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        if len(self._samples) < max(1, min_samples):
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class LLMGateway:
+    """
+    Retries, circuit breaking, hedging and model failover in front of ``OpenRouterClient``.
+
+    Models are tried in order. Each model gets up to ``max_retries`` retries
+    on retryable errors (transport errors, timeouts, 429 and 5xx), with
+    full-jitter exponential backoff or the upstream's ``Retry-After``. Other
+    errors move straight to the next model. A model whose circuit breaker is
+    open is skipped without a request. When a call has run longer than the
+    model's recent ``hedge_quantile`` latency (time to first token for
+    streams), a second identical request is sent and whichever answers first
+    wins; at most ``hedge_ratio`` of calls are hedged. The whole call,
+    including retries and failover, is bounded by ``deadline`` seconds
+    (``chat_deadline`` for non-streamed completions, which must wait for the
+    whole reply). An attempt that runs past its timeout fails over to the
+    next model without counting against the breaker. A stream is never
+    retried once its first delta has been returned.
+
+    Args:
+        client: Shared OpenRouter client
+        models: Models in order of preference
+        max_retries: Extra attempts per model
+        backoff_base: First backoff in seconds, doubled per retry
+        backoff_max: Cap for a single backoff
+        deadline: Seconds a stream may take in total until its first delta
+        attempt_timeout: Seconds a single stream attempt may wait for its first delta
+        chat_deadline: Seconds a non-streamed completion may take in total
+        chat_attempt_timeout: Seconds a single non-streamed attempt may take
+        breaker_failures: Consecutive failures that open a model's breaker
+        breaker_reset: Seconds a breaker stays open
+        hedge: Send hedged requests
+        hedge_quantile: Latency quantile after which a call is hedged
+        hedge_min_samples: Successful calls needed before a model is hedged
+        hedge_min_delay: Never hedge sooner than this many seconds
+        hedge_ratio: Largest fraction of calls that may be hedged
+        on_event: Called with ``(event, model)`` for retry, hedge, failover, rejected and breaker_open
+    """
+
+    def __init__(
+        self,
+        client: OpenRouterClient,
+        models: Sequence[str],
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 2.0,
+        deadline: float = 20.0,
+        attempt_timeout: float = 10.0,
+        chat_deadline: float = 45.0,
+        chat_attempt_timeout: float = 30.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        hedge_min_delay: float = 0.25,
+        hedge_ratio: float = 0.1,
+        on_event: Optional[Callable[[str, str], None]] = None,
+    ):
+        if not models:
+            raise ValueError("LLMGateway needs at least one model")
+        self.client = client
+        self.models = list(dict.fromkeys(models))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.chat_deadline = chat_deadline
+        self.chat_attempt_timeout = chat_attempt_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_ratio = hedge_ratio
+        self.on_event = on_event
+        self.breakers = {m: CircuitBreaker(breaker_failures, breaker_reset) for m in self.models}
+        self._latency: Dict[Tuple[str, str], LatencyWindow] = {}
+        self._calls = 0
+        self._hedges = 0
+        self._rng = random.Random()
+
+    def _event(self, event: str, model: str) -> None:
+        if self.on_event is not None:
+            self.on_event(event, model)
+
+    def _window(self, model: str, kind: str) -> LatencyWindow:
+        return self._latency.setdefault((model, kind), LatencyWindow())
+
+    def _hedge_delay(self, model: str, kind: str) -> Optional[float]:
+        if not self.hedge or self._hedges >= self.hedge_ratio * self._calls:
+            return None
+        threshold = self._window(model, kind).quantile(self.hedge_quantile, self.hedge_min_samples)
+        return None if threshold is None else max(self.hedge_min_delay, threshold)
+
+    def _backoff(self, attempt: int, error: LLMError) -> float:
+        if error.retry_after is not None:
+            return min(error.retry_after, self.backoff_max)
+        return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record(self, model: str, error: Optional[LLMError]) -> None:
+        breaker = self.breakers[model]
+        # Requests the upstream rejected (400, 401, ...) say nothing about its health
+        if error is None or not error.retryable:
+            breaker.success()
+            return
+        was_open = breaker.opened_at is not None
+        breaker.failure()
+        if not was_open and breaker.opened_at is not None:
+            self._event("breaker_open", model)
+
+    async def _attempts(self, attempt_fn, deadline_seconds: float, attempt_timeout: float):
+        """Run ``attempt_fn(model, timeout)`` through the retry, breaker and failover policy."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + deadline_seconds
+        last_error: Optional[LLMError] = None
+        for index, model in enumerate(self.models):
+            if index:
+                self._event("failover", model)
+            for attempt in range(self.max_retries + 1):
+                breaker = self.breakers[model]
+                if not breaker.allow():
+                    self._event("rejected", model)
+                    last_error = LLMError(f"{model} is unavailable (circuit open)", status=503, retry_after=breaker.retry_after())
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    breaker.release()
+                    raise LLMError(f"no completion within {deadline_seconds:g}s", status=504) from last_error
+                try:
+                    result = await attempt_fn(model, min(attempt_timeout, remaining))
+                except AttemptTimeout as e:
+                    # Slow is not broken: leave the breaker alone and try the next model
+                    breaker.release()
+                    last_error = e
+                    break
+                except LLMError as e:
+                    self._record(model, e)
+                    last_error = e
+                    if not e.retryable or attempt == self.max_retries:
+                        break
+                    delay = self._backoff(attempt, e)
+                    if loop.time() + delay >= deadline:
+                        break
+                    self._event("retry", model)
+                    await asyncio.sleep(delay)
+                    continue
+                except BaseException:
+                    breaker.release()
+                    raise
+                self._record(model, None)
+                return model, result
+        raise last_error
+
+    async def _race(self, model: str, kind: str, start: Callable[[], "asyncio.Future"], timeout: float, discard: Callable[[asyncio.Future], Any]):
+        """Await ``start()``, hedging it with a second ``start()`` once it runs past the model's latency threshold."""
+        self._calls += 1
+        tasks = [start()]
+        try:
+            delay = self._hedge_delay(model, kind)
+            if delay is not None and delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self._hedges += 1
+                    self._event("hedge", model)
+                    tasks.append(start())
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        tasks.remove(task)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                await discard(task)
+
+    async def chat(self, messages: List[Dict[str, Any]], **params: Any) -> str:
+        """
+        Chat completion through the gateway.
+
+        Args:
+            messages: OpenAI-style chat messages
+            **params: Extra completion parameters (temperature, max_tokens, ...)
+
+        Returns:
+            The assistant reply text
+
+        Raises:
+            LLMError: When every model failed, was skipped, or the deadline passed
+        """
+
+        async def attempt(model: str, timeout: float) -> str:
+            async def call() -> str:
+                started = time.monotonic()
+                try:
+                    reply = await asyncio.wait_for(self.client.chat(messages, model=model, **params), timeout)
+                except asyncio.TimeoutError:
+                    raise AttemptTimeout(f"{model} timed out after {timeout:.1f}s") from None
+                self._window(model, "chat").add(time.monotonic() - started)
+                return reply
+
+            async def discard(task: asyncio.Future) -> None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+            return await self._race(model, "chat", lambda: asyncio.ensure_future(call()), timeout, discard)
+
+        return (await self._attempts(attempt, self.chat_deadline, self.chat_attempt_timeout))[1]
+
+    async def stream_chat(self, messages: List[Dict[str, Any]], **params: Any) -> AsyncIterator[str]:
+        """
+        Streamed chat completion through the gateway; retries and failover happen before the first delta.
+
+        Args:
+            messages: OpenAI-style chat messages
+            **params: Extra completion parameters (temperature, max_tokens, ...)
+
+        Yields:
+            Non-empty assistant content fragments, in order
+
+        Raises:
+            LLMError: When no model produced a first delta, or the chosen stream failed part-way
+        """
+        streams: Dict[asyncio.Future, AsyncIterator[str]] = {}
+
+        async def attempt(model: str, timeout: float) -> tuple:
+            def start() -> asyncio.Future:
+                deltas = self.client.stream_chat(messages, model=model, **params)
+                started = time.monotonic()
+
+                async def first() -> Optional[str]:
+                    try:
+                        delta = await asyncio.wait_for(deltas.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        return None
+                    except asyncio.TimeoutError:
+                        raise AttemptTimeout(f"{model} sent no tokens within {timeout:.1f}s") from None
+                    self._window(model, "stream").add(time.monotonic() - started)
+                    return delta
+
+                task = asyncio.ensure_future(first())
+                streams[task] = deltas
+                return task
+
+            async def discard(task: asyncio.Future) -> None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await streams.pop(task).aclose()
+
+            first_delta = await self._race(model, "stream", start, timeout, discard)
+            # Losing and failed attempts were discarded, so only the winner's stream is left
+            (_, deltas), = streams.items()
+            streams.clear()
+            return first_delta, deltas
+
+        model, (first_delta, deltas) = await self._attempts(attempt, self.deadline, self.attempt_timeout)
+        try:
+            if first_delta is None:
+                return
+            yield first_delta
+            try:
+                async for delta in deltas:
+                    yield delta
+            except LLMError as e:
+                self._record(model, e)
+                raise
+        finally:
+            await deltas.aclose()
@@ -1,37 +1,145 @@
 
-from firebase_admin import auth
-from typing import Optional, List
+from typing import Callable, Literal, Optional, List
 import uuid
-from google.cloud.firestore_v1 import SERVER_TIMESTAMP
 import json
-import requests
-import cloudinary
-import cloudinary.uploader
+import hashlib
+import math
+import re
+import asyncio
+import datetime
+import threading
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, BackgroundTasks, Query, Request, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import os
-from pydantic import BaseModel
-import firebase_admin
-from firebase_admin import credentials, firestore
+from pydantic import BaseModel, Field
+from llm import OpenRouterClient, LLMError
+from llm_gateway import LLMGateway
+from ingest import ImageIngestPool, IngestQueueFull
+from dedup import ImageHashIndex
+from cache import RecommendationCache, UserContextCache, cache_from_url, wardrobe_digest
+from prompting import Prompt, PromptBuilder, encode_wardrobe, estimate_tokens
+from outfits import OutfitEngine, Outfit, format_outfits
+from structured import RESPONSE_FORMATS, STRUCTURED_INSTRUCTIONS, OutfitStreamParser, StructuredOutputError, format_structured, outfits_from_engine, parse_outfit_reply, resolve_outfit
+from embeddings import WardrobeEmbeddingIndex
+from chat_memory import CompactionTracker, clip_summary, messages_to_fold, summary_prompt
+from singleflight import SingleFlight
+from ratelimit import AdmissionController, RateLimited, RateLimiter, rate_limit_backend_from_url
+from tokens import TokenCache, TokenVerifier
+from metrics import MetricsMiddleware, registry
+from utils import VALID_WARDROBE_NATURES, VALID_WARDROBE_TYPES, normalize_wardrobe_facets, validate_wardrobe_item
 
 # ---------------- Env + Firebase Init ---------------- #
 load_dotenv()
 
 
-# --- Robust Firebase credentials: support file path or JSON string --- #
-firebase_creds = os.getenv("FIREBASE_CREDENTIALS")
-if not firebase_admin._apps:
-    if firebase_creds and firebase_creds.strip().startswith("{"):
-        cred = credentials.Certificate(json.loads(firebase_creds))
-    else:
-        cred = credentials.Certificate(firebase_creds)
-    firebase_admin.initialize_app(cred)
+# Firebase (and with it gRPC and firebase_admin.auth) is imported and initialized on first use,
+# not at import, so cold starts reach the first request sooner; the lifespan warms it up.
+_firebase_lock = threading.Lock()
+_db = None
+
+def get_firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _firebase_lock:
+        if not firebase_admin._apps:
+            # --- Robust Firebase credentials: support file path or JSON string --- #
+            firebase_creds = os.getenv("FIREBASE_CREDENTIALS")
+            if firebase_creds and firebase_creds.strip().startswith("{"):
+                cred = credentials.Certificate(json.loads(firebase_creds))
+            else:
+                cred = credentials.Certificate(firebase_creds)
+            firebase_admin.initialize_app(cred)
+        return firebase_admin.get_app()
+
+def get_db():
+    """Shared Firestore client, created on the first call."""
+    global _db
+    if _db is None:
+        get_firebase_app()
+        from firebase_admin import firestore
+
+        with _firebase_lock:
+            if _db is None:
+                _db = firestore.client()
+    return _db
 
-db = firestore.client()
+def preload_shared_data() -> None:
+    """
+    Load read-only state in the production launcher before it forks workers (see launcher.py).
+
+    Only module code and the ID-token signing keys are loaded; anything holding sockets or
+    threads (the Firestore client, httpx pools) is still created inside each worker.
+    """
+    import firebase_admin.auth  # noqa: F401
+    from firebase_admin import firestore  # noqa: F401
+    from utils import cloudinary_uploader  # noqa: F401
+
+    try:
+        token_verifier.keys.get()
+    except Exception as e:
+        print("[ERROR startup] preloading ID-token keys:", e)
+
+def warm_up_clients() -> None:
+    try:
+        get_db()
+        import firebase_admin.auth  # noqa: F401
+    except Exception as e:
+        print("[ERROR startup] warming up Firebase:", e)
 
 # ---------------- FastAPI ---------------- #
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in a worker thread so the server starts accepting requests straight away
+    asyncio.get_running_loop().run_in_executor(None, warm_up_clients)
+    compaction = asyncio.create_task(chat_compaction_loop()) if CHAT_COMPACTION_INTERVAL > 0 else None
+    yield
+    if compaction is not None:
+        compaction.cancel()
+    await llm_client.aclose()
+    # Let accepted uploads finish before the worker exits
+    await run_in_threadpool(image_pool.shutdown)
+
+app = FastAPI(lifespan=lifespan)
+
+# ---------------- Metrics ---------------- #
+# Per-process Prometheus metrics, scraped from GET /metrics
+HTTP_SECONDS = registry.histogram(
+    "stylo_http_request_duration_seconds", "Request latency by route template", ("method", "route", "status")
+)
+PHASE_SECONDS = registry.histogram(
+    "stylo_phase_duration_seconds", "Time spent in each request phase", ("phase", "op")
+)
+PROMPT_TOKENS = registry.counter(
+    "stylo_prompt_tokens_total", "Estimated prompt tokens sent to the LLM, by prompt section", ("endpoint", "section")
+)
+LLM_ERRORS = registry.counter("stylo_llm_errors_total", "Failed LLM calls", ("op",))
+LLM_GATEWAY_EVENTS = registry.counter(
+    "stylo_llm_gateway_events_total", "LLM retries, hedged requests, failovers and circuit breaker events", ("event", "model")
+)
+CACHE_REQUESTS = registry.counter("stylo_cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+STRUCTURED_REPLIES = registry.counter(
+    "stylo_structured_replies_total", "Structured (JSON) recommendation replies by parse result", ("result",)
+)
+RATE_LIMITED = registry.counter("stylo_rate_limited_total", "Requests refused with 429, by the limit that refused them", ("reason",))
+
+def span(phase: str, op: str = ""):
+    # Phases: firestore_read, firestore_write, prompt_build, llm, llm_first_token, serialize
+    return PHASE_SECONDS.time(phase=phase, op=op)
+
+def count_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+app.add_middleware(MetricsMiddleware, histogram=HTTP_SECONDS, skip_paths=("/metrics",))
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Enable CORS
 app.add_middleware(
@@ -48,12 +156,38 @@ app.add_middleware(
 # ---------------- Auth ---------------- #
 ALLOW_MOCK_TOKENS = os.getenv("ALLOW_MOCK_TOKENS", "false").lower() == "true"
 
+def firebase_project_id() -> Optional[str]:
+    try:
+        return os.getenv("FIREBASE_PROJECT_ID") or get_firebase_app().project_id
+    except Exception:
+        return None
+
+def verify_id_token_with_firebase(token: str) -> dict:
+    get_firebase_app()
+    from firebase_admin import auth
+
+    return auth.verify_id_token(token)
+
+# Verified tokens are cached until their own `exp`; misses are checked locally against shared,
+# background-refreshed Google public keys (auth.verify_id_token if no project id is known).
+# The project id is resolved on the first miss, not at import.
+token_verifier = TokenVerifier(
+    project_id=firebase_project_id,
+    fallback=verify_id_token_with_firebase,
+    cache=TokenCache(max_entries=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))),
+)
+
+registry.callback(
+    "stylo_auth_token_cache_total", "Verified-token cache lookups by result", "counter", ("result",),
+    lambda: [(("hit",), token_verifier.cache.hits), (("miss",), token_verifier.cache.misses)],
+)
+
 def get_current_user(authorization: str = Header(...)):
     token = authorization.replace("Bearer ", "")
     try:
         if ALLOW_MOCK_TOKENS and token.startswith("mock-token-"):
             return {"uid": token.replace("mock-token-", "")}
-        decoded = auth.verify_id_token(token)
+        decoded = token_verifier.verify(token)
         return decoded
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid auth token: {e}")
@@ -73,13 +207,22 @@ class AddWardrobeItem(BaseModel):
     material: str
     brand: str
     size: str
+    # Perceptual hash returned by the image ingest job, used for duplicate detection
+    imageHash: Optional[str] = Field(None, pattern=r"^[0-9a-f]{16}$")
 
 class RecommendRequest(BaseModel):
     userId: str
+    stream: bool = False
+    # llm: model writes the outfit; fast: rule engine only; hybrid: model ranks the rule engine's candidates
+    mode: Literal["llm", "fast", "hybrid"] = "llm"
+    occasion: Optional[str] = None
+    # text: one free-text recommendation; json: a list of outfits whose items carry wardrobe ids
+    format: Literal["text", "json"] = "text"
 
 class AIRequest(BaseModel):
     userId: str
     text: str
+    stream: bool = False
 
 class QuestionnaireRequest(BaseModel):
     userId: str
@@ -97,47 +240,312 @@ class QuestionnaireRequest(BaseModel):
     occupation: str
 
 # ---------------- Cloudinary ---------------- #
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-)
+# Configured from CLOUDINARY_* on the first upload (utils.cloudinary_uploader)
 
 
 # ---------------- OpenRouter (DeepSeek R1 / GPT-4o) ---------------- #
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "openai/gpt-3.5-turbo")  # safe default
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
 
-def openrouter_chat(messages: list) -> str:
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": OPENROUTER_MODEL,
-        "messages": messages
-    }
+# One pooled, keep-alive client shared by every request in this worker
+llm_client = OpenRouterClient(
+    api_key=OPENROUTER_API_KEY,
+    model=OPENROUTER_MODEL,
+    url=OPENROUTER_URL,
+    timeout=float(os.getenv("OPENROUTER_TIMEOUT", "30")),
+    max_connections=int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20")),
+    max_concurrency=int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "64")),
+)
+
+# Models tried in order when the previous one fails or its circuit breaker is open
+OPENROUTER_FALLBACK_MODELS = [m.strip() for m in os.getenv("OPENROUTER_FALLBACK_MODELS", "").split(",") if m.strip()]
+
+# Retries, per-model circuit breakers, hedged requests and failover; a call gives up after LLM_DEADLINE
+# seconds (until the first token, for streams) instead of waiting out every timeout in turn
+llm_gateway = LLMGateway(
+    llm_client,
+    [OPENROUTER_MODEL, *OPENROUTER_FALLBACK_MODELS],
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+    backoff_base=float(os.getenv("LLM_RETRY_BACKOFF", "0.25")),
+    backoff_max=float(os.getenv("LLM_RETRY_BACKOFF_MAX", "2")),
+    deadline=float(os.getenv("LLM_DEADLINE", "20")),
+    attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", "10")),
+    # Non-streamed completions (structured outfits, summaries) wait for the whole reply, not just the first token
+    chat_deadline=float(os.getenv("LLM_CHAT_DEADLINE", "45")),
+    chat_attempt_timeout=float(os.getenv("LLM_CHAT_ATTEMPT_TIMEOUT", "30")),
+    breaker_failures=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    breaker_reset=float(os.getenv("LLM_BREAKER_RESET", "30")),
+    hedge=os.getenv("LLM_HEDGE", "true").lower() == "true",
+    hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+    hedge_ratio=float(os.getenv("LLM_HEDGE_RATIO", "0.1")),
+    on_event=lambda event, model: LLM_GATEWAY_EVENTS.inc(event=event, model=model),
+)
+
+registry.callback(
+    "stylo_llm_circuit_open", "1 while a model's circuit breaker is rejecting calls", "gauge", ("model",),
+    lambda: [((model,), float(breaker.state == "open")) for model, breaker in llm_gateway.breakers.items()],
+)
+
+def llm_unavailable_message(e: Exception) -> str:
+    return f"Sorry, the AI service is currently unavailable. ({e})"
+
+async def llm_chat(messages: list, op: str, **params) -> str:
+    with span("llm", op):
+        try:
+            return await llm_gateway.chat(messages, **params)
+        except LLMError:
+            LLM_ERRORS.inc(op=op)
+            raise
+
+async def llm_stream(messages: list, op: str, **params):
+    # Records time to first token as well as the full stream duration
+    start = time.perf_counter()
+    first = True
     try:
-        resp = requests.post(OPENROUTER_URL, headers=headers, data=json.dumps(data), timeout=30)
-        if not resp.ok:
-            print("[ERROR openrouter_chat] status:", resp.status_code)
-            print("[ERROR openrouter_chat] response:", resp.text)
-            resp.raise_for_status()
-        result = resp.json()
-        return result["choices"][0]["message"]["content"]
-    except Exception as e:
+        async for delta in llm_gateway.stream_chat(messages, **params):
+            if first:
+                PHASE_SECONDS.observe(time.perf_counter() - start, phase="llm_first_token", op=op)
+                first = False
+            yield delta
+    except LLMError:
+        LLM_ERRORS.inc(op=op)
+        raise
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - start, phase="llm", op=op)
+
+def llm_unavailable_error(e: LLMError) -> HTTPException:
+    # Nothing is stored for a failed call; Retry-After tells the client when the LLM may be back
+    retry_after = max(1, round(e.retry_after)) if e.retry_after is not None else 5
+    return HTTPException(status_code=503, detail=llm_unavailable_message(e), headers={"Retry-After": str(retry_after)})
+
+# ---------------- Request Coalescing ---------------- #
+# Concurrent identical requests (double-clicks, client retries) share one upstream call in this worker
+llm_flight = SingleFlight("llm")
+wardrobe_flight = SingleFlight("wardrobe")
+
+def flight_key(op: str, userId: str, messages: list) -> str:
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{op}:{userId}:{digest}"
+
+# ---------------- Rate Limiting ---------------- #
+# Token buckets for the AI endpoints, per client IP and per verified uid (0 per minute disables a limit).
+# memory:// keeps buckets per worker; redis://... shares them between workers and replicas
+rate_limiter = RateLimiter(
+    rate_limit_backend_from_url(os.getenv("RATE_LIMIT_URL", "memory://")),
+    {
+        "ip": (float(os.getenv("RATE_LIMIT_IP_PER_MIN", "60")), float(os.getenv("RATE_LIMIT_IP_BURST", "20"))),
+        "user": (float(os.getenv("RATE_LIMIT_USER_PER_MIN", "20")), float(os.getenv("RATE_LIMIT_USER_BURST", "5"))),
+    },
+)
+
+# Caps LLM calls in flight in this worker; excess callers wait briefly in a bounded queue, then get 429
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", os.getenv("OPENROUTER_MAX_CONCURRENCY", "64"))),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT", "2")),
+)
+
+registry.callback(
+    "stylo_llm_admission", "LLM calls holding or waiting for an admission slot", "gauge", ("state",),
+    lambda: [(("active",), admission.active), (("waiting",), admission.waiting)],
+)
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, e: RateLimited):
+    RATE_LIMITED.inc(reason=e.reason)
+    return JSONResponse(status_code=429, content={"detail": str(e)}, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+def verified_uid(authorization: Optional[str]) -> Optional[str]:
+    """Uid of a valid (non-mock) bearer token, else None."""
+    token = (authorization or "").replace("Bearer ", "")
+    if not token or token.startswith("mock-token-"):
+        return None
+    try:
+        return token_verifier.verify(token).get("uid")
+    except Exception:
+        return None
+
+async def check_rate_limits(request: Request) -> None:
+    # The body's userId is unauthenticated, so keying the user bucket on it would let anyone drain
+    # another user's budget. Verified users get only their own bucket: behind a proxy that is not in
+    # FORWARDED_ALLOW_IPS every client shares the proxy's address, and so would share one IP bucket
+    uid = await run_in_threadpool(verified_uid, request.headers.get("authorization"))
+    if uid is not None:
+        await rate_limiter.check(user=uid)
+    else:
+        await rate_limiter.check(ip=request.client.host if request.client else None)
+
+async def admitted_chat(messages: list, op: str, **params) -> str:
+    async with await admission.acquire():
+        return await llm_chat(messages, op, **params)
+
+async def admitted_stream(permit, messages: list, op: str, **params):
+    try:
+        async for delta in llm_stream(messages, op, **params):
+            yield delta
+    finally:
+        permit.release()
+
+async def shared_llm_stream(key: str, messages: list, op: str, **params) -> tuple:
+    """Join the in-flight stream for ``key``, or start one; only a new upstream stream takes an admission slot."""
+    permit = None if llm_flight.in_flight(key) else await admission.acquire()
+    deltas, shared = llm_flight.stream(key, lambda: admitted_stream(permit, messages, op, **params))
+    if shared and permit is not None:
+        # Another request started the same stream while this one waited for a slot
+        permit.release()
+    count_cache("singleflight_llm", shared)
+    return deltas, shared
+
+def count_prompt_tokens(prompt: Prompt, endpoint: str) -> Prompt:
+    for section, tokens in prompt.sections.items():
+        PROMPT_TOKENS.inc(tokens, endpoint=endpoint, section=section)
+    return prompt
+
+# ---------------- Prompt Building ---------------- #
+# Estimated-token budget for each prompt; wardrobe rows and old turns are dropped to fit
+prompt_builder = PromptBuilder(
+    max_tokens=int(os.getenv("PROMPT_TOKEN_BUDGET", "3000")),
+    history_share=float(os.getenv("PROMPT_HISTORY_SHARE", "0.35")),
+)
+
+# ---------------- Outfit Engine ---------------- #
+# Rule-based outfits: mode=fast, candidates for mode=hybrid, and the fallback when the LLM is unavailable
+outfit_engine = OutfitEngine()
+OUTFIT_CANDIDATES = int(os.getenv("OUTFIT_CANDIDATES", "3"))
+
+# ---------------- Structured Output ---------------- #
+# format=json asks for outfits as JSON: json_schema (strict schema), json_object (any JSON) or none (prompt only)
+OPENROUTER_RESPONSE_FORMAT = os.getenv("OPENROUTER_RESPONSE_FORMAT", "json_schema")
+STRUCTURED_PARAMS = {"response_format": RESPONSE_FORMATS[OPENROUTER_RESPONSE_FORMAT]} if OPENROUTER_RESPONSE_FORMAT in RESPONSE_FORMATS else {}
+# Times an unusable JSON reply is sent back to the model with the parse error before falling back to the rule engine
+STRUCTURED_RETRIES = int(os.getenv("STRUCTURED_RETRIES", "1"))
+
+# ---------------- Precomputed Recommendations ---------------- #
+# Written off-peak by batch.py; served while the wardrobe and profile are unchanged and the result is younger than this
+PRECOMPUTED_MAX_AGE_HOURS = float(os.getenv("PRECOMPUTED_MAX_AGE_HOURS", "36"))
+
+# ---------------- Recommendation Cache ---------------- #
+# RECOMMENDATION_CACHE_URL: memory:// (per worker) or redis://... (shared across workers)
+recommendation_cache = RecommendationCache(
+    cache_from_url(
+        os.getenv("RECOMMENDATION_CACHE_URL", "memory://"),
+        max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024")),
+    ),
+    ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "3600")),
+)
+
+# ---------------- User Context Cache ---------------- #
+# Wardrobe, questionnaire and recent chat per user, kept current by the write endpoints
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "10"))
+# "sync" waits for the chatHistory batch commit; "background" commits after the response is sent
+CHAT_HISTORY_WRITE_MODE = os.getenv("CHAT_HISTORY_WRITE_MODE", "sync").lower()
+context_cache = UserContextCache(
+    max_users=int(os.getenv("USER_CONTEXT_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("USER_CONTEXT_CACHE_TTL", "300")),
+    history_window=CHAT_HISTORY_WINDOW,
+    max_items=int(os.getenv("USER_CONTEXT_MAX_ITEMS", "500")),
+)
+
+# ---------------- Chat Memory ---------------- #
+# chatHistory messages older than the last CHAT_HISTORY_WINDOW are folded into one rolling summary
+# doc per user by a background job, so /api/voice reads one doc plus a short tail however long
+# the conversation gets, and the chatHistory collection stays small
+CHAT_COMPACT_MIN_MESSAGES = int(os.getenv("CHAT_COMPACT_MIN_MESSAGES", "10"))
+# At most this many messages are folded per run; archiving costs two writes each and the
+# whole compaction is one batch (500 writes max, one of them the summary)
+CHAT_COMPACT_BATCH = min(int(os.getenv("CHAT_COMPACT_BATCH", "200")), 249)
+CHAT_COMPACTION_INTERVAL = float(os.getenv("CHAT_COMPACTION_INTERVAL", "30"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+# Folded messages move to chatArchive with an `expireAt` for a Firestore TTL policy; 0 deletes them instead
+CHAT_ARCHIVE_TTL_DAYS = float(os.getenv("CHAT_ARCHIVE_TTL_DAYS", "30"))
+compaction_tracker = CompactionTracker(every=int(os.getenv("CHAT_COMPACT_EVERY_TURNS", "5")))
+
+# ---------------- Wardrobe Embeddings ---------------- #
+# Per-user vector index used to send only the items relevant to a chat message
+wardrobe_index = WardrobeEmbeddingIndex(
+    dim=int(os.getenv("WARDROBE_EMBEDDING_DIM", "512")),
+    max_users=int(os.getenv("WARDROBE_INDEX_USERS", "1000")),
+)
+VOICE_WARDROBE_TOP_K = int(os.getenv("VOICE_WARDROBE_TOP_K", "20"))
+# Below this cosine the best match is noise (e.g. "what should I wear to a wedding" names no item field)
+VOICE_WARDROBE_MIN_SCORE = float(os.getenv("VOICE_WARDROBE_MIN_SCORE", "0.2"))
+
+# ---------------- Streaming (SSE) ---------------- #
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def sse_response(deltas, result_key: str, on_complete=None) -> StreamingResponse:
+    """Forward LLM deltas as server-sent events; `on_complete` runs only once the stream finishes."""
+    async def events():
+        chunks = []
+        try:
+            async for delta in deltas:
+                chunks.append(delta)
+                yield sse_event({"delta": delta})
+        except LLMError as e:
+            print("[ERROR stream]", e)
+            yield sse_event({"detail": llm_unavailable_message(e)}, event="error")
+            return
+        reply = "".join(chunks).strip()
+        if on_complete is not None:
+            await on_complete(reply)
+        yield sse_event({result_key: reply}, event="done")
+    return event_stream(events())
+
+def outfit_sse_response(outfits, state: dict, on_complete=None) -> StreamingResponse:
+    """Send each outfit as an `outfit` event as soon as it is parsed, then a `done` event with all of them."""
+    async def events():
+        sent = []
+        try:
+            async for outfit in outfits:
+                sent.append(outfit)
+                yield sse_event(outfit, event="outfit")
+        except LLMError as e:
+            print("[ERROR stream]", e)
+            yield sse_event({"detail": llm_unavailable_message(e)}, event="error")
+            return
+        source = state.get("source", "llm")
+        if on_complete is not None:
+            await on_complete(sent, source)
+        yield sse_event({"outfits": sent, "source": source}, event="done")
+    return event_stream(events())
+
+def event_stream(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def stream_with_fallback(deltas, fallback: Callable[[], str], state: dict):
+    """Forward LLM deltas; if the LLM fails before sending anything, yield `fallback()` instead and set state["fallback"]."""
+    started = False
+    try:
+        async for delta in deltas:
+            started = True
+            yield delta
+    except LLMError as e:
+        if started:
+            raise
         print("[ERROR openrouter_chat]", e)
-        return f"Sorry, the AI service is currently unavailable. ({e})"
+        state["fallback"] = True
+        yield fallback()
 
 # ---------------- Questionnaire Endpoints ---------------- #
 @app.post("/api/questionnaire")
-def save_questionnaire(req: QuestionnaireRequest):
+async def save_questionnaire(req: QuestionnaireRequest):
     try:
-        doc_ref = db.collection("users").document(req.userId).collection("profile").document("questionnaire")
-        if doc_ref.get().exists:
+        doc_ref = get_db().collection("users").document(req.userId).collection("profile").document("questionnaire")
+        if (await run_in_threadpool(doc_ref.get)).exists:
             raise HTTPException(status_code=409, detail="Questionnaire already submitted for this user.")
-        doc_ref.set(req.dict())
+        with span("firestore_write", "questionnaire"):
+            await run_in_threadpool(doc_ref.set, req.dict())
+        context_cache.set_questionnaire(req.userId, req.dict())
+        # Recommendations are keyed on the profile too; drop any made without it
+        await recommendation_cache.invalidate(req.userId)
         return {"success": True}
     except HTTPException:
         raise
@@ -148,123 +556,902 @@ def save_questionnaire(req: QuestionnaireRequest):
 def get_questionnaire(userId: str, user=Depends(get_current_user)):
     if user["uid"] != userId:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    doc = db.collection("users").document(userId).collection("profile").document("questionnaire").get()
+    doc = get_db().collection("users").document(userId).collection("profile").document("questionnaire").get()
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Not found")
     return doc.to_dict()
 
 # ---------------- Wardrobe Endpoints ---------------- #
 @app.post("/api/wardrobe")
-def add_wardrobe_item(item: AddWardrobeItem):
+async def add_wardrobe_item(item: AddWardrobeItem):
     try:
-        ref = db.collection("wardrobes").document(item.userId).collection("items").document()
-        ref.set(item.dict())
+        ref = get_db().collection("wardrobes").document(item.userId).collection("items").document()
+        # `normalized` holds the lowercased vocabulary values the listing filters query against
+        doc = {**item.dict(exclude_none=True), "normalized": normalize_wardrobe_facets(item.dict())}
+        with span("firestore_write", "wardrobe_item"):
+            await run_in_threadpool(ref.set, doc)
+        await recommendation_cache.invalidate(item.userId)
+        wardrobe_flight.forget(item.userId)
+        context_cache.add_wardrobe_item(item.userId, {**doc, "id": ref.id})
+        wardrobe_index.add(item.userId, {**doc, "id": ref.id})
+        if item.imageHash:
+            # Replaces the upload job's temporary claim, so deleting the item frees the photo again
+            await run_in_threadpool(image_hash_index.attach, item.userId, int(item.imageHash, 16), ref.id)
         return {"id": ref.id, **item.dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding wardrobe item: {str(e)}")
 
+# Firestore caps a batched write at 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+BULK_IMPORT_MAX_ITEMS = int(os.getenv("BULK_IMPORT_MAX_ITEMS", "5000"))
+
+def prepare_bulk_item(raw) -> dict:
+    if not isinstance(raw, dict):
+        raise ValueError("Item must be a JSON object")
+    if not isinstance(raw.get("userId"), str) or not raw["userId"]:
+        raise ValueError("Missing userId")
+    for field in ("type", "color", "nature", "imageUrl"):
+        if not isinstance(raw.get(field, ""), str):
+            raise ValueError(f"{field} must be a string")
+    doc = {
+        "userId": raw["userId"],
+        **validate_wardrobe_item(raw),
+        "material": str(raw.get("material") or ""),
+        "brand": str(raw.get("brand") or ""),
+        "size": str(raw.get("size") or ""),
+    }
+    doc["normalized"] = normalize_wardrobe_facets(doc)
+    return doc
+
+def commit_wardrobe_batch(pending: list) -> None:
+    batch = get_db().batch()
+    for _, ref, doc in pending:
+        batch.set(ref, doc)
+    batch.commit()
+
+async def iter_bulk_items(request: Request):
+    # NDJSON is parsed line by line as it arrives; anything else is read as one JSON array
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+        return
+    try:
+        items = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of wardrobe items")
+    # Refuse an oversized array before anything is written, so the client can split it and retry
+    if len(items) > BULK_IMPORT_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_IMPORT_MAX_ITEMS} items per request")
+    for item in items:
+        yield item
+
+@app.post("/api/wardrobe/bulk")
+async def bulk_add_wardrobe_items(request: Request):
+    results, pending, user_ids = [], [], set()
+
+    async def flush():
+        try:
+            await run_in_threadpool(commit_wardrobe_batch, pending)
+            for index, ref, doc in pending:
+                results.append({"index": index, "id": ref.id})
+                user_ids.add(doc["userId"])
+        except Exception as e:
+            results.extend({"index": index, "error": f"Batch commit failed: {e}"} for index, _, _ in pending)
+        pending.clear()
+
+    index, truncated = -1, False
+    async for raw in iter_bulk_items(request):
+        index += 1
+        if index >= BULK_IMPORT_MAX_ITEMS:
+            # Earlier NDJSON batches may already be committed: stop reading and report what was written
+            truncated = True
+            results.append({"index": index, "error": f"At most {BULK_IMPORT_MAX_ITEMS} items per request; this and later items were not imported"})
+            break
+        try:
+            doc = prepare_bulk_item(json.loads(raw) if isinstance(raw, bytes) else raw)
+        except ValueError as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+        ref = get_db().collection("wardrobes").document(doc["userId"]).collection("items").document()
+        pending.append((index, ref, doc))
+        if len(pending) == FIRESTORE_BATCH_LIMIT:
+            await flush()
+    if pending:
+        await flush()
+
+    for uid in user_ids:
+        await recommendation_cache.invalidate(uid)
+        wardrobe_flight.forget(uid)
+        context_cache.invalidate(uid)
+        wardrobe_index.invalidate(uid)
+    results.sort(key=lambda r: r["index"])
+    created = sum(1 for r in results if "id" in r)
+    return {"created": created, "failed": len(results) - created, "truncated": truncated, "results": results}
+
+WARDROBE_PAGE_MAX = 200
+FIELD_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    invalid = [f for f in names if not FIELD_NAME_RE.match(f)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid field names: {', '.join(invalid)}")
+    # "id" is the document id, not a stored field; it is always returned
+    return [f for f in names if f != "id"]
+
+def parse_wardrobe_filters(**values: Optional[str]) -> dict:
+    filters = {}
+    for field, value in values.items():
+        if value is None:
+            continue
+        normalized = value.lower().strip()
+        if field == "type" and normalized not in VALID_WARDROBE_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid type; expected one of: {', '.join(VALID_WARDROBE_TYPES)}")
+        if field == "nature" and normalized not in VALID_WARDROBE_NATURES:
+            raise HTTPException(status_code=400, detail=f"Invalid nature; expected one of: {', '.join(VALID_WARDROBE_NATURES)}")
+        filters[field] = normalized
+    return filters
+
+def fetch_wardrobe_page(userId: str, limit: Optional[int], cursor: Optional[str], fields: Optional[List[str]], filters: Optional[dict] = None) -> tuple:
+    # Document id order is stable; equality filters on `normalized.*` are served by
+    # the composite indexes in firestore.indexes.json
+    from google.cloud.firestore_v1 import FieldFilter
+
+    query = get_db().collection("wardrobes").document(userId).collection("items")
+    for field, value in (filters or {}).items():
+        query = query.where(filter=FieldFilter(f"normalized.{field}", "==", value))
+    query = query.order_by("__name__")
+    if fields is not None:
+        query = query.select(fields)
+    if cursor:
+        query = query.start_after({"__name__": cursor})
+    if limit is not None:
+        # One extra document tells us whether another page exists without a count query
+        query = query.limit(limit + 1)
+    docs = list(query.stream())
+    next_cursor = None
+    if limit is not None and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = docs[-1].id
+    items = []
+    for doc in docs:
+        d = clean_firestore(doc.to_dict())
+        # Index-only field; returned only when explicitly projected
+        if fields is None or "normalized" not in fields:
+            d.pop("normalized", None)
+        items.append({**d, "id": doc.id})
+    return items, next_cursor
+
 @app.get("/api/wardrobe/{userId}")
-def get_wardrobe(userId: str):
+async def get_wardrobe(
+    userId: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=WARDROBE_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    type: Optional[str] = None,
+    color: Optional[str] = None,
+    nature: Optional[str] = None,
+    brand: Optional[str] = None,
+    material: Optional[str] = None,
+):
+    # Without `limit` the whole wardrobe is returned, as before; `nextCursor` is then always null
+    field_list = parse_fields(fields)
+    filters = parse_wardrobe_filters(type=type, color=color, nature=nature, brand=brand, material=material)
     try:
-        items_ref = db.collection("wardrobes").document(userId).collection("items").stream()
-        wardrobe = [{**item.to_dict(), "id": item.id} for item in items_ref]
-        return {"items": wardrobe}
+        with span("firestore_read", "wardrobe_page"):
+            items, next_cursor = await run_in_threadpool(fetch_wardrobe_page, userId, limit, cursor, field_list, filters)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching wardrobe: {str(e)}")
+    with span("serialize", "wardrobe_page"):
+        payload = {"items": items, "nextCursor": next_cursor}
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def backfill_wardrobe_facets(userId: Optional[str] = None) -> int:
+    """Add `normalized` to items written before it existed, so listing filters can match them."""
+    db = get_db()
+    user_ids = [userId] if userId else [ref.id for ref in db.collection("wardrobes").list_documents()]
+    updated = 0
+    for uid in user_ids:
+        batch, pending = db.batch(), 0
+        for doc in db.collection("wardrobes").document(uid).collection("items").stream():
+            d = doc.to_dict()
+            facets = normalize_wardrobe_facets(d)
+            if d.get("normalized") == facets:
+                continue
+            batch.update(doc.reference, {"normalized": facets})
+            pending += 1
+            if pending == FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                updated, batch, pending = updated + pending, db.batch(), 0
+        if pending:
+            batch.commit()
+            updated += pending
+        context_cache.invalidate(uid)
+    return updated
+
+# ---------------- Image Ingest ---------------- #
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+
+DUPLICATE_IMAGE_DISTANCE = int(os.getenv("DUPLICATE_IMAGE_DISTANCE", "6"))
+# imageJobs docs carry an `expireAt` this far past their last update for a Firestore TTL policy
+IMAGE_JOB_TTL_HOURS = float(os.getenv("IMAGE_JOB_TTL_HOURS", "24"))
+
+def patch_item_image(userId: str, itemId: str, image: dict) -> None:
+    ref = get_db().collection("wardrobes").document(userId).collection("items").document(itemId)
+    patch = {"imageUrl": image["url"], "thumbnailUrl": image["thumbnailUrl"]}
+    if image.get("imageHash"):
+        patch["imageHash"] = image["imageHash"]
+    ref.update(patch)
+    context_cache.invalidate(userId)
+
+def load_image_hashes(userId: str) -> list:
+    # Only the hash field is read, even for large wardrobes
+    docs = get_db().collection("wardrobes").document(userId).collection("items").select(["imageHash"]).stream()
+    hashes = []
+    for doc in docs:
+        value = (doc.to_dict() or {}).get("imageHash")
+        if value:
+            hashes.append((int(value, 16), doc.id))
+    return hashes
+
+def persist_image_job(job: dict) -> None:
+    # Mirrors job state so a poll served by another worker still finds it
+    expireAt = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=IMAGE_JOB_TTL_HOURS)
+    get_db().collection("imageJobs").document(job["jobId"]).set({**job, "expireAt": expireAt})
+
+image_hash_index = ImageHashIndex(
+    load_image_hashes,
+    max_users=int(os.getenv("IMAGE_HASH_INDEX_USERS", "1000")),
+    claim_ttl=float(os.getenv("IMAGE_HASH_CLAIM_TTL", "3600")),
+)
+
+image_pool = ImageIngestPool(
+    max_workers=int(os.getenv("IMAGE_INGEST_WORKERS", "4")),
+    max_pending=int(os.getenv("IMAGE_INGEST_MAX_PENDING", "64")),
+    patch_item=patch_item_image,
+    persist_job=persist_image_job,
+    hash_index=image_hash_index,
+    duplicate_distance=DUPLICATE_IMAGE_DISTANCE,
+)
+
+@app.post("/api/wardrobe/images", status_code=202)
+async def upload_wardrobe_images(
+    userId: str = Form(...),
+    files: List[UploadFile] = File(...),
+    itemIds: List[str] = Form([]),
+    onDuplicate: str = Form("reject"),
+):
+    # itemIds[i], when given and non-empty, is the wardrobe item whose imageUrl files[i] replaces
+    if onDuplicate not in ("reject", "flag", "allow"):
+        raise HTTPException(status_code=400, detail="onDuplicate must be one of: reject, flag, allow")
+    # Files already submitted keep running, so a file that fails is reported in its slot instead of failing the request
+    jobs = []
+    queue_full = None
+    for i, upload in enumerate(files):
+        itemId = itemIds[i] if i < len(itemIds) and itemIds[i] else None
+        try:
+            if queue_full is not None:
+                raise queue_full
+            path = await run_in_threadpool(ImageIngestPool.spool, upload.file, MAX_IMAGE_BYTES)
+            job = await run_in_threadpool(image_pool.submit, path, userId, itemId, upload.filename, onDuplicate)
+        except ValueError as e:
+            job = {"filename": upload.filename, "status": "rejected", "code": 413, "error": str(e)}
+        except IngestQueueFull as e:
+            queue_full = e
+            job = {"filename": upload.filename, "status": "rejected", "code": 503, "error": str(e)}
+        finally:
+            await upload.close()
+        jobs.append(job)
+    if all(job["status"] == "rejected" for job in jobs):
+        # Nothing was accepted: fail the request as a whole so the client can simply retry it
+        first = jobs[0]
+        raise HTTPException(status_code=first["code"], detail=first["error"], headers={"Retry-After": "5"} if first["code"] == 503 else None)
+    return {"jobs": jobs}
+
+@app.get("/api/wardrobe/images/{jobId}")
+async def get_image_job(jobId: str, user=Depends(get_current_user)):
+    job = image_pool.get(jobId)
+    if job is None:
+        doc = await run_in_threadpool(get_db().collection("imageJobs").document(jobId).get)
+        if not doc.exists:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job = doc.to_dict()
+        job.pop("expireAt", None)
+    if user["uid"] != job.get("userId"):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return job
+
 @app.delete("/api/wardrobe/{userId}/{itemId}")
-def delete_wardrobe_item(userId: str, itemId: str):
+async def delete_wardrobe_item(userId: str, itemId: str):
     try:
-        ref = db.collection("wardrobes").document(userId).collection("items").document(itemId)
-        ref.delete()
+        ref = get_db().collection("wardrobes").document(userId).collection("items").document(itemId)
+        with span("firestore_write", "wardrobe_item"):
+            await run_in_threadpool(ref.delete)
+        await recommendation_cache.invalidate(userId)
+        wardrobe_flight.forget(userId)
+        context_cache.remove_wardrobe_item(userId, itemId)
+        await run_in_threadpool(image_hash_index.remove, userId, itemId)
+        wardrobe_index.remove(userId, itemId)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting wardrobe item: {str(e)}")
 
+@app.get("/api/wardrobe/{userId}/{itemId}/similar")
+async def get_similar_wardrobe_items(userId: str, itemId: str, k: int = Query(5, ge=1, le=50)):
+    wardrobe_items = await load_wardrobe(userId)
+    await run_in_threadpool(wardrobe_index.sync, userId, wardrobe_items)
+    matches = wardrobe_index.similar(userId, itemId, k)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    by_id = {item["id"]: item for item in wardrobe_items}
+    return {"items": [{**by_id[other], "score": round(score, 4)} for other, score in matches if other in by_id]}
+
 @app.get("/api/wardrobe/{item_id}")
 def get_wardrobe_item(item_id: str, user=Depends(get_current_user)):
     uid = user["uid"]
-    doc = db.collection("users").document(uid).collection("wardrobe").document(item_id).get()
+    doc = get_db().collection("users").document(uid).collection("wardrobe").document(item_id).get()
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Item not found")
     return doc.to_dict() | {"id": doc.id}
 
+# ---------------- Firestore Helpers ---------------- #
+def clean_firestore(obj):
+    if isinstance(obj, dict):
+        return {k: clean_firestore(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [clean_firestore(v) for v in obj]
+    elif hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    else:
+        return obj
+
+def fetch_wardrobe(userId: str) -> list:
+    with span("firestore_read", "wardrobe"):
+        docs = list(get_db().collection("wardrobes").document(userId).collection("items").stream())
+    with span("serialize", "wardrobe"):
+        return [{**clean_firestore(item.to_dict()), "id": item.id} for item in docs]
+
+def fetch_chat_history(userId: str, limit: int = CHAT_HISTORY_WINDOW) -> list:
+    history_ref = get_db().collection("users").document(userId).collection("chatHistory")
+    with span("firestore_read", "chat_history"):
+        history_docs = [doc.to_dict() for doc in history_ref.order_by("createdAt", direction="DESCENDING").limit(limit).stream()]
+    # Both messages of a turn share createdAt; seq breaks the tie (older docs have none)
+    history_docs.sort(key=lambda d: (d.get("createdAt") is None, d.get("createdAt"), d.get("seq", 0)))
+    messages = []
+    for d in history_docs:
+        if d.get("role") and d.get("content"):
+            messages.append({"role": d["role"], "content": d["content"]})
+    return messages
+
+def chat_summary_ref(userId: str):
+    return get_db().collection("users").document(userId).collection("profile").document("chatSummary")
+
+def fetch_chat_summary(userId: str) -> Optional[str]:
+    with span("firestore_read", "chat_summary"):
+        doc = chat_summary_ref(userId).get()
+    return (doc.to_dict() or {}).get("summary") if doc.exists else None
+
+def fetch_questionnaire(userId: str) -> Optional[dict]:
+    with span("firestore_read", "questionnaire"):
+        doc = get_db().collection("users").document(userId).collection("profile").document("questionnaire").get()
+    return clean_firestore(doc.to_dict()) if doc.exists else None
+
+# Cache-aware loaders: serve from context_cache, fall back to Firestore and fill the cache
+async def load_wardrobe(userId: str) -> list:
+    wardrobe_items = context_cache.get_wardrobe(userId)
+    count_cache("context_wardrobe", wardrobe_items is not None)
+    if wardrobe_items is None:
+        async def fetch() -> list:
+            # A write that lands while Firestore is read makes this snapshot stale; set_wardrobe then drops it
+            version = context_cache.wardrobe_version(userId)
+            items = await run_in_threadpool(fetch_wardrobe, userId)
+            context_cache.set_wardrobe(userId, items, version)
+            return items
+
+        wardrobe_items, shared = await wardrobe_flight.do(userId, fetch)
+        count_cache("singleflight_wardrobe", shared)
+    return wardrobe_items
+
+async def load_chat_history(userId: str) -> list:
+    messages = context_cache.get_history(userId)
+    count_cache("context_history", messages is not None)
+    if messages is None:
+        messages = await run_in_threadpool(fetch_chat_history, userId)
+        context_cache.set_history(userId, messages)
+        # First load in this worker: check for history written before compaction existed
+        compaction_tracker.mark(userId)
+    return messages
+
+async def load_chat_summary(userId: str) -> Optional[str]:
+    loaded, summary = context_cache.get_summary(userId)
+    count_cache("context_summary", loaded)
+    if not loaded:
+        summary = await run_in_threadpool(fetch_chat_summary, userId)
+        context_cache.set_summary(userId, summary)
+    return summary
+
+async def load_questionnaire(userId: str) -> Optional[dict]:
+    loaded, questionnaire = context_cache.get_questionnaire(userId)
+    count_cache("context_questionnaire", loaded)
+    if not loaded:
+        questionnaire = await run_in_threadpool(fetch_questionnaire, userId)
+        context_cache.set_questionnaire(userId, questionnaire)
+    return questionnaire
+
 # ---------------- Outfit Recommendation ---------------- #
+def build_recommend_prompt(wardrobe_items: list, questionnaire: Optional[dict] = None, occasion: Optional[str] = None, structured: bool = False) -> Prompt:
+    outfit = f"{occasion} outfit" if occasion else "outfit"
+    user_text = f"Suggest a complete {outfit} using available items. If something is missing, recommend it."
+    if structured:
+        user_text = f"Suggest {outfit}s for me. {STRUCTURED_INSTRUCTIONS}"
+    return prompt_builder.build(
+        instructions="You are Stylo, a professional AI Fashion Stylist. The client's profile and wardrobe are below.",
+        user_text=user_text,
+        wardrobe=wardrobe_items,
+        questionnaire=questionnaire,
+    )
+
+def build_ranking_prompt(outfits: List[Outfit], questionnaire: Optional[dict] = None) -> Prompt:
+    # The model only ranks and explains pre-built candidates, so the full wardrobe is not sent
+    candidates = "\n".join(f"{i}. {outfit.describe()}" for i, outfit in enumerate(outfits, 1))
+    return prompt_builder.build(
+        instructions="You are Stylo, a professional AI Fashion Stylist. The client's profile is below.",
+        user_text=(
+            f"Candidate {outfits[0].occasion} outfits from my wardrobe:\n{candidates}\n"
+            "Pick the best one for me and explain why in a few sentences. If something is missing, recommend it."
+        ),
+        questionnaire=questionnaire,
+    )
+
+def candidate_items(outfits: List[Outfit]) -> list:
+    # Items used by the rule engine's candidates, once each, for a structured prompt that skips the rest of the wardrobe
+    items = {}
+    for outfit in outfits:
+        for item in outfit.items.values():
+            items.setdefault(item.get("id"), item)
+    return list(items.values())
+
+async def structured_outfits(messages: list, wardrobe_items: list, reply: Optional[str] = None) -> list:
+    """
+    Parse a JSON recommendation into outfits with wardrobe ids.
+
+    Args:
+        messages: Prompt that asked for the JSON
+        wardrobe_items: Rows of the wardrobe table in that prompt (``Prompt.wardrobe_items``)
+        reply: Reply already received (e.g. a finished stream); None to request one
+
+    Returns:
+        Outfit dicts
+
+    Raises:
+        StructuredOutputError: When the reply is still unusable after STRUCTURED_RETRIES repair requests
+    """
+    for attempt in range(STRUCTURED_RETRIES + 1):
+        if reply is None:
+            reply = await admitted_chat(messages, "recommend", **STRUCTURED_PARAMS)
+        try:
+            outfits = [resolve_outfit(o, wardrobe_items).model_dump() for o in parse_outfit_reply(reply)]
+            STRUCTURED_REPLIES.inc(result="parsed")
+            return outfits
+        except StructuredOutputError as e:
+            if attempt == STRUCTURED_RETRIES:
+                STRUCTURED_REPLIES.inc(result="failed")
+                raise
+            STRUCTURED_REPLIES.inc(result="retried")
+            # Show the model its reply and what was wrong with it
+            messages = messages + [
+                {"role": "assistant", "content": reply[:4000]},
+                {"role": "user", "content": f"That reply could not be used ({e}). Reply again with only the JSON object."},
+            ]
+            reply = None
+
+async def stream_outfits(deltas, messages: list, wardrobe_items: list, fallback: Callable[[], list], state: dict):
+    """Yield outfits as the streamed reply completes each one; repair, retry or fall back (state["source"]) if it yields none."""
+    parser = OutfitStreamParser()
+    sent = 0
+    try:
+        async for delta in deltas:
+            for outfit in parser.feed(delta):
+                sent += 1
+                yield resolve_outfit(outfit, wardrobe_items).model_dump()
+        if sent:
+            STRUCTURED_REPLIES.inc(result="parsed")
+            return
+        outfits = await structured_outfits(messages, wardrobe_items, reply=parser.text)
+    except (LLMError, StructuredOutputError, RateLimited) as e:
+        if sent:
+            raise
+        print("[ERROR structured recommendation]", e)
+        state["source"] = "rules"
+        outfits = fallback()
+    for outfit in outfits:
+        yield outfit
+
+def precomputed_ref(userId: str):
+    return get_db().collection("users").document(userId).collection("profile").document("precomputedOutfits")
+
+def precomputed_age(data: dict) -> datetime.timedelta:
+    return datetime.datetime.now(datetime.timezone.utc) - data["createdAt"].replace(tzinfo=datetime.timezone.utc)
+
+def fetch_precomputed(userId: str, digest: str) -> Optional[list]:
+    """Precomputed outfits for ``userId`` if they were made from the wardrobe and profile behind ``digest`` and are still fresh."""
+    with span("firestore_read", "precomputed"):
+        doc = precomputed_ref(userId).get()
+    data = doc.to_dict() if doc.exists else None
+    if not data or data.get("digest") != digest:
+        return None
+    return data["outfits"] if precomputed_age(data) <= datetime.timedelta(hours=PRECOMPUTED_MAX_AGE_HOURS) else None
+
+async def precompute_recommendation(userId: str, refresh_after_hours: float = 20) -> str:
+    """
+    Generate and store the default recommendation for one user (see batch.py).
+
+    Args:
+        userId: User to precompute for
+        refresh_after_hours: Keep an existing result for an unchanged wardrobe and profile until it is this old
+
+    Returns:
+        ``written`` or ``skipped``
+
+    Raises:
+        LLMError, StructuredOutputError: When no usable recommendation could be generated
+    """
+    # Read Firestore directly: this process's context cache may be older than the wardrobe
+    wardrobe_items, questionnaire, snapshot = await asyncio.gather(
+        run_in_threadpool(fetch_wardrobe, userId),
+        run_in_threadpool(fetch_questionnaire, userId),
+        run_in_threadpool(precomputed_ref(userId).get),
+    )
+    if not wardrobe_items and not questionnaire:
+        return "skipped"
+    digest = wardrobe_digest(wardrobe_items, OPENROUTER_MODEL, questionnaire)
+    existing = snapshot.to_dict() if snapshot.exists else None
+    if existing and existing.get("digest") == digest and precomputed_age(existing) < datetime.timedelta(hours=refresh_after_hours):
+        return "skipped"
+    prompt = build_recommend_prompt(wardrobe_items, questionnaire, structured=True)
+    outfits = await structured_outfits(prompt.messages, prompt.wardrobe_items)
+    record = {"digest": digest, "model": OPENROUTER_MODEL, "outfits": outfits, "createdAt": datetime.datetime.now(datetime.timezone.utc)}
+    with span("firestore_write", "precomputed"):
+        await run_in_threadpool(precomputed_ref(userId).set, record)
+    return "written"
+
 @app.post("/api/recommend")
-def recommend_outfit(req: RecommendRequest):
-    def clean_firestore(obj):
-        if isinstance(obj, dict):
-            return {k: clean_firestore(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [clean_firestore(v) for v in obj]
-        elif hasattr(obj, 'isoformat'):
-            return obj.isoformat()
-        else:
-            return obj
+async def recommend_outfit(req: RecommendRequest, request: Request):
     try:
-        # Fetch user's wardrobe
-        items_ref = db.collection("wardrobes").document(req.userId).collection("items").stream()
-        wardrobe_items = [clean_firestore(item.to_dict()) for item in items_ref]
-        prompt = f"""
-You are Stylo, a professional AI Fashion Stylist.\nThe client’s wardrobe: {json.dumps(wardrobe_items)}.\nSuggest a complete outfit using available items. If something is missing, recommend it.\n"""
-        ai_reply = openrouter_chat(prompt)
-        return {"recommendation": ai_reply.strip()}
+        await check_rate_limits(request)
+        # Fetch user's wardrobe and questionnaire concurrently
+        wardrobe_items, questionnaire = await asyncio.gather(
+            load_wardrobe(req.userId),
+            load_questionnaire(req.userId),
+        )
+        # Unchanged wardrobe + profile + model -> serve the previous recommendation without an LLM call
+        digest = wardrobe_digest(wardrobe_items, OPENROUTER_MODEL, questionnaire)
+        index_key = digest
+        structured = req.format == "json"
+
+        def suggest_outfits() -> List[Outfit]:
+            return outfit_engine.suggest(wardrobe_items, questionnaire, req.occasion, k=OUTFIT_CANDIDATES, key=index_key)
+
+        def rule_outfits() -> list:
+            return [o.model_dump() for o in outfits_from_engine(outfits or suggest_outfits())]
+
+        def reply_now(result, source: str):
+            if structured:
+                if req.stream:
+                    async def replay_outfits():
+                        for outfit in result:
+                            yield outfit
+                    return outfit_sse_response(replay_outfits(), {"source": source})
+                return {"outfits": result, "source": source}
+            if req.stream:
+                async def replay():
+                    yield result
+                return sse_response(replay(), "recommendation")
+            return {"recommendation": result, "source": source}
+
+        outfits = suggest_outfits() if req.mode != "llm" else []
+        if req.mode == "fast":
+            return reply_now(rule_outfits() if structured else format_outfits(outfits), "rules")
+
+        with span("prompt_build", "recommend"):
+            if structured:
+                prompt = build_recommend_prompt(candidate_items(outfits) if outfits else wardrobe_items, questionnaire, req.occasion, structured=True)
+            elif outfits:
+                prompt = build_ranking_prompt(outfits, questionnaire)
+            else:
+                prompt = build_recommend_prompt(wardrobe_items, questionnaire, req.occasion)
+        messages = prompt.messages
+        # Mode, occasion and format change the prompt, so they are part of the cache key
+        if req.mode != "llm" or req.occasion or structured:
+            digest = wardrobe_digest(wardrobe_items, f"{OPENROUTER_MODEL}|{req.mode}|{req.occasion or ''}|{req.format}", questionnaire)
+        cached = await recommendation_cache.get(req.userId, digest)
+        count_cache("recommendation", cached is not None)
+        if cached is not None:
+            return reply_now(cached, "cache")
+        # The default request (no occasion, full LLM) is precomputed nightly; answer from that while it is fresh
+        if req.mode == "llm" and not req.occasion:
+            precomputed = await run_in_threadpool(fetch_precomputed, req.userId, index_key)
+            count_cache("precomputed", precomputed is not None)
+            if precomputed is not None:
+                result = precomputed if structured else format_structured(precomputed)
+                await recommendation_cache.set(req.userId, digest, result)
+                return reply_now(result, "precomputed")
+        count_prompt_tokens(prompt, "recommend")
+        key = flight_key("recommend", req.userId, messages)
+
+        if structured:
+            if req.stream:
+                state = {}
+
+                async def cache_outfits(result: list, source: str) -> None:
+                    if source == "llm":
+                        await recommendation_cache.set(req.userId, digest, result)
+
+                deltas, _ = await shared_llm_stream(key, messages, "recommend", **STRUCTURED_PARAMS)
+                return outfit_sse_response(
+                    stream_outfits(deltas, messages, prompt.wardrobe_items, rule_outfits, state),
+                    state,
+                    on_complete=cache_outfits,
+                )
+            try:
+                result, shared = await llm_flight.do(key, lambda: structured_outfits(messages, prompt.wardrobe_items))
+                count_cache("singleflight_llm", shared)
+            except (LLMError, StructuredOutputError) as e:
+                print("[ERROR structured recommendation]", e)
+                return {"outfits": rule_outfits(), "source": "rules"}
+            await recommendation_cache.set(req.userId, digest, result)
+            return {"outfits": result, "source": "llm"}
+
+        # If the LLM is unavailable the rule engine answers instead of an apology
+        fallback = lambda: format_outfits(outfits or suggest_outfits())
+        if req.stream:
+            state = {}
+
+            async def cache_reply(reply: str) -> None:
+                if not state.get("fallback"):
+                    await recommendation_cache.set(req.userId, digest, reply)
+
+            deltas, _ = await shared_llm_stream(key, messages, "recommend")
+            return sse_response(
+                stream_with_fallback(deltas, fallback, state),
+                "recommendation",
+                on_complete=cache_reply,
+            )
+        try:
+            ai_reply, shared = await llm_flight.do(key, lambda: admitted_chat(messages, "recommend"))
+            ai_reply = ai_reply.strip()
+            count_cache("singleflight_llm", shared)
+        except LLMError as e:
+            # Fallback outfits are returned to the client but never cached
+            print("[ERROR openrouter_chat]", e)
+            return {"recommendation": fallback(), "source": "rules"}
+        await recommendation_cache.set(req.userId, digest, ai_reply)
+        return {"recommendation": ai_reply, "source": "llm"}
+    except RateLimited:
+        raise
     except Exception as e:
         import traceback
         print("[ERROR /api/recommend]", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"AI recommendation failed: {e}")
 
 # ---------------- Conversational AI ---------------- #
+async def relevant_wardrobe_items(userId: str, wardrobe_items: list, text: str, k: int, max_tokens: int) -> list:
+    # Wardrobes whose table fits the prompt budget are sent whole (the prompt builder ranks and trims them);
+    # larger ones are cut to the k items closest to the message, unless nothing is actually close to it
+    if len(wardrobe_items) <= k or estimate_tokens(encode_wardrobe(wardrobe_items)) <= max_tokens:
+        return wardrobe_items
+    await run_in_threadpool(wardrobe_index.sync, userId, wardrobe_items)
+    matches = wardrobe_index.search(userId, text, k)
+    if not matches or matches[0][1] < VOICE_WARDROBE_MIN_SCORE:
+        return wardrobe_items
+    by_id = {item["id"]: item for item in wardrobe_items}
+    return [by_id[itemId] for itemId, _ in matches if itemId in by_id]
+
+async def build_voice_prompt(userId: str, text: str) -> Prompt:
+    # Independent reads: summary, history tail, wardrobe and questionnaire run concurrently,
+    # so pre-LLM latency is the slowest single read rather than the sum
+    summary, history, wardrobe_items, questionnaire = await asyncio.gather(
+        load_chat_summary(userId),
+        load_chat_history(userId),
+        load_wardrobe(userId),
+        load_questionnaire(userId),
+    )
+    with span("prompt_build", "voice"):
+        wardrobe_items = await relevant_wardrobe_items(userId, wardrobe_items, text, VOICE_WARDROBE_TOP_K, prompt_builder.max_tokens)
+        # Wardrobe and profile go in the system prompt, ranked against the new message
+        prompt = prompt_builder.build(
+            instructions="You are Stylo, a professional AI Fashion Stylist. Always consider the user's wardrobe and style profile below when giving advice or outfit suggestions.",
+            user_text=text,
+            wardrobe=wardrobe_items,
+            questionnaire=questionnaire,
+            history=history,
+            query=text,
+            summary=summary,
+        )
+    return count_prompt_tokens(prompt, "voice")
+
+_chat_seq_lock = threading.Lock()
+_last_chat_seq = 0
+
+def next_chat_seq() -> int:
+    # Wall-clock nanoseconds, forced strictly increasing within this process; each turn reserves two values
+    global _last_chat_seq
+    with _chat_seq_lock:
+        _last_chat_seq = max(time.time_ns(), _last_chat_seq + 2)
+        return _last_chat_seq
+
+def write_chat_turn(userId: str, text: str, reply: str, seq: int, now: datetime.datetime) -> None:
+    # Save user and assistant messages to Firestore in one atomic batch (single round trip)
+    try:
+        db = get_db()
+        history_ref = db.collection("users").document(userId).collection("chatHistory")
+        batch = db.batch()
+        batch.set(history_ref.document(), {"role": "user", "content": text, "createdAt": now, "seq": seq})
+        batch.set(history_ref.document(), {"role": "assistant", "content": reply, "createdAt": now, "seq": seq + 1})
+        with span("firestore_write", "chat_turn"):
+            batch.commit()
+    except Exception:
+        import traceback
+        print("[ERROR write_chat_turn]", traceback.format_exc())
+        context_cache.invalidate(userId)
+        raise
+
+async def save_chat_turn(userId: str, text: str, reply: str, background_tasks: Optional[BackgroundTasks] = None) -> None:
+    seq, now = next_chat_seq(), datetime.datetime.utcnow()
+    # The cache is updated first so the next turn sees this one even while a deferred write is pending
+    context_cache.append_history(userId, [{"role": "user", "content": text}, {"role": "assistant", "content": reply}])
+    compaction_tracker.record(userId)
+    if background_tasks is not None and CHAT_HISTORY_WRITE_MODE == "background":
+        background_tasks.add_task(write_chat_turn, userId, text, reply, seq, now)
+    else:
+        await run_in_threadpool(write_chat_turn, userId, text, reply, seq, now)
+
 @app.post("/api/voice")
-def ai_voice(req: AIRequest):
+async def ai_voice(req: AIRequest, request: Request, background_tasks: BackgroundTasks):
     try:
-        # Conversation memory: fetch history from Firestore
-        history_ref = db.collection("users").document(req.userId).collection("chatHistory")
-        # Get last 10 messages (if any)
-        history_docs = list(history_ref.order_by("createdAt", direction=firestore.Query.DESCENDING).limit(10).stream())[::-1]
-        messages = []
-        for doc in history_docs:
-            d = doc.to_dict()
-            if d.get("role") and d.get("content"):
-                messages.append({"role": d["role"], "content": d["content"]})
-        # Fetch user's wardrobe
-        items_ref = db.collection("wardrobes").document(req.userId).collection("items").stream()
-        def clean_firestore(obj):
-            if isinstance(obj, dict):
-                return {k: clean_firestore(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [clean_firestore(v) for v in obj]
-            elif hasattr(obj, 'isoformat'):
-                return obj.isoformat()
-            else:
-                return obj
-        wardrobe_items = []
-        for item in items_ref:
-            d = clean_firestore(item.to_dict())
-            # Remove imageUrl and createdAt fields if present
-            d.pop("imageUrl", None)
-            d.pop("createdAt", None)
-            wardrobe_items.append(d)
-        # Fetch user's questionnaire
-        questionnaire_ref = db.collection("users").document(req.userId).collection("profile").document("questionnaire")
-        questionnaire_doc = questionnaire_ref.get()
-        questionnaire = questionnaire_doc.to_dict() if questionnaire_doc.exists else None
-        # Add system prompt with wardrobe and questionnaire summary
-        system_prompt = {
-            "role": "system",
-            "content": f"You are Stylo, a professional AI Fashion Stylist. The user's wardrobe: {json.dumps(wardrobe_items)}. The user's style preferences and profile: {json.dumps(questionnaire)}. Always consider these when giving advice or outfit suggestions."
-        }
-        messages = [system_prompt] + messages
-        # Add the new user message
-        messages.append({"role": "user", "content": req.text})
+        await check_rate_limits(request)
+        messages = (await build_voice_prompt(req.userId, req.text)).messages
+        # The same message sent again while the first is in flight gets the same reply, and the turn is stored once
+        key = flight_key("voice", req.userId, messages)
+        if req.stream:
+            deltas, shared = await shared_llm_stream(key, messages, "voice")
+
+            async def save_reply(reply: str) -> None:
+                if not shared:
+                    await save_chat_turn(req.userId, req.text, reply, background_tasks)
+
+            # The turn is persisted only after the last delta has been forwarded
+            return sse_response(deltas, "response", on_complete=save_reply)
         # Call OpenRouter with full history
-        ai_reply = openrouter_chat(messages)
-        # Save user and assistant messages to Firestore
-        import datetime
-        now = datetime.datetime.utcnow()
-        history_ref.add({"role": "user", "content": req.text, "createdAt": now})
-        history_ref.add({"role": "assistant", "content": ai_reply, "createdAt": now})
+        try:
+            ai_reply, shared = await llm_flight.do(key, lambda: admitted_chat(messages, "voice"))
+        except LLMError as e:
+            print("[ERROR /api/voice]", e)
+            raise llm_unavailable_error(e)
+        count_cache("singleflight_llm", shared)
+        if not shared:
+            await save_chat_turn(req.userId, req.text, ai_reply, background_tasks)
         return {"response": ai_reply.strip()}
+    except (HTTPException, RateLimited):
+        raise
     except Exception as e:
         import traceback
         print("[ERROR /api/voice]", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"AI generation failed: {e}")
+
+# ---------------- Chat Compaction ---------------- #
+def read_compaction_candidates(userId: str) -> tuple:
+    """Return ``(summary snapshot, messages older than the tail)``, the oldest CHAT_COMPACT_BATCH at most."""
+    history_ref = get_db().collection("users").document(userId).collection("chatHistory")
+    with span("firestore_read", "chat_compaction"):
+        summary_doc = chat_summary_ref(userId).get()
+        tail = [doc.to_dict() for doc in history_ref.order_by("createdAt", direction="DESCENDING").limit(CHAT_HISTORY_WINDOW).stream()]
+        if len(tail) < CHAT_HISTORY_WINDOW:
+            return summary_doc, []
+        oldest = [{**doc.to_dict(), "id": doc.id} for doc in history_ref.order_by("createdAt").limit(CHAT_COMPACT_BATCH).stream()]
+    return summary_doc, messages_to_fold(oldest, tail)
+
+def commit_chat_compaction(userId: str, summary_doc, summary: str, folded: list) -> bool:
+    """Write the new summary and archive (or delete) the folded messages in one batch; False if another worker won."""
+    from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+
+    db = get_db()
+    user_ref = db.collection("users").document(userId)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    last = folded[-1]
+    previous = (summary_doc.to_dict() or {}) if summary_doc.exists else {}
+    data = {
+        "summary": summary,
+        "foldedMessages": previous.get("foldedMessages", 0) + len(folded),
+        "throughCreatedAt": last.get("createdAt"),
+        "throughSeq": last.get("seq", 0),
+        "updatedAt": now,
+    }
+    batch = db.batch()
+    if summary_doc.exists:
+        # Precondition: nobody has rewritten the summary since we read it
+        batch.update(summary_doc.reference, data, option=db.write_option(last_update_time=summary_doc.update_time))
+    else:
+        batch.create(summary_doc.reference, data)
+    for message in folded:
+        message = dict(message)
+        msg_id = message.pop("id")
+        if CHAT_ARCHIVE_TTL_DAYS > 0:
+            message["expireAt"] = now + datetime.timedelta(days=CHAT_ARCHIVE_TTL_DAYS)
+            batch.set(user_ref.collection("chatArchive").document(msg_id), message)
+        batch.delete(user_ref.collection("chatHistory").document(msg_id))
+    try:
+        with span("firestore_write", "chat_compaction"):
+            batch.commit()
+    except (AlreadyExists, FailedPrecondition):
+        return False
+    return True
+
+async def compact_chat_history(userId: str) -> int:
+    """
+    Fold a user's chat messages older than the prompt tail into their rolling summary.
+
+    Runs only once at least CHAT_COMPACT_MIN_MESSAGES are waiting, so each LLM call folds a
+    useful chunk. Nothing is archived unless the new summary was written.
+
+    Args:
+        userId: User whose chatHistory is compacted
+
+    Returns:
+        Number of messages folded (0 if there was too little to fold or another worker did it)
+    """
+    summary_doc, folded = await run_in_threadpool(read_compaction_candidates, userId)
+    if len(folded) < CHAT_COMPACT_MIN_MESSAGES:
+        return 0
+    previous = (summary_doc.to_dict() or {}).get("summary") if summary_doc.exists else None
+    reply = await llm_chat(summary_prompt(previous, folded, CHAT_SUMMARY_MAX_TOKENS), "chat_summary")
+    summary = clip_summary(reply, CHAT_SUMMARY_MAX_TOKENS)
+    if not summary:
+        return 0
+    if not await run_in_threadpool(commit_chat_compaction, userId, summary_doc, summary, folded):
+        return 0
+    context_cache.set_summary(userId, summary)
+    return len(folded)
+
+async def chat_compaction_loop() -> None:
+    # Users become due after CHAT_COMPACT_EVERY_TURNS turns in this worker (or their first load here)
+    while True:
+        await asyncio.sleep(CHAT_COMPACTION_INTERVAL)
+        for userId in compaction_tracker.due():
+            try:
+                await compact_chat_history(userId)
+            except Exception as e:
+                print("[ERROR chat compaction]", userId, e)
+
+async def compact_all_chat_histories() -> int:
+    """Compact every user's chatHistory now, from a shell (see DEPLOYMENT.md); returns messages folded."""
+    user_ids = [ref.id for ref in await run_in_threadpool(get_db().collection("users").list_documents)]
+    folded = 0
+    for userId in user_ids:
+        # Long histories need several passes of CHAT_COMPACT_BATCH messages
+        while True:
+            count = await compact_chat_history(userId)
+            folded += count
+            if count < CHAT_COMPACT_BATCH:
+                break
+    await llm_client.aclose()
+    return folded
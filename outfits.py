@@ -0,0 +1,321 @@
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils import VALID_WARDROBE_NATURES, normalize_wardrobe_facets
+
+# Wardrobe type -> outfit slot
+SLOT_BY_TYPE = {
+    "shirt": "top",
+    "sweater": "top",
+    "pants": "bottom",
+    "skirt": "bottom",
+    "dress": "dress",
+    "jacket": "outer",
+    "shoes": "shoes",
+    "accessory": "accessory",
+}
+# Slots every outfit needs, per base; outer and accessory are added only when they improve the score
+OUTFIT_BASES = (("top", "bottom", "shoes"), ("dress", "shoes"))
+OPTIONAL_SLOTS = ("outer", "accessory")
+
+# Neutrals go with everything
+NEUTRAL_COLORS = {"black", "white", "grey", "beige", "navy", "brown", "cream", "khaki", "tan", "denim", "ivory", "charcoal"}
+# Position of each chromatic color on a 12-step color wheel
+COLOR_WHEEL = {
+    "red": 0, "burgundy": 0, "maroon": 0,
+    "orange": 2, "coral": 1, "rust": 1,
+    "yellow": 4, "mustard": 3, "gold": 3,
+    "olive": 5, "lime": 5,
+    "green": 6, "emerald": 6, "mint": 6,
+    "teal": 7, "turquoise": 7,
+    "blue": 8, "cyan": 7, "sky": 8,
+    "purple": 9, "violet": 9, "lavender": 9,
+    "magenta": 10, "pink": 11, "rose": 11,
+}
+COLOR_ALIASES = {"gray": "grey", "jean": "denim", "jeans": "denim", "camel": "tan", "off-white": "ivory", "wine": "burgundy"}
+
+
+def _harmony(a: str, b: str) -> float:
+    if a in NEUTRAL_COLORS or b in NEUTRAL_COLORS:
+        # Two neutrals are safe but flat; a neutral anchoring a color is the classic pairing
+        return 0.8 if a in NEUTRAL_COLORS and b in NEUTRAL_COLORS else 0.9
+    steps = abs(COLOR_WHEEL[a] - COLOR_WHEEL[b]) % 12
+    steps = min(steps, 12 - steps)
+    if steps == 0:
+        return 0.8  # monochrome
+    if steps == 1:
+        return 0.85  # analogous
+    if steps == 6:
+        return 0.75  # complementary
+    if steps == 4:
+        return 0.6  # triadic
+    return 0.3
+
+
+_KNOWN_COLORS = sorted(NEUTRAL_COLORS | set(COLOR_WHEEL))
+# Pairwise score for every known color, computed once so scoring is a dict lookup
+COLOR_HARMONY: Dict[Tuple[str, str], float] = {(a, b): _harmony(a, b) for a in _KNOWN_COLORS for b in _KNOWN_COLORS}
+UNKNOWN_COLOR_HARMONY = 0.6
+
+# Symmetric occasion compatibility between item natures; unlisted pairs score NATURE_MISMATCH
+NATURE_COMPATIBILITY = {
+    ("formal", "business"): 0.8,
+    ("formal", "elegant"): 0.9,
+    ("business", "elegant"): 0.7,
+    ("party", "elegant"): 0.9,
+    ("casual", "sport"): 0.7,
+    ("casual", "party"): 0.6,
+    ("casual", "business"): 0.5,
+    ("business", "party"): 0.4,
+}
+NATURE_MISMATCH = 0.2
+
+_WORD_RE = re.compile(r"[a-z\-]+")
+
+
+def color_family(color: Optional[str]) -> Optional[str]:
+    """
+    Map a free-text color ("Light Blue", "navy blue", "gray") onto a known color.
+
+    The last recognized word wins, so modifiers like "light" or "dark" are
+    ignored and "navy blue" is treated as navy.
+
+    Args:
+        color: Color as entered by the user
+
+    Returns:
+        Known color name, or None if nothing is recognized
+    """
+    found = None
+    for word in _WORD_RE.findall((color or "").lower()):
+        word = COLOR_ALIASES.get(word, word)
+        if word in NEUTRAL_COLORS:
+            return word
+        if word in COLOR_WHEEL:
+            found = word
+    return found
+
+
+def color_score(a: Optional[str], b: Optional[str]) -> float:
+    if a is None or b is None:
+        return UNKNOWN_COLOR_HARMONY
+    return COLOR_HARMONY[(a, b)]
+
+
+def nature_score(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    return NATURE_COMPATIBILITY.get((a, b)) or NATURE_COMPATIBILITY.get((b, a)) or NATURE_MISMATCH
+
+
+@dataclass
+class Outfit:
+    """A candidate outfit: one wardrobe item per filled slot, best first when returned by the engine."""
+
+    items: Dict[str, Dict[str, Any]]
+    score: float
+    occasion: str
+    missing: List[str] = field(default_factory=list)
+
+    def describe(self) -> str:
+        parts = []
+        for slot, item in self.items.items():
+            label = " ".join(str(item.get(k) or "").strip() for k in ("color", "type")).strip()
+            brand = str(item.get("brand") or "").strip()
+            parts.append(f"{slot}: {label}" + (f" ({brand})" if brand else ""))
+        text = "; ".join(parts)
+        if self.missing:
+            text += f". Missing: {', '.join(self.missing)}"
+        return text
+
+
+class _Entry:
+    __slots__ = ("item", "slot", "nature", "color")
+
+    def __init__(self, item: Dict[str, Any]):
+        facets = normalize_wardrobe_facets(item)
+        self.item = item
+        self.slot = SLOT_BY_TYPE[facets["type"]]
+        self.nature = facets["nature"]
+        self.color = color_family(facets["color"])
+
+
+class WardrobeIndex:
+    """
+    Wardrobe items grouped by outfit slot, with normalized nature and color family.
+
+    Built once per wardrobe version and reused across requests, together
+    with the per-occasion shortlists derived from it.
+    """
+
+    def __init__(self, items: Iterable[Dict[str, Any]]):
+        self.slots: Dict[str, List[_Entry]] = {slot: [] for slot in set(SLOT_BY_TYPE.values())}
+        self.shortlists: Dict[tuple, Dict[str, List[_Entry]]] = {}
+        for item in items:
+            entry = _Entry(item)
+            self.slots[entry.slot].append(entry)
+
+
+class OutfitEngine:
+    """
+    Deterministic, in-process outfit generator.
+
+    Each slot's items are scored against the occasion (nature compatibility,
+    plus a bonus for the user's favorite colors) and only the best
+    ``per_slot`` survive. Outfits are then grown slot by slot from a top +
+    bottom + shoes or a dress + shoes base with a beam search on pairwise
+    color harmony and nature consistency, and outerwear and an accessory are
+    added when they raise the score. Empty required slots are reported as
+    missing rather than failing.
+
+    Args:
+        per_slot: Candidates kept per slot before combining
+        beam_width: Partial outfits kept after each slot is filled
+        max_indexes: Wardrobe indexes kept in memory, keyed by wardrobe digest
+    """
+
+    def __init__(self, per_slot: int = 6, beam_width: int = 8, max_indexes: int = 256):
+        self.per_slot = per_slot
+        self.beam_width = beam_width
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[str, WardrobeIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self, items: Sequence[Dict[str, Any]], key: Optional[str] = None) -> WardrobeIndex:
+        """
+        Return the slot index for a wardrobe, reusing the one cached under ``key``.
+
+        Args:
+            items: Cleaned wardrobe items
+            key: Wardrobe content digest; without one the index is not cached
+        """
+        if key is None:
+            return WardrobeIndex(items)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        index = WardrobeIndex(items)
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def suggest(
+        self,
+        items: Sequence[Dict[str, Any]],
+        questionnaire: Optional[Dict[str, Any]] = None,
+        occasion: Optional[str] = None,
+        k: int = 3,
+        key: Optional[str] = None,
+    ) -> List[Outfit]:
+        """
+        Generate the ``k`` best outfits from a wardrobe.
+
+        Args:
+            items: Cleaned wardrobe items
+            questionnaire: User's questionnaire; ``favoriteStyle`` is the default occasion
+                and ``favoriteColors`` earn a small bonus
+            occasion: Target nature (casual, formal, business, party, sport, elegant)
+            k: Number of outfits to return
+            key: Wardrobe content digest used to reuse the slot index
+
+        Returns:
+            Up to ``k`` outfits, best first; no two share the same base items
+        """
+        index = self.index(items, key)
+        questionnaire = questionnaire or {}
+        occasion = (occasion or questionnaire.get("favoriteStyle") or "").lower().strip()
+        if occasion not in VALID_WARDROBE_NATURES:
+            occasion = "casual"
+        favorites = {color_family(c) for c in questionnaire.get("favoriteColors") or []} - {None}
+
+        def fit(entry: _Entry) -> float:
+            return nature_score(entry.nature, occasion) + (0.15 if entry.color in favorites else 0.0)
+
+        shortlist_key = (occasion, frozenset(favorites), self.per_slot)
+        shortlist = index.shortlists.get(shortlist_key)
+        if shortlist is None:
+            shortlist = index.shortlists[shortlist_key] = {
+                slot: sorted(entries, key=fit, reverse=True)[: self.per_slot]
+                for slot, entries in index.slots.items()
+            }
+        fits = {id(e): fit(e) for entries in shortlist.values() for e in entries}
+
+        def extend(state: tuple, entry: _Entry) -> tuple:
+            # state = (score, entries, fit_sum, pair_sum); scores are updated incrementally:
+            # mean occasion fit + mean pairwise (color harmony + nature consistency)
+            _, entries, fit_sum, pair_sum = state
+            fit_sum += fits[id(entry)]
+            for other in entries:
+                pair_sum += color_score(entry.color, other.color) + nature_score(entry.nature, other.nature)
+            n = len(entries) + 1
+            pair_count = n * (n - 1) // 2
+            score = fit_sum / n + (pair_sum / pair_count if pair_count else 0.0)
+            return score, entries + (entry,), fit_sum, pair_sum
+
+        width = max(self.beam_width, 2 * k)
+        candidates: List[Tuple[float, List[str], Tuple[_Entry, ...]]] = []
+        for base in OUTFIT_BASES:
+            filled = [slot for slot in base if shortlist[slot]]
+            # A base with none of its defining garments (no top/bottom, no dress) is not an outfit
+            if not filled or filled == ["shoes"]:
+                continue
+            beam = [(0.0, (), 0.0, 0.0)]
+            for slot in filled:
+                grown = [extend(state, entry) for state in beam for entry in shortlist[slot]]
+                grown.sort(key=lambda state: state[0], reverse=True)
+                beam = grown[:width]
+            missing = [slot for slot in base if slot not in filled]
+            for state in beam:
+                for slot in OPTIONAL_SLOTS:
+                    extras = [extend(state, extra) for extra in shortlist[slot]]
+                    best = max(extras, key=lambda s: s[0], default=None)
+                    if best is not None and best[0] > state[0]:
+                        state = best
+                # Incomplete outfits stay available but rank below complete ones
+                candidates.append((state[0] - 0.5 * len(missing), missing, state[1]))
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        outfits: List[Outfit] = []
+        seen_bases = set()
+        for score, missing, chosen in candidates:
+            base_ids = frozenset(id(e) for e in chosen if e.slot in ("top", "bottom", "dress"))
+            if base_ids in seen_bases:
+                continue
+            seen_bases.add(base_ids)
+            outfits.append(Outfit(
+                items={e.slot: e.item for e in chosen},
+                score=round(score, 3),
+                occasion=occasion,
+                missing=list(missing),
+            ))
+            if len(outfits) >= k:
+                break
+        return outfits
+
+
+def format_outfits(outfits: Sequence[Outfit]) -> str:
+    """
+    Render outfits as a plain-text recommendation.
+
+    Args:
+        outfits: Outfits, best first
+
+    Returns:
+        Recommendation text
+    """
+    if not outfits:
+        return "Your wardrobe doesn't have enough items for a complete outfit yet. Start with a top, a bottom and a pair of shoes."
+    lines = [f"Suggested {outfits[0].occasion} outfits from your wardrobe:"]
+    for i, outfit in enumerate(outfits, 1):
+        lines.append(f"{i}. {outfit.describe()}")
+    missing = sorted({slot for outfit in outfits for slot in outfit.missing})
+    if missing:
+        lines.append(f"Consider adding: {', '.join(missing)}.")
+    return "\n".join(lines)
@@ -0,0 +1,279 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Fields sent to the LLM for each wardrobe item; ids, image URLs and timestamps are never useful to it
+WARDROBE_FIELDS = ("type", "color", "nature", "material", "brand", "size")
+# Profile fields that carry no styling signal
+PROFILE_SKIP_FIELDS = {"userId"}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English/JSON-ish text).
+
+    Args:
+        text: Prompt text
+
+    Returns:
+        Estimated token count
+    """
+    return math.ceil(len(text) / 4) if text else 0
+
+
+def encode_profile(questionnaire: Optional[Dict[str, Any]]) -> str:
+    """
+    Encode questionnaire answers as a single ``key=value; ...`` line.
+
+    Args:
+        questionnaire: User's questionnaire answers, or None
+
+    Returns:
+        Compact profile text, empty if there is nothing to say
+    """
+    if not questionnaire:
+        return ""
+    parts = []
+    for key, value in questionnaire.items():
+        if key in PROFILE_SKIP_FIELDS or value in (None, "", []):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        parts.append(f"{key}={value}")
+    return "; ".join(parts)
+
+
+def encode_wardrobe(items: Sequence[Dict[str, Any]], fields: Sequence[str] = WARDROBE_FIELDS) -> str:
+    """
+    Encode wardrobe items as a compact table with per-column value dictionaries.
+
+    Values repeated within a column (``shirt``, ``casual``, a common brand)
+    are written once in a legend and referenced by a short code such as
+    ``T1``; one-off values stay inline. Rows are numbered ``#1..#n`` in the
+    order given so replies can refer back to individual items.
+
+    Args:
+        items: Wardrobe items (extra keys are ignored)
+        fields: Columns to encode, in order
+
+    Returns:
+        Table text, empty if there are no items
+    """
+    if not items:
+        return ""
+    columns = {f: [_cell(item.get(f)) for item in items] for f in fields}
+    legends: Dict[str, Dict[str, str]] = {}
+    for f in fields:
+        prefix = f[0].upper()
+        counts = Counter(v for v in columns[f] if v != "-")
+        legend: Dict[str, str] = {}
+        for value, count in counts.most_common():
+            code = f"{prefix}{len(legend) + 1}"
+            # A legend entry costs "code=value " once; each use saves len(value) - len(code)
+            if count < 2 or count * (len(value) - len(code)) <= len(value) + len(code) + 2:
+                continue
+            legend[value] = code
+        legends[f] = legend
+
+    lines = [f"Wardrobe ({len(items)} items). Columns: {'|'.join(fields)}."]
+    legend_parts = []
+    for f in fields:
+        if legends[f]:
+            legend_parts.append(f"{f}: " + " ".join(f"{code}={value}" for value, code in legends[f].items()))
+    if legend_parts:
+        lines.append("Codes: " + "; ".join(legend_parts))
+    for i in range(len(items)):
+        row = "|".join(legends[f].get(columns[f][i], columns[f][i]) for f in fields)
+        lines.append(f"#{i + 1} {row}")
+    return "\n".join(lines)
+
+
+def _cell(value: Any) -> str:
+    if value in (None, ""):
+        return "-"
+    return str(value).replace("|", "/").replace("\n", " ").strip() or "-"
+
+
+def rank_wardrobe(items: Sequence[Dict[str, Any]], query: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Order items by how many query words appear in their field values.
+
+    Ties (including every item when there is no query) keep their original
+    order, so the ranking is stable.
+
+    Args:
+        items: Wardrobe items
+        query: Free text the items should be relevant to
+
+    Returns:
+        Items, most relevant first
+    """
+    words = set(_WORD_RE.findall(query.lower())) if query else set()
+    if not words:
+        return list(items)
+
+    def score(item: Dict[str, Any]) -> int:
+        text = " ".join(str(item.get(f, "")) for f in WARDROBE_FIELDS).lower()
+        return len(words & set(_WORD_RE.findall(text)))
+
+    scored = sorted(enumerate(items), key=lambda pair: (-score(pair[1]), pair[0]))
+    return [item for _, item in scored]
+
+
+def fit_wardrobe(
+    items: Sequence[Dict[str, Any]],
+    max_tokens: int,
+    query: Optional[str] = None,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Encode as many of the most relevant items as fit in ``max_tokens``.
+
+    Args:
+        items: Wardrobe items
+        max_tokens: Token budget for the encoded table
+        query: Optional text used to rank items before truncating
+
+    Returns:
+        ``(table_text, kept_items)``; ``kept_items[i]`` is row ``#i+1`` of the table
+    """
+    ranked = rank_wardrobe(items, query)
+    text = encode_wardrobe(ranked)
+    if estimate_tokens(text) <= max_tokens:
+        return text, ranked
+
+    def render(count: int) -> str:
+        if not count:
+            return ""
+        return encode_wardrobe(ranked[:count]) + f"\n({len(ranked) - count} less relevant items omitted)"
+
+    # Dictionary encoding makes size non-additive, so binary search the largest prefix that fits
+    lo, hi = 0, len(ranked)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(render(mid)) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return render(lo), ranked[:lo]
+
+
+def fit_history(messages: Sequence[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """
+    Keep the most recent chat messages that fit in ``max_tokens``.
+
+    Args:
+        messages: Chat messages, oldest first
+        max_tokens: Token budget for the history
+
+    Returns:
+        The newest messages that fit, oldest first, never starting with an assistant reply
+    """
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(messages):
+        cost = estimate_tokens(message["content"]) + 4
+        if used + cost > max_tokens:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    while kept and kept[0]["role"] == "assistant":
+        kept.pop(0)
+    return kept
+
+
+@dataclass
+class Prompt:
+    """Chat messages ready for the LLM, plus what went into them."""
+
+    messages: List[Dict[str, str]]
+    sections: Dict[str, int] = field(default_factory=dict)
+    wardrobe_items: List[Dict[str, Any]] = field(default_factory=list)
+    history_messages: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.sections.values())
+
+
+class PromptBuilder:
+    """
+    Builds stylist prompts under a fixed token budget.
+
+    Instructions, profile and the new user message are always included. What
+    is left of ``max_tokens`` is split between chat history (at most
+    ``history_share`` of it, newest turns first) and the wardrobe table (most
+    relevant items first); whichever needs less hands its slack to the other.
+
+    Args:
+        max_tokens: Total prompt budget in estimated tokens
+        history_share: Maximum fraction of the flexible budget given to history
+    """
+
+    def __init__(self, max_tokens: int = 3000, history_share: float = 0.35):
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+
+    def build(
+        self,
+        instructions: str,
+        user_text: str,
+        wardrobe: Sequence[Dict[str, Any]] = (),
+        questionnaire: Optional[Dict[str, Any]] = None,
+        history: Sequence[Dict[str, str]] = (),
+        query: Optional[str] = None,
+        summary: Optional[str] = None,
+    ) -> Prompt:
+        """
+        Assemble ``[system, *history, user]`` messages within the budget.
+
+        Args:
+            instructions: Stylist persona / task instructions for the system message
+            user_text: The new user message
+            wardrobe: Cleaned wardrobe items
+            questionnaire: User's questionnaire answers
+            history: Previous chat messages, oldest first
+            query: Text used to rank wardrobe items, usually the user message
+            summary: Rolling summary of the conversation before ``history``; always included
+
+        Returns:
+            The prompt with per-section token counts
+        """
+        profile = encode_profile(questionnaire)
+        profile_text = f"User profile: {profile}" if profile else ""
+        summary_text = f"Earlier conversation (summary): {summary}" if summary else ""
+        sections = {
+            "instructions": estimate_tokens(instructions),
+            "profile": estimate_tokens(profile_text),
+            "summary": estimate_tokens(summary_text),
+            "user": estimate_tokens(user_text),
+        }
+        flexible = max(0, self.max_tokens - sum(sections.values()))
+
+        history_cost = sum(estimate_tokens(m["content"]) + 4 for m in history)
+        wardrobe_cost = estimate_tokens(encode_wardrobe(wardrobe))
+        history_budget = min(history_cost, int(flexible * self.history_share))
+        wardrobe_budget = flexible - history_budget
+        if wardrobe_cost < wardrobe_budget:
+            history_budget = min(history_cost, flexible - wardrobe_cost)
+            wardrobe_budget = flexible - history_budget
+
+        wardrobe_text, kept_items = fit_wardrobe(wardrobe, wardrobe_budget, query=query)
+        kept_history = fit_history(history, history_budget)
+        sections["wardrobe"] = estimate_tokens(wardrobe_text)
+        sections["history"] = sum(estimate_tokens(m["content"]) + 4 for m in kept_history)
+
+        system = "\n\n".join(part for part in (instructions, profile_text, summary_text, wardrobe_text) if part)
+        messages = [{"role": "system", "content": system}]
+        messages += [{"role": m["role"], "content": m["content"]} for m in kept_history]
+        messages.append({"role": "user", "content": user_text})
+        return Prompt(
+            messages=messages,
+            sections=sections,
+            wardrobe_items=kept_items,
+            history_messages=len(kept_history),
+        )
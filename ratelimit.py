@@ -0,0 +1,266 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+
+class RateLimited(Exception):
+    """
+    Raised when a request is refused by a rate limit or by admission control.
+
+    Args:
+        reason: Which limit refused it (``user``, ``ip`` or ``overloaded``)
+        retry_after: Seconds the client should wait before trying again
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"rate limited ({reason}); retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimitBackend:
+    """
+    Token-bucket store shared by every rate limit backend.
+
+    A bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+    second; each request takes ``cost`` tokens.
+    """
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens from the bucket ``key`` if it has them.
+
+        Returns:
+            0 when the tokens were taken, else the seconds until the bucket will have them
+        """
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Process-local token buckets; each worker enforces its own share of a limit.
+
+    Args:
+        max_keys: Buckets kept before the least recently used is dropped (a dropped bucket starts full)
+    """
+
+    def __init__(self, max_keys: int = 100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# Refill, take and store atomically on the Redis server, using its clock so workers on different hosts agree
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets in Redis, so a limit holds across every worker and replica.
+
+    Requires the optional ``redis`` package (``pip install redis``).
+
+    Args:
+        url: Redis connection URL, e.g. ``redis://localhost:6379/0``
+        namespace: Prefix applied to every bucket key
+    """
+
+    def __init__(self, url: str, namespace: str = "stylo:ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RedisRateLimitBackend requires the 'redis' package: pip install redis") from e
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.namespace = namespace
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        return float(await self._script(keys=[self.namespace + key], args=[rate, burst, cost]))
+
+
+def rate_limit_backend_from_url(url: Optional[str]) -> RateLimitBackend:
+    """
+    Build a rate limit backend from a URL.
+
+    Args:
+        url: ``memory://`` (or empty) for per-worker buckets, ``redis://...`` for shared ones
+
+    Returns:
+        The configured backend
+    """
+    if not url or url.startswith("memory://"):
+        return InMemoryRateLimitBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisRateLimitBackend(url)
+    raise ValueError(f"Unsupported rate limit URL: {url}")
+
+
+class RateLimiter:
+    """
+    Per-key token-bucket limits, e.g. one for user ids and one for client IPs.
+
+    Args:
+        backend: Where the buckets live
+        limits: ``{scope: (requests per minute, burst)}``; a rate of 0 disables that scope
+    """
+
+    def __init__(self, backend: RateLimitBackend, limits: Dict[str, Tuple[float, float]]):
+        self.backend = backend
+        self.limits = {scope: (per_minute / 60.0, burst) for scope, (per_minute, burst) in limits.items() if per_minute > 0}
+
+    async def check(self, cost: float = 1.0, **keys: Optional[str]) -> None:
+        """
+        Take ``cost`` from the bucket of every given scope, in order.
+
+        Args:
+            cost: Tokens the request uses
+            **keys: Bucket key per scope, e.g. ``ip="1.2.3.4", user="uid"``; None skips a scope
+
+        Raises:
+            RateLimited: For the first scope whose bucket is empty
+        """
+        for scope, key in keys.items():
+            if key is None or scope not in self.limits:
+                continue
+            rate, burst = self.limits[scope]
+            wait = await self.backend.take(f"{scope}:{key}", rate, burst, cost)
+            if wait > 0:
+                raise RateLimited(scope, wait)
+
+
+class Permit:
+    """A slot granted by ``AdmissionController``; release it once, when the LLM call is over."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.started)
+
+    async def __aenter__(self) -> "Permit":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """
+    Caps concurrent LLM calls in this worker and sheds load it cannot serve soon.
+
+    Up to ``max_concurrent`` calls run at once. Further callers wait in a FIFO
+    queue of at most ``max_queue`` for at most ``max_wait`` seconds; callers
+    that find the queue full, or whose wait runs out, get ``RateLimited``
+    with a ``retry_after`` estimated from how long recent calls held a slot.
+
+    Args:
+        max_concurrent: Calls allowed in flight at once
+        max_queue: Callers allowed to wait for a slot
+        max_wait: Seconds a caller may wait for a slot
+    """
+
+    def __init__(self, max_concurrent: int = 64, max_queue: int = 64, max_wait: float = 2.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._waiters: deque = deque()
+        # Moving average of how long a call holds its slot, for Retry-After
+        self._hold_seconds = 1.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> float:
+        return max(1.0, math.ceil(self._hold_seconds * (len(self._waiters) + 1) / self.max_concurrent))
+
+    def _reject(self) -> RateLimited:
+        self.rejected += 1
+        return RateLimited("overloaded", self.retry_after())
+
+    async def acquire(self) -> Permit:
+        """
+        Wait for a slot.
+
+        Raises:
+            RateLimited: When the queue is full or no slot frees up within ``max_wait``
+        """
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return Permit(self)
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter], timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not waiter.done():
+            self._abandon(waiter)
+            raise self._reject()
+        return Permit(self)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # A slot was handed over just as we gave up; pass it on
+            self._release(None)
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, held: Optional[float]) -> None:
+        if held is not None:
+            self._hold_seconds += 0.2 * (held - self._hold_seconds)
+        # Hand the slot straight to the oldest waiter, so newcomers cannot jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
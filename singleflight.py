@@ -0,0 +1,140 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Broadcast:
+    """One upstream async iterator fanned out to any number of subscribers, each replayed from the start."""
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._wake()
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            self.done = True
+            self._wake()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        try:
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # Nobody is listening any more: stop paying for the upstream call
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical async calls into one upstream call.
+
+    The first caller for a key starts the call; callers that arrive with the
+    same key while it is running wait for it and receive the same result or
+    exception. The key is dropped as soon as the call finishes, so this is not
+    a cache: a request arriving afterwards makes a fresh call. A caller that is
+    cancelled (its client disconnected) does not cancel the call for the
+    others. Coalescing is per process; other workers make their own calls.
+
+    Args:
+        name: Label for stats
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Run ``fn()`` unless a call with ``key`` is already in flight, then wait for that one.
+
+        Args:
+            key: Identity of the call; include everything that changes its result
+            fn: Starts the upstream call
+
+        Returns:
+            ``(result, shared)``; ``shared`` is True for callers that joined another caller's call
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task), shared
+
+    def stream(self, key: str, fn: Callable[[], AsyncIterator[T]]) -> Tuple[AsyncIterator[T], bool]:
+        """
+        Like ``do`` for streamed results: subscribers that join late first get what was already produced.
+
+        The upstream iterator is cancelled once every subscriber has stopped reading.
+
+        Args:
+            key: Identity of the stream
+            fn: Opens the upstream iterator
+
+        Returns:
+            ``(iterator, shared)``
+        """
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None and not broadcast.done
+        if shared:
+            self.shared += 1
+        else:
+            self.calls += 1
+            broadcast = self._streams[key] = _Broadcast(fn())
+            broadcast.task.add_done_callback(lambda t, b=broadcast: self._streams.get(key) is b and self._streams.pop(key))
+        broadcast.subscribers += 1
+        return broadcast.subscribe(), shared
+
+    def in_flight(self, key: str) -> bool:
+        """Whether a caller for ``key`` would join a running call or stream."""
+        broadcast = self._streams.get(key)
+        return key in self._inflight or (broadcast is not None and not broadcast.done)
+
+    def forget(self, key: str) -> None:
+        """Let the next caller for ``key`` start a fresh call, e.g. after a write made the running one stale."""
+        self._inflight.pop(key, None)
+        self._streams.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "shared": self.shared, "inflight": len(self._inflight) + len(self._streams)}
@@ -2,19 +2,33 @@
 """
 Startup script for Stylo AI Backend
 Checks for required configuration files and starts the server
+
+    python start.py                  # development: one process, reloads on file changes
+    python start.py --production     # production: one worker per CPU (see launcher.py)
 """
 
+import argparse
 import os
 import sys
+from importlib.util import find_spec
 from pathlib import Path
 
-def check_requirements():
+def module_available(name):
+    """True if `name` can be imported; parent packages are imported, the module itself is not"""
+    try:
+        return find_spec(name) is not None
+    except ImportError:
+        return False
+
+def check_requirements(production=False):
     """Check if all required files and environment variables are present"""
     errors = []
     warnings = []
     
-    # Check for Firebase service account file
-    if not os.path.exists("firebase-service-account.json"):
+    # Check for Firebase credentials (service account file, or FIREBASE_CREDENTIALS as set on hosting platforms)
+    if os.getenv("FIREBASE_CREDENTIALS"):
+        print("✅ FIREBASE_CREDENTIALS is set")
+    elif not os.path.exists("firebase-service-account.json"):
         errors.append("❌ firebase-service-account.json not found")
         print("   → Download from Firebase Console > Project Settings > Service Accounts")
     else:
@@ -27,26 +41,38 @@ def check_requirements():
     else:
         print("✅ .env file found")
     
-    # Check Python dependencies
-    try:
-        import fastapi
-        import firebase_admin
-        import cloudinary
-        import google.generativeai
-        print("✅ All Python dependencies are installed")
-    except ImportError as e:
-        errors.append(f"❌ Missing Python dependency: {e}")
+    # Check Python dependencies (find_spec locates them without paying for the import)
+    required = ["fastapi", "firebase_admin", "cloudinary", "google.generativeai"]
+    if production:
+        required.append("gunicorn")
+    missing = [name for name in required if not module_available(name)]
+    if missing:
+        errors.append(f"❌ Missing Python dependency: {', '.join(missing)}")
         print("   → Run: pip install -r requirements.txt")
+    else:
+        print("✅ All Python dependencies are installed")
     
     return errors, warnings
 
 def main():
     """Main startup function"""
+    parser = argparse.ArgumentParser(description="Start the Stylo AI backend")
+    parser.add_argument("--production", action="store_true", help="multi-worker server without the file watcher")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, help="worker processes (production; default: WEB_CONCURRENCY or one per CPU)")
+    args = parser.parse_args()
+
+    # Load the same .env main.py does, so the checks see the same settings
+    if module_available("dotenv"):
+        from dotenv import load_dotenv
+        load_dotenv()
+
     print("🚀 Stylo AI Backend Startup")
     print("=" * 40)
     
     # Check requirements
-    errors, warnings = check_requirements()
+    errors, warnings = check_requirements(production=args.production)
     
     if warnings:
         print("\n⚠️  Warnings:")
@@ -65,18 +91,23 @@ def main():
     
     # Start the server
     try:
+        if args.production:
+            import launcher
+
+            launcher.run(args.host, args.port, args.workers)
+            return
+
         import uvicorn
-        from main import app
-        
-        print("🌐 Server starting on http://localhost:8000")
-        print("📚 API Documentation: http://localhost:8000/docs")
+
+        print(f"🌐 Server starting on http://localhost:{args.port}")
+        print(f"📚 API Documentation: http://localhost:{args.port}/docs")
         print("🔧 Press Ctrl+C to stop the server")
         print("=" * 40)
         
         uvicorn.run(
             "main:app",
-            host="0.0.0.0",
-            port=8000,
+            host=args.host,
+            port=args.port,
             reload=True,
             log_level="info"
         )
@@ -0,0 +1,280 @@
+import json
+import re
+from typing import Any, Dict, List, Literal, Optional, Sequence
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from outfits import Outfit
+
+# Strict-mode JSON schema for OpenRouter's ``response_format``; rows refer to the ``#n`` wardrobe table rows
+OUTFIT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["outfits"],
+    "properties": {
+        "outfits": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["type", "items", "comment"],
+                "properties": {
+                    "type": {"type": "string", "enum": ["wardrobe_only", "mix", "new"]},
+                    "items": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "additionalProperties": False,
+                            "required": ["row", "description"],
+                            "properties": {
+                                "row": {"type": ["integer", "null"], "description": "Wardrobe row number, or null for an item to buy"},
+                                "description": {"type": "string"},
+                            },
+                        },
+                    },
+                    "comment": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+RESPONSE_FORMATS = {
+    "json_schema": {"type": "json_schema", "json_schema": {"name": "outfit_recommendations", "strict": True, "schema": OUTFIT_SCHEMA}},
+    "json_object": {"type": "json_object"},
+}
+
+STRUCTURED_INSTRUCTIONS = (
+    "Reply with JSON only, no prose or code fences, in this shape: "
+    '{"outfits": [{"type": "wardrobe_only" | "mix" | "new", '
+    '"items": [{"row": <wardrobe row number, or null for an item to buy>, "description": "<colour and item>"}], '
+    '"comment": "<why it works for me>"}]}. '
+    "Give 3 outfits: one only from my wardrobe, one mixing my items with new ones, and one of new items."
+)
+
+
+class StructuredOutputError(ValueError):
+    """Raised when an LLM reply holds no outfit that matches the schema."""
+
+
+class OutfitPiece(BaseModel):
+    row: Optional[int] = None
+    description: str = ""
+    itemId: Optional[str] = None
+
+    @field_validator("row", mode="before")
+    @classmethod
+    def _row_number(cls, value: Any) -> Any:
+        # Models sometimes echo the table's "#3" instead of 3
+        if isinstance(value, str):
+            value = value.strip().lstrip("#")
+            return int(value) if value.isdigit() else None
+        return value
+
+
+class StructuredOutfit(BaseModel):
+    type: Literal["wardrobe_only", "mix", "new"] = "mix"
+    items: List[OutfitPiece] = Field(min_length=1)
+    comment: str = ""
+
+
+class OutfitStreamParser:
+    """
+    Pulls complete outfit objects out of a streamed JSON reply as soon as each one closes.
+
+    Text outside the JSON (code fences, a leading sentence) is ignored. The
+    outfits array is the first array in the top-level object, or the reply
+    itself when the model sent a bare array. Objects that do not match the
+    schema are counted in ``invalid`` and skipped.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.invalid = 0
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None
+        self._start: Optional[int] = None
+
+    def feed(self, delta: str) -> List[StructuredOutfit]:
+        """
+        Add the next piece of the reply.
+
+        Returns:
+            Outfits completed by this piece, in order
+        """
+        self.text += delta
+        completed = []
+        for pos in range(self._pos, len(self.text)):
+            char = self.text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"' and self._stack:
+                self._in_string = True
+            elif char in "{[":
+                if char == "[" and self._array_depth is None and len(self._stack) <= 1:
+                    self._array_depth = len(self._stack) + 1
+                self._stack.append(char)
+                if char == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._start = pos
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._start is not None and len(self._stack) == self._array_depth:
+                    outfit = self._validate(self.text[self._start:pos + 1])
+                    self._start = None
+                    if outfit is not None:
+                        completed.append(outfit)
+        self._pos = len(self.text)
+        return completed
+
+    def _validate(self, raw: str) -> Optional[StructuredOutfit]:
+        try:
+            return StructuredOutfit(**json.loads(raw))
+        except (ValueError, TypeError, ValidationError):
+            self.invalid += 1
+            return None
+
+
+def _close(text: str) -> str:
+    """Close the strings, objects and arrays a truncated JSON document left open."""
+    stack: List[str] = []
+    in_string = escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    return text + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Any:
+    """
+    Parse the JSON in an LLM reply, fixing the usual damage.
+
+    Handles code fences and prose around the JSON, trailing commas, and
+    replies cut off mid-document (the incomplete tail is dropped).
+
+    Args:
+        text: Raw reply
+
+    Returns:
+        The parsed value
+
+    Raises:
+        StructuredOutputError: When no JSON could be recovered
+    """
+    text = re.sub(r"```(?:json)?", "", text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise StructuredOutputError("reply contains no JSON")
+    text = text[min(starts):].strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    # Either trailing prose or a truncated document: retry from the closing brackets, preferring
+    # cuts that leave the fewest brackets open so a half-sent last element is dropped, not salvaged
+    candidates = [re.sub(r",\s*$", "", text[:i + 1]) for i, char in enumerate(text) if char in "}]"][::-1][:50]
+    attempts = [_close(candidate) for candidate in candidates]
+    for attempt, _ in sorted(zip(attempts, candidates), key=lambda pair: len(pair[0]) - len(pair[1])):
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            continue
+    raise StructuredOutputError("reply is not valid JSON")
+
+
+def parse_outfit_reply(text: str) -> List[StructuredOutfit]:
+    """
+    Parse a complete reply into outfits, repairing the JSON if needed.
+
+    Raises:
+        StructuredOutputError: When the reply holds no valid outfit
+    """
+    data = repair_json(text)
+    raw = data.get("outfits") if isinstance(data, dict) else data
+    if isinstance(data, dict) and raw is None and "items" in data:
+        raw = [data]
+    if not isinstance(raw, list):
+        raise StructuredOutputError("reply has no outfits array")
+    outfits = []
+    for entry in raw:
+        try:
+            outfits.append(StructuredOutfit(**entry))
+        except (TypeError, ValidationError):
+            continue
+    if not outfits:
+        raise StructuredOutputError("no outfit in the reply matches the schema")
+    return outfits
+
+
+def resolve_outfit(outfit: StructuredOutfit, wardrobe_items: Sequence[Dict[str, Any]]) -> StructuredOutfit:
+    """
+    Map row numbers to wardrobe document ids.
+
+    ``wardrobe_items`` must be the rows the model saw (``Prompt.wardrobe_items``),
+    so row ``n`` is ``wardrobe_items[n - 1]``. Rows outside the table become
+    items to buy. ``type`` is recomputed from what actually resolved.
+
+    Returns:
+        The outfit with ``itemId`` filled in
+    """
+    pieces = []
+    for piece in outfit.items:
+        item = wardrobe_items[piece.row - 1] if piece.row and 1 <= piece.row <= len(wardrobe_items) else None
+        if item is None:
+            pieces.append(OutfitPiece(row=None, description=piece.description))
+            continue
+        label = " ".join(str(item.get(k) or "").strip() for k in ("color", "type")).strip()
+        pieces.append(OutfitPiece(row=piece.row, description=piece.description or label, itemId=item.get("id")))
+    owned = sum(1 for piece in pieces if piece.itemId)
+    kind = "wardrobe_only" if owned == len(pieces) else "new" if owned == 0 else "mix"
+    return StructuredOutfit(type=kind, items=pieces, comment=outfit.comment)
+
+
+def outfits_from_engine(outfits: Sequence[Outfit]) -> List[StructuredOutfit]:
+    """Rule-engine outfits in the structured shape, for fast mode and LLM fallbacks."""
+    structured = []
+    for outfit in outfits:
+        if not outfit.items:
+            continue
+        pieces = [
+            OutfitPiece(description=" ".join(str(item.get(k) or "").strip() for k in ("color", "type")).strip(), itemId=item.get("id"))
+            for item in outfit.items.values()
+        ]
+        comment = f"{outfit.occasion.capitalize()} outfit from your wardrobe."
+        if outfit.missing:
+            comment += f" Consider adding: {', '.join(outfit.missing)}."
+        structured.append(StructuredOutfit(type="wardrobe_only", items=pieces, comment=comment))
+    return structured
+
+
+def format_structured(outfits: Sequence[Dict[str, Any]]) -> str:
+    """Render structured outfit dicts as a plain-text recommendation, for clients that asked for text."""
+    lines = []
+    for i, outfit in enumerate(outfits, 1):
+        items = ", ".join(piece["description"] + ("" if piece.get("itemId") else " (new)") for piece in outfit["items"])
+        lines.append(f"{i}. {items}" + (f". {outfit['comment']}" if outfit.get("comment") else ""))
+    return "\n".join(lines)
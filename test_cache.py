@@ -0,0 +1,79 @@
+"""
+Checks for the per-user context cache in cache.py.
+
+Run with ``python -m pytest test_cache.py``.
+"""
+
+from cache import UserContextCache
+
+
+def test_wardrobe_read_overlapping_a_write_is_not_cached():
+    cache = UserContextCache()
+    # A Firestore read starts, an item is added (nothing cached yet, so the add is a no-op), then the read finishes
+    version = cache.wardrobe_version("u1")
+    cache.add_wardrobe_item("u1", {"id": "new"})
+    cache.set_wardrobe("u1", [{"id": "old"}], version)
+    assert cache.get_wardrobe("u1") is None
+
+
+def test_wardrobe_read_after_a_write_is_cached():
+    cache = UserContextCache()
+    cache.remove_wardrobe_item("u1", "gone")
+    version = cache.wardrobe_version("u1")
+    cache.set_wardrobe("u1", [{"id": "a"}], version)
+    assert cache.get_wardrobe("u1") == [{"id": "a"}]
+
+
+def test_writes_to_other_users_do_not_drop_a_read():
+    cache = UserContextCache()
+    version = cache.wardrobe_version("u1")
+    cache.invalidate("u2")
+    cache.set_wardrobe("u1", [{"id": "a"}], version)
+    assert cache.get_wardrobe("u1") == [{"id": "a"}]
+
+
+def test_forgotten_write_history_errs_on_the_side_of_dropping():
+    cache = UserContextCache(max_users=1)
+    version = cache.wardrobe_version("u1")
+    cache.invalidate("u1")
+    # Push u1's write out of the bounded write history
+    for n in range(10):
+        cache.invalidate(f"other-{n}")
+    cache.set_wardrobe("u1", [{"id": "old"}], version)
+    assert cache.get_wardrobe("u1") is None
+
+
+def test_invalidating_a_user_drops_only_their_recommendations():
+    import asyncio
+
+    from cache import InMemoryCache, RecommendationCache
+
+    backend = InMemoryCache()
+    cache = RecommendationCache(backend)
+
+    async def scenario():
+        await cache.set("u1", "digest-a", "reply a")
+        await cache.set("u1", "digest-b", [{"type": "mix"}])
+        await cache.set("u10", "digest-a", "other user")
+        await cache.invalidate("u1")
+        return [await cache.get(u, d) for u, d in (("u1", "digest-a"), ("u1", "digest-b"), ("u10", "digest-a"))]
+
+    assert asyncio.run(scenario()) == [None, None, "other user"]
+    assert len(backend) == 1
+
+
+def test_evicted_entries_leave_their_group():
+    import asyncio
+
+    from cache import InMemoryCache
+
+    backend = InMemoryCache(max_entries=1)
+
+    async def scenario():
+        await backend.set("a", 1, group="g")
+        await backend.set("b", 2, group="g")
+        return await backend.delete_group("g")
+
+    # "a" was evicted by "b", so only "b" is still a member
+    assert asyncio.run(scenario()) == 1
+    assert backend._groups == {}
@@ -0,0 +1,131 @@
+"""
+Checks for chat history compaction in chat_memory.py and main.compact_chat_history.
+
+Run with ``python -m pytest test_chat_memory.py``. Compaction runs against the
+in-memory Firestore with a scripted summary reply instead of OpenRouter.
+"""
+
+import asyncio
+import datetime
+
+import pytest
+
+from chat_memory import messages_to_fold
+
+BASE = datetime.datetime(2024, 5, 1, 12, 0)
+
+
+def turn_messages(turns):
+    # Both messages of a turn share createdAt; seq orders them
+    messages = []
+    for n in range(turns):
+        created = BASE + datetime.timedelta(minutes=n)
+        messages.append({"role": "user", "content": f"q{n}", "createdAt": created, "seq": 2 * n})
+        messages.append({"role": "assistant", "content": f"a{n}", "createdAt": created, "seq": 2 * n + 1})
+    return messages
+
+
+def test_fold_stops_right_before_the_tail():
+    messages = turn_messages(4)
+    assert messages_to_fold(messages, messages[-4:]) == messages[:4]
+
+
+def test_tail_starting_mid_turn_still_folds_that_turns_first_message():
+    messages = turn_messages(4)
+    # The tail holds only the assistant half of turn 2; its user half shares createdAt but has a lower seq
+    assert messages_to_fold(messages, messages[-3:]) == messages[:5]
+
+
+def test_nothing_is_folded_without_a_tail():
+    assert messages_to_fold(turn_messages(2), []) == []
+
+
+def test_messages_written_after_the_tail_was_read_are_not_folded():
+    messages = turn_messages(3)
+    # A turn saved between reading the tail and reading the oldest messages is newer than the tail
+    assert messages_to_fold(messages, messages[2:4]) == messages[:2]
+
+
+@pytest.fixture
+def compaction(api, monkeypatch):
+    main, _, db = api
+    monkeypatch.setattr(main, "CHAT_HISTORY_WINDOW", 4)
+    monkeypatch.setattr(main, "CHAT_COMPACT_MIN_MESSAGES", 3)
+    monkeypatch.setattr(main, "CHAT_ARCHIVE_TTL_DAYS", 30)
+    prompts = []
+
+    async def summarize(messages, op, **params):
+        prompts.append(messages)
+        return "Likes navy; has a wedding in June."
+
+    monkeypatch.setattr(main, "llm_chat", summarize)
+    return main, db, prompts
+
+
+def add_messages(main, userId, start, count):
+    history = main.get_db().collection("users").document(userId).collection("chatHistory")
+    for n in range(start, start + count):
+        history.document(f"m{n:02d}").set(
+            {"role": "user" if n % 2 == 0 else "assistant", "content": f"message {n}", "createdAt": BASE + datetime.timedelta(minutes=n), "seq": n}
+        )
+
+
+def stored(db, userId, collection):
+    return sorted(path[3] for path in db.docs if len(path) == 4 and path[:3] == ("users", userId, collection))
+
+
+def test_history_just_under_the_threshold_is_left_alone(compaction):
+    main, db, prompts = compaction
+    # Window (4) plus one message short of the minimum fold (3)
+    add_messages(main, "compact-under", 0, 6)
+    assert asyncio.run(main.compact_chat_history("compact-under")) == 0
+    assert prompts == []
+    assert len(stored(db, "compact-under", "chatHistory")) == 6
+
+
+def test_history_at_the_threshold_folds_all_but_the_recent_window(compaction):
+    main, db, prompts = compaction
+    add_messages(main, "compact-at", 0, 7)
+    assert asyncio.run(main.compact_chat_history("compact-at")) == 3
+    assert stored(db, "compact-at", "chatHistory") == ["m03", "m04", "m05", "m06"]
+    assert stored(db, "compact-at", "chatArchive") == ["m00", "m01", "m02"]
+    # The kept turns are untouched and only the folded ones went to the LLM
+    kept = db.docs[("users", "compact-at", "chatHistory", "m03")]
+    assert kept["content"] == "message 3" and "expireAt" not in kept
+    transcript = prompts[0][-1]["content"]
+    assert "message 2" in transcript and "message 3" not in transcript
+    summary = db.docs[("users", "compact-at", "profile", "chatSummary")]
+    assert summary["summary"] == "Likes navy; has a wedding in June."
+    assert summary["foldedMessages"] == 3 and summary["throughSeq"] == 2
+    assert main.context_cache.get_summary("compact-at") == (True, summary["summary"])
+
+
+def test_history_just_over_the_threshold_folds_the_extra_message_too(compaction):
+    main, db, _ = compaction
+    add_messages(main, "compact-over", 0, 8)
+    assert asyncio.run(main.compact_chat_history("compact-over")) == 4
+    assert stored(db, "compact-over", "chatHistory") == ["m04", "m05", "m06", "m07"]
+    # A second pass has nothing left to fold
+    assert asyncio.run(main.compact_chat_history("compact-over")) == 0
+
+
+@pytest.mark.parametrize("existing", [True, False])
+def test_losing_the_summary_precondition_keeps_every_message(compaction, monkeypatch, existing):
+    main, db, _ = compaction
+    userId = f"compact-race-{existing}"
+    summary_ref = main.chat_summary_ref(userId)
+    if existing:
+        summary_ref.set({"summary": "Earlier notes.", "foldedMessages": 2})
+    add_messages(main, userId, 0, 8)
+
+    async def summarize_while_another_worker_commits(messages, op, **params):
+        # Another worker finishes its own compaction while this one waits on the LLM
+        summary_ref.set({"summary": "The other worker's summary.", "foldedMessages": 6})
+        return "A summary that must not be written."
+
+    monkeypatch.setattr(main, "llm_chat", summarize_while_another_worker_commits)
+    assert asyncio.run(main.compact_chat_history(userId)) == 0
+    assert db.docs[("users", userId, "profile", "chatSummary")]["summary"] == "The other worker's summary."
+    assert len(stored(db, userId, "chatHistory")) == 8
+    assert stored(db, userId, "chatArchive") == []
+    assert main.context_cache.get_summary(userId) == (False, None)
@@ -0,0 +1,69 @@
+"""
+Checks for the perceptual-hash index in dedup.py.
+
+Run with ``python -m pytest test_dedup.py``.
+"""
+
+import threading
+
+from dedup import ImageHashIndex
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_temporary_claim_expires():
+    clock = Clock()
+    index = ImageHashIndex(lambda userId: [], claim_ttl=60, clock=clock)
+    assert index.claim("u1", 0b1011, "job:1", 4, temporary=True) == []
+    assert index.claim("u1", 0b1011, "job:2", 4, temporary=True) == [(0, "job:1")]
+    clock.now = 61
+    assert index.claim("u1", 0b1011, "job:2", 4, temporary=True) == []
+
+
+def test_attach_replaces_the_upload_claim():
+    clock = Clock()
+    index = ImageHashIndex(lambda userId: [], claim_ttl=60, clock=clock)
+    index.claim("u1", 0b1011, "job:1", 4, temporary=True)
+    index.attach("u1", 0b1011, "item-1")
+    assert index.find("u1", 0b1011, 0) == [(0, "item-1")]
+    # Attached hashes do not expire; removing the item frees the photo
+    clock.now = 3600
+    assert index.find("u1", 0b1011, 0) == [(0, "item-1")]
+    index.remove("u1", "item-1")
+    assert index.find("u1", 0b1011, 0) == []
+
+
+def test_loading_one_user_does_not_block_others():
+    loading, release = threading.Event(), threading.Event()
+    stored = {"slow": [(0b1, "slow-item")], "fast": [(0b1, "fast-item")]}
+    loads = []
+
+    def loader(userId):
+        # Snapshot first, like a Firestore read, then stall the slow user's load
+        snapshot = list(stored[userId])
+        loads.append(userId)
+        if userId == "slow" and loads.count("slow") == 1:
+            loading.set()
+            release.wait(5)
+        return snapshot
+
+    index = ImageHashIndex(loader)
+    slow = threading.Thread(target=index.find, args=("slow", 0b1, 0))
+    slow.start()
+    try:
+        assert loading.wait(5)
+        assert index.find("fast", 0b1, 0) == [(0, "fast-item")]
+        # The item is deleted while its stale snapshot is still loading
+        stored["slow"] = []
+        index.remove("slow", "slow-item")
+    finally:
+        release.set()
+        slow.join()
+    assert index.find("slow", 0b1, 0) == []
+    assert loads.count("slow") == 2
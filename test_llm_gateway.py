@@ -0,0 +1,243 @@
+"""
+Checks for the retry, circuit breaker, hedging and failover policy in llm_gateway.py.
+
+Run with ``python -m pytest test_llm_gateway.py``. The gateway talks to a
+scripted in-process client instead of OpenRouter.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from llm import LLMError
+from llm_gateway import CircuitBreaker, LLMGateway
+
+
+class ScriptedClient:
+    """
+    Stand-in for ``OpenRouterClient``.
+
+    Each call takes the next step from its model's script (the last step
+    repeats): an ``LLMError`` is raised, a number is a delay before replying,
+    and a list is streamed delta by delta. Replies name the model.
+    """
+
+    def __init__(self, **scripts):
+        self.scripts = scripts
+        self.calls = []
+        self.cancelled = 0
+        self.closed_streams = 0
+
+    def _step(self, model):
+        self.calls.append(model)
+        script = self.scripts[model]
+        return script.pop(0) if len(script) > 1 else script[0]
+
+    async def chat(self, messages, model, **params):
+        step = self._step(model)
+        if isinstance(step, LLMError):
+            raise step
+        try:
+            await asyncio.sleep(step)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"reply from {model}"
+
+    async def stream_chat(self, messages, model, **params):
+        step = self._step(model)
+        try:
+            if isinstance(step, LLMError):
+                raise step
+            delay, *deltas = step
+            await asyncio.sleep(delay)
+            for delta in deltas:
+                if isinstance(delta, LLMError):
+                    raise delta
+                yield delta
+        finally:
+            self.closed_streams += 1
+
+
+def gateway(client, models=("a", "b"), **options):
+    events = []
+    options = {"backoff_base": 0.001, "hedge": False, "on_event": lambda event, model: events.append((event, model)), **options}
+    return LLMGateway(client, list(models), **options), events
+
+
+def test_retryable_error_is_retried_on_the_same_model():
+    client = ScriptedClient(a=[LLMError("busy", status=503), 0])
+    gw, events = gateway(client)
+    assert asyncio.run(gw.chat([])) == "reply from a"
+    assert client.calls == ["a", "a"]
+    assert events == [("retry", "a")]
+
+
+def test_retry_after_from_the_upstream_is_honoured_up_to_backoff_max():
+    client = ScriptedClient(a=[LLMError("slow down", status=429, retry_after=60), 0])
+    gw, _ = gateway(client, backoff_max=0.05)
+    started = time.monotonic()
+    asyncio.run(gw.chat([]))
+    assert 0.05 <= time.monotonic() - started < 1
+
+
+def test_non_retryable_error_fails_over_without_retrying():
+    client = ScriptedClient(a=[LLMError("bad request", status=400)], b=[0])
+    gw, events = gateway(client)
+    assert asyncio.run(gw.chat([])) == "reply from b"
+    assert client.calls == ["a", "b"]
+    assert events == [("failover", "b")]
+    # A rejected request says nothing about the model's health
+    assert gw.breakers["a"].state == "closed"
+
+
+def test_every_model_failing_raises_the_last_error():
+    client = ScriptedClient(a=[LLMError("down", status=500)], b=[LLMError("also down", status=502)])
+    gw, _ = gateway(client, max_retries=1)
+    with pytest.raises(LLMError, match="also down"):
+        asyncio.run(gw.chat([]))
+    assert client.calls == ["a", "a", "b", "b"]
+
+
+def test_open_breaker_skips_the_model_without_a_request():
+    client = ScriptedClient(a=[LLMError("down", status=500)], b=[0])
+    gw, events = gateway(client, max_retries=0, breaker_failures=1, breaker_reset=60)
+
+    async def scenario():
+        await gw.chat([])
+        await gw.chat([])
+
+    asyncio.run(scenario())
+    assert client.calls == ["a", "b", "b"]
+    assert ("breaker_open", "a") in events and ("rejected", "a") in events
+
+
+def test_breaker_lets_one_probe_through_when_half_open():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+    assert breaker.retry_after() == 10
+    now[0] = 10
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow()
+    # A failed probe opens it again for a full reset period
+    breaker.failure()
+    assert breaker.state == "open"
+    now[0] = 20
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+
+def test_released_probe_slot_can_be_taken_again():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1, clock=lambda: now[0])
+    breaker.failure()
+    now[0] = 1
+    assert breaker.allow() and not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_deadline_bounds_the_whole_call():
+    client = ScriptedClient(a=[LLMError("busy", status=503)], b=[5])
+    gw, _ = gateway(client, chat_deadline=0.2, chat_attempt_timeout=5, max_retries=10, backoff_base=0.02)
+    started = time.monotonic()
+    with pytest.raises(LLMError):
+        asyncio.run(gw.chat([]))
+    assert time.monotonic() - started < 0.5
+
+
+def test_attempt_timeout_fails_over_without_retry_or_breaker_failure():
+    client = ScriptedClient(a=[5], b=[0])
+    gw, events = gateway(client, chat_attempt_timeout=0.05, max_retries=3, breaker_failures=1)
+    assert asyncio.run(gw.chat([])) == "reply from b"
+    assert client.calls == ["a", "b"] and client.cancelled == 1
+    assert events == [("failover", "b")]
+    assert gw.breakers["a"].state == "closed"
+
+
+def test_full_completions_get_longer_than_the_stream_first_token_timeout():
+    client = ScriptedClient(a=[0.1])
+    gw, _ = gateway(client, models=["a"], attempt_timeout=0.02, chat_attempt_timeout=1)
+    assert asyncio.run(gw.chat([])) == "reply from a"
+
+
+def test_stream_waits_only_attempt_timeout_for_its_first_delta():
+    client = ScriptedClient(a=[[5, "late"]], b=[[0, "b"]])
+    gw, _ = gateway(client, attempt_timeout=0.05, chat_attempt_timeout=10)
+    assert collect(gw) == ["b"]
+    assert gw.breakers["a"].state == "closed"
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled():
+    client = ScriptedClient(a=[0, 0, 5, 0])
+    gw, events = gateway(client, models=["a"], hedge=True, hedge_min_samples=2, hedge_min_delay=0.02, hedge_ratio=1.0)
+
+    async def scenario():
+        # Two fast calls set the latency threshold; the third is slow and gets a hedge
+        await gw.chat([])
+        await gw.chat([])
+        started = time.monotonic()
+        reply = await gw.chat([])
+        return reply, time.monotonic() - started
+
+    reply, elapsed = asyncio.run(scenario())
+    assert reply == "reply from a" and elapsed < 1
+    assert events == [("hedge", "a")]
+    assert client.calls == ["a"] * 4 and client.cancelled == 1
+
+
+def test_hedging_respects_the_ratio():
+    client = ScriptedClient(a=[0, 0, 0.05])
+    gw, events = gateway(client, models=["a"], hedge=True, hedge_min_samples=2, hedge_min_delay=0.01, hedge_ratio=0.0)
+
+    async def scenario():
+        for _ in range(3):
+            await gw.chat([])
+
+    asyncio.run(scenario())
+    assert events == [] and len(client.calls) == 3
+
+
+def collect(gw):
+    async def scenario():
+        return [delta async for delta in gw.stream_chat([])]
+
+    return asyncio.run(scenario())
+
+
+def test_stream_retries_before_the_first_delta():
+    client = ScriptedClient(a=[LLMError("busy", status=503), [0, "x", "y"]])
+    gw, events = gateway(client)
+    assert collect(gw) == ["x", "y"]
+    assert events == [("retry", "a")]
+    assert client.closed_streams == 2
+
+
+def test_stream_failing_after_the_first_delta_is_not_retried():
+    client = ScriptedClient(a=[[0, "x", LLMError("dropped")], [0, "never"]])
+    gw, _ = gateway(client)
+    received = []
+
+    async def scenario():
+        async for delta in gw.stream_chat([]):
+            received.append(delta)
+
+    with pytest.raises(LLMError, match="dropped"):
+        asyncio.run(scenario())
+    assert received == ["x"] and client.calls == ["a"]
+
+
+def test_hedged_stream_hands_over_the_winner_and_closes_the_loser():
+    client = ScriptedClient(a=[[0, "w"], [0, "w"], [5, "slow"], [0, "fast", "er"]])
+    gw, events = gateway(client, models=["a"], hedge=True, hedge_min_samples=2, hedge_min_delay=0.02, hedge_ratio=1.0)
+    assert collect(gw) == ["w"] and collect(gw) == ["w"]
+    assert collect(gw) == ["fast", "er"]
+    assert events == [("hedge", "a")]
+    # Every stream opened, including the losing hedge, was closed
+    assert client.closed_streams == len(client.calls) == 4
@@ -0,0 +1,101 @@
+"""
+Checks for budgeted prompt assembly in prompting.py.
+
+Run with ``python -m pytest test_prompting.py``.
+"""
+
+import re
+
+from prompting import PromptBuilder, encode_wardrobe, estimate_tokens, fit_history, rank_wardrobe
+
+INSTRUCTIONS = "You are a personal stylist. Suggest outfits from the wardrobe below."
+PROFILE = {"userId": "u1", "style": "minimal", "colors": ["navy", "grey"]}
+
+
+def wardrobe(count):
+    colors = ["navy", "grey", "white", "black", "olive"]
+    types = ["shirt", "jeans", "sweater", "jacket", "sneakers", "boots"]
+    return [
+        {"id": f"item-{n}", "type": types[n % len(types)], "color": colors[n % len(colors)], "nature": "casual", "brand": f"brand-{n}"}
+        for n in range(count)
+    ]
+
+
+def history(turns, words=20):
+    messages = []
+    for n in range(turns):
+        messages.append({"role": "user", "content": f"question {n} " + "word " * words})
+        messages.append({"role": "assistant", "content": f"answer {n} " + "word " * words})
+    return messages
+
+
+def rows(prompt):
+    return re.findall(r"^#(\d+) ", prompt.messages[0]["content"], flags=re.MULTILINE)
+
+
+def test_wardrobe_is_trimmed_to_fit_the_budget():
+    items = wardrobe(200)
+    assert estimate_tokens(encode_wardrobe(items)) > 1000
+    prompt = PromptBuilder(max_tokens=1000).build(INSTRUCTIONS, "What should I wear?", wardrobe=items, questionnaire=PROFILE)
+    assert prompt.total_tokens <= 1000
+    assert 0 < len(prompt.wardrobe_items) < len(items)
+    assert f"({len(items) - len(prompt.wardrobe_items)} less relevant items omitted)" in prompt.messages[0]["content"]
+    # Every row in the table is one of the kept items, numbered in order
+    assert rows(prompt) == [str(n) for n in range(1, len(prompt.wardrobe_items) + 1)]
+
+
+def test_required_sections_are_never_dropped():
+    summary = "We talked about a wedding in June. " * 10
+    user_text = "Anything for the rehearsal dinner? " * 10
+    prompt = PromptBuilder(max_tokens=50).build(
+        INSTRUCTIONS, user_text, wardrobe=wardrobe(20), questionnaire=PROFILE, history=history(3), summary=summary
+    )
+    system = prompt.messages[0]["content"]
+    assert INSTRUCTIONS in system and "style=minimal" in system and summary in system
+    assert "userId" not in system
+    assert prompt.messages[-1] == {"role": "user", "content": user_text}
+    # Only the flexible sections give way when the required ones alone exceed the budget
+    assert prompt.sections["wardrobe"] == prompt.sections["history"] == 0
+    assert prompt.wardrobe_items == [] and prompt.history_messages == 0
+
+
+def test_ranked_wardrobe_keeps_the_most_relevant_items_in_order():
+    items = wardrobe(120)
+    items[97]["color"], items[97]["type"] = "red", "dress"
+    items[40]["color"] = "red"
+    query = "red dress for a party"
+    full = PromptBuilder(max_tokens=10000).build(INSTRUCTIONS, query, wardrobe=items, query=query)
+    trimmed = PromptBuilder(max_tokens=400).build(INSTRUCTIONS, query, wardrobe=items, query=query)
+    assert full.wardrobe_items == rank_wardrobe(items, query)
+    assert [item["id"] for item in full.wardrobe_items[:2]] == ["item-97", "item-40"]
+    # Trimming keeps a prefix of the ranking, so the best matches survive as rows #1 and #2
+    assert 2 <= len(trimmed.wardrobe_items) < len(items)
+    assert trimmed.wardrobe_items == full.wardrobe_items[:len(trimmed.wardrobe_items)]
+    lines = trimmed.messages[0]["content"].splitlines()
+    assert next(line for line in lines if line.startswith("#1 ")).startswith("#1 dress|red|")
+
+
+def test_history_keeps_the_newest_turns_within_its_share():
+    builder = PromptBuilder(max_tokens=1200, history_share=0.35)
+    prompt = builder.build(INSTRUCTIONS, "And for tomorrow?", wardrobe=wardrobe(200), history=history(20))
+    kept = prompt.messages[1:-1]
+    assert 0 < prompt.history_messages == len(kept) < 40
+    assert kept == history(20)[-len(kept):]
+    assert kept[0]["role"] == "user"
+    flexible = 1200 - sum(prompt.sections[s] for s in ("instructions", "profile", "summary", "user"))
+    assert prompt.sections["history"] <= int(flexible * 0.35)
+
+
+def test_short_history_hands_its_slack_to_the_wardrobe():
+    items = wardrobe(200)
+    with_history = PromptBuilder(max_tokens=1200).build(INSTRUCTIONS, "Hi", wardrobe=items, history=history(1, words=2))
+    without = PromptBuilder(max_tokens=1200).build(INSTRUCTIONS, "Hi", wardrobe=items)
+    assert with_history.history_messages == 2
+    assert len(without.wardrobe_items) >= len(with_history.wardrobe_items) > len(without.wardrobe_items) * 0.8
+
+
+def test_history_never_starts_with_an_assistant_reply():
+    messages = history(3)
+    budget = sum(estimate_tokens(m["content"]) + 4 for m in messages[-3:])
+    kept = fit_history(messages, budget)
+    assert kept == messages[-2:]
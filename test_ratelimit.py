@@ -0,0 +1,199 @@
+"""
+Checks for the rate limits and admission control in ratelimit.py, and how main.py applies them.
+
+Run with ``python -m pytest test_ratelimit.py``.
+"""
+
+import asyncio
+
+import pytest
+
+from ratelimit import AdmissionController, InMemoryRateLimitBackend, RateLimited, RateLimiter, rate_limit_backend_from_url
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bucket_allows_a_burst_then_refills():
+    clock = Clock()
+    backend = InMemoryRateLimitBackend(clock=clock)
+
+    async def take():
+        return await backend.take("k", rate=1.0, burst=2)
+
+    assert [asyncio.run(take()) for _ in range(3)] == [0, 0, 1.0]
+    clock.now = 0.5
+    assert asyncio.run(take()) == pytest.approx(0.5)
+    clock.now = 1.0
+    assert asyncio.run(take()) == 0
+
+
+def test_least_recently_used_buckets_are_dropped():
+    backend = InMemoryRateLimitBackend(max_keys=2, clock=Clock())
+    for key in ("a", "b", "c"):
+        asyncio.run(backend.take(key, rate=1.0, burst=1))
+    assert len(backend) == 2
+    # "a" was dropped, so it starts full again
+    assert asyncio.run(backend.take("a", rate=1.0, burst=1)) == 0
+
+
+def test_limiter_checks_each_scope_and_skips_missing_keys():
+    limiter = RateLimiter(InMemoryRateLimitBackend(clock=Clock()), {"ip": (60, 1), "user": (60, 1), "off": (0, 1)})
+
+    async def scenario():
+        await limiter.check(ip="1.2.3.4", user=None, off="x")
+        await limiter.check(ip="5.6.7.8", user="u1", off="x")
+        with pytest.raises(RateLimited) as e:
+            await limiter.check(ip="9.9.9.9", user="u1")
+        return e.value
+
+    error = asyncio.run(scenario())
+    assert error.reason == "user" and error.retry_after == pytest.approx(1.0)
+
+
+def test_backend_from_url():
+    assert isinstance(rate_limit_backend_from_url(""), InMemoryRateLimitBackend)
+    assert isinstance(rate_limit_backend_from_url("memory://"), InMemoryRateLimitBackend)
+    with pytest.raises(ValueError):
+        rate_limit_backend_from_url("memcached://localhost")
+
+
+def test_admission_hands_slots_over_in_arrival_order():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=10, max_wait=1)
+        order = []
+        first = await admission.acquire()
+
+        async def worker(n):
+            async with await admission.acquire():
+                order.append(n)
+                await asyncio.sleep(0)
+
+        workers = [asyncio.ensure_future(worker(n)) for n in range(3)]
+        await asyncio.sleep(0)
+        assert admission.waiting == 3
+        # A newcomer arriving while others wait must queue behind them
+        late = asyncio.ensure_future(worker("late"))
+        await asyncio.sleep(0)
+        first.release()
+        await asyncio.gather(*workers, late)
+        return order, admission.active, admission.waiting
+
+    assert asyncio.run(scenario()) == ([0, 1, 2, "late"], 0, 0)
+
+
+def test_admission_sheds_load_when_the_queue_is_full_or_the_wait_runs_out():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=1, max_wait=0.05)
+        held = await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimited) as full:
+            await admission.acquire()
+        with pytest.raises(RateLimited):
+            await waiter
+        held.release()
+        return full.value, admission.active, admission.waiting, admission.rejected
+
+    error, active, waiting, rejected = asyncio.run(scenario())
+    assert error.reason == "overloaded" and error.retry_after >= 1
+    assert (active, waiting, rejected) == (0, 0, 2)
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=10, max_wait=1)
+        held = await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        held.release()
+        return admission.active, admission.waiting
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+def test_slot_handed_to_a_waiter_that_gives_up_is_passed_on():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=10, max_wait=1)
+        held = await admission.acquire()
+        abandoning = asyncio.ensure_future(admission.acquire())
+        next_in_line = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        # The slot goes to the first waiter, which is cancelled before it can run
+        held.release()
+        abandoning.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await abandoning
+        permit = await asyncio.wait_for(next_in_line, 0.5)
+        active = admission.active
+        permit.release()
+        permit.release()
+        return active, admission.active
+
+    assert asyncio.run(scenario()) == (1, 0)
+
+
+def test_user_rate_limit_is_keyed_on_the_verified_token(api, client, monkeypatch):
+    main, _, _ = api
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(InMemoryRateLimitBackend(), {"user": (1, 1)}))
+    monkeypatch.setattr(main.token_verifier, "verify", lambda token: {"uid": token.removeprefix("token-")})
+    body = {"userId": "victim", "mode": "fast"}
+    # Unauthenticated requests naming someone else's userId do not touch that user's bucket
+    for _ in range(3):
+        assert client.post("/api/recommend", json=body).status_code == 200
+    assert client.post("/api/recommend", json=body, headers={"Authorization": "Bearer token-victim"}).status_code == 200
+    limited = client.post("/api/recommend", json=body, headers={"Authorization": "Bearer token-victim"})
+    assert limited.status_code == 429 and limited.headers["Retry-After"]
+
+
+def proxied_client(app):
+    from fastapi.testclient import TestClient
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+    # Every request comes from the proxy's address ("testclient"); only its X-Forwarded-For tells clients apart
+    return TestClient(ProxyHeadersMiddleware(app, trusted_hosts="testclient"))
+
+
+def test_clients_behind_the_same_proxy_are_limited_independently(api, monkeypatch):
+    main, app, _ = api
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(InMemoryRateLimitBackend(), {"ip": (1, 1)}))
+    body = {"userId": "behind-proxy", "mode": "fast"}
+    with proxied_client(app) as client:
+        first = {"X-Forwarded-For": "203.0.113.1"}
+        second = {"X-Forwarded-For": "203.0.113.2"}
+        assert client.post("/api/recommend", json=body, headers=first).status_code == 200
+        assert client.post("/api/recommend", json=body, headers=second).status_code == 200
+        assert client.post("/api/recommend", json=body, headers=first).status_code == 429
+
+
+def test_verified_users_do_not_share_the_proxy_ip_bucket(api, client, monkeypatch):
+    main, _, _ = api
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(InMemoryRateLimitBackend(), {"ip": (1, 1), "user": (1, 1)}))
+    monkeypatch.setattr(main.token_verifier, "verify", lambda token: {"uid": token.removeprefix("token-")})
+    body = {"userId": "shared-proxy", "mode": "fast"}
+    for uid in ("a", "b", "c"):
+        assert client.post("/api/recommend", json=body, headers={"Authorization": f"Bearer token-{uid}"}).status_code == 200
+    assert client.post("/api/recommend", json=body, headers={"Authorization": "Bearer token-a"}).status_code == 429
+
+
+def test_ip_limit_is_off_until_the_proxy_range_is_configured(monkeypatch):
+    import os
+
+    import launcher
+
+    monkeypatch.delenv("FORWARDED_ALLOW_IPS", raising=False)
+    monkeypatch.setenv("RATE_LIMIT_IP_PER_MIN", "60")
+    launcher.check_ip_rate_limit()
+    assert os.environ["RATE_LIMIT_IP_PER_MIN"] == "0"
+    monkeypatch.setenv("FORWARDED_ALLOW_IPS", "10.0.0.0/8")
+    monkeypatch.setenv("RATE_LIMIT_IP_PER_MIN", "60")
+    launcher.check_ip_rate_limit()
+    assert os.environ["RATE_LIMIT_IP_PER_MIN"] == "60"
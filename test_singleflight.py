@@ -0,0 +1,147 @@
+"""
+Checks for request coalescing in singleflight.py.
+
+Run with ``python -m pytest test_singleflight.py``.
+"""
+
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "reply"
+
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["reply"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert stats == {"calls": 1, "shared": 4, "inflight": 0}
+
+
+def test_errors_reach_every_caller_and_the_next_call_starts_fresh():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream")
+
+        results = await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flight.do("k", fail)
+        return calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_call_for_others():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "reply"
+
+        first = asyncio.ensure_future(flight.do("k", fetch))
+        second = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == ("reply", True)
+
+
+def test_forget_lets_the_next_caller_start_a_fresh_call():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        stale = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        flight.forget("k")
+        fresh = await flight.do("k", fetch)
+        return await stale, fresh
+
+    assert asyncio.run(scenario()) == ((2, False), (2, False))
+
+
+async def deltas(events, count=3, delay=0.01):
+    try:
+        for n in range(count):
+            await asyncio.sleep(delay)
+            events.append(n)
+            yield n
+    finally:
+        events.append("closed")
+
+
+def test_late_stream_subscriber_replays_from_the_start():
+    async def scenario():
+        flight, events = SingleFlight(), []
+        first, shared_first = flight.stream("k", lambda: deltas(events))
+        received_first = [await first.__anext__()]
+        second, shared_second = flight.stream("k", lambda: deltas(events))
+        received_second = [d async for d in second]
+        received_first += [d async for d in first]
+        return shared_first, shared_second, received_first, received_second, events, flight.in_flight("k")
+
+    shared_first, shared_second, received_first, received_second, events, in_flight = asyncio.run(scenario())
+    assert (shared_first, shared_second) == (False, True)
+    assert received_first == received_second == [0, 1, 2]
+    assert events == [0, 1, 2, "closed"]
+    assert not in_flight
+
+
+def test_stream_is_cancelled_once_every_subscriber_stops():
+    async def scenario():
+        flight, events = SingleFlight(), []
+        first, _ = flight.stream("k", lambda: deltas(events, count=100))
+        second, _ = flight.stream("k", lambda: deltas(events, count=100))
+        await first.__anext__()
+        await second.__anext__()
+        await first.aclose()
+        assert flight.in_flight("k")
+        await second.aclose()
+        await asyncio.sleep(0.02)
+        return events, flight.in_flight("k")
+
+    events, in_flight = asyncio.run(scenario())
+    assert events[-1] == "closed" and len(events) < 10
+    assert not in_flight
+
+
+def test_stream_errors_reach_every_subscriber():
+    async def failing():
+        yield 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream")
+
+    async def scenario():
+        flight = SingleFlight()
+        streams = [flight.stream("k", failing)[0] for _ in range(2)]
+
+        async def drain(stream):
+            return [d async for d in stream]
+
+        return await asyncio.gather(*(drain(s) for s in streams), return_exceptions=True)
+
+    assert [type(r) for r in asyncio.run(scenario())] == [RuntimeError, RuntimeError]
@@ -0,0 +1,129 @@
+"""
+Checks for streaming outfit parsing and JSON repair in structured.py.
+
+Run with ``python -m pytest test_structured.py``. The retry and fallback
+checks drive main's ``structured_outfits``/``stream_outfits`` with scripted
+LLM replies instead of OpenRouter.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from structured import OutfitStreamParser, StructuredOutputError, parse_outfit_reply, repair_json
+
+WARDROBE = [{"id": "shirt-1", "type": "shirt", "color": "navy"}, {"id": "jeans-1", "type": "jeans", "color": "blue"}]
+
+
+def outfit(comment="works", rows=(1, 2), kind="wardrobe_only"):
+    return {"type": kind, "items": [{"row": row, "description": f"piece {row}"} for row in rows], "comment": comment}
+
+
+def feed_all(parser, deltas):
+    return [o for delta in deltas for o in parser.feed(delta)]
+
+
+def test_objects_split_across_deltas_are_emitted_when_they_close():
+    reply = json.dumps({"outfits": [outfit("first"), outfit("second")]})
+    parser = OutfitStreamParser()
+    received = []
+    for n in range(0, len(reply), 7):
+        completed = parser.feed(reply[n:n + 7])
+        received += completed
+        if completed:
+            # Each outfit arrives in the delta that closes it, not at the end of the stream
+            assert reply[:n + 7].count('"comment"') == len(received)
+    assert [o.comment for o in received] == ["first", "second"]
+    assert parser.invalid == 0
+
+
+def test_escaped_quotes_and_braces_inside_strings_do_not_close_objects():
+    tricky = 'say "hi" {not json} [nor this] \\ done'
+    reply = json.dumps({"outfits": [outfit(tricky), outfit("next")]})
+    # Split right after a backslash so the escape straddles two deltas
+    cut = reply.index("\\") + 1
+    received = feed_all(OutfitStreamParser(), [reply[:cut], reply[cut:]])
+    assert [o.comment for o in received] == [tricky, "next"]
+    assert parse_outfit_reply(reply)[0].comment == tricky
+
+
+def test_code_fences_and_prose_around_the_json_are_ignored():
+    reply = "Here you go:\n```json\n" + json.dumps({"outfits": [outfit()]}) + "\n```\nEnjoy!"
+    assert [o.comment for o in feed_all(OutfitStreamParser(), [reply])] == ["works"]
+    assert [o.comment for o in parse_outfit_reply(reply)] == ["works"]
+
+
+def test_truncated_final_object_is_dropped():
+    full = json.dumps({"outfits": [outfit("kept"), outfit("cut", kind="new")]})
+    truncated = full[:full.index('"cut"') - 30]
+    parser = OutfitStreamParser()
+    assert [o.comment for o in feed_all(parser, [truncated])] == ["kept"]
+    assert repair_json(truncated) == {"outfits": [outfit("kept")]}
+    assert [o.comment for o in parse_outfit_reply(truncated)] == ["kept"]
+
+
+@pytest.mark.parametrize("data", [[outfit("a"), outfit("b")], {"outfits": [outfit("a"), outfit("b")]}])
+def test_bare_array_and_wrapped_object_parse_the_same(data):
+    reply = json.dumps(data)
+    assert [o.comment for o in feed_all(OutfitStreamParser(), [reply])] == ["a", "b"]
+    assert [o.comment for o in parse_outfit_reply(reply)] == ["a", "b"]
+
+
+def test_objects_that_miss_the_schema_are_skipped_and_counted():
+    reply = json.dumps({"outfits": [{"type": "mix", "items": []}, outfit("ok")]})
+    parser = OutfitStreamParser()
+    assert [o.comment for o in feed_all(parser, [reply])] == ["ok"]
+    assert parser.invalid == 1
+
+
+def test_trailing_commas_are_repaired():
+    assert repair_json('{"outfits": [{"type": "new", "items": [{"row": null, "description": "x"},],},]}')["outfits"][0]["type"] == "new"
+
+
+@pytest.mark.parametrize("reply", ["Sorry, I can't help with that.", '{"outfits": "none"}', '{"outfits": [{"type": "mix", "items": []}]}'])
+def test_unusable_replies_raise(reply):
+    with pytest.raises(StructuredOutputError):
+        parse_outfit_reply(reply)
+
+
+def scripted_chat(monkeypatch, main, replies):
+    requests = []
+
+    async def chat(messages, op, **params):
+        requests.append(messages)
+        return replies.pop(0)
+
+    monkeypatch.setattr(main, "admitted_chat", chat)
+    return requests
+
+
+def test_unrepairable_reply_is_retried_with_the_error_shown(api, monkeypatch):
+    main = api[0]
+    monkeypatch.setattr(main, "STRUCTURED_RETRIES", 1)
+    requests = scripted_chat(monkeypatch, main, [json.dumps({"outfits": [outfit()]})])
+    prompt = [{"role": "user", "content": "dress me"}]
+    outfits = asyncio.run(main.structured_outfits(prompt, WARDROBE, reply="Sorry, no JSON today."))
+    assert [piece["itemId"] for piece in outfits[0]["items"]] == ["shirt-1", "jeans-1"]
+    (retry,) = requests
+    assert retry[:1] == prompt
+    assert retry[1] == {"role": "assistant", "content": "Sorry, no JSON today."}
+    assert "could not be used" in retry[2]["content"]
+
+
+def test_stream_falls_back_to_rules_when_retries_are_exhausted(api, monkeypatch):
+    main = api[0]
+    monkeypatch.setattr(main, "STRUCTURED_RETRIES", 1)
+    requests = scripted_chat(monkeypatch, main, ["still not JSON"])
+    rules = [outfit("from rules")]
+    state = {"source": "llm"}
+
+    async def deltas():
+        for delta in ("I would ", "suggest jeans."):
+            yield delta
+
+    async def scenario():
+        return [o async for o in main.stream_outfits(deltas(), [], WARDROBE, lambda: rules, state)]
+
+    assert asyncio.run(scenario()) == rules
+    assert state["source"] == "rules" and len(requests) == 1
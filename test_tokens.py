@@ -0,0 +1,192 @@
+"""
+Checks for Firebase ID token verification in tokens.py.
+
+Run with ``python -m pytest test_tokens.py``. Tokens are signed with a key
+generated for the test, and the certificate endpoint is replaced by an
+in-process response, so nothing talks to Google.
+"""
+
+import base64
+import datetime
+import json
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+import tokens
+from tokens import PublicKeyCache, TokenCache, TokenVerifier
+
+PROJECT = "demo-project"
+
+
+def make_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return crypt.RSASigner.from_string(private_pem), cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+SIGNER, CERT = make_key()
+OTHER_SIGNER, OTHER_CERT = make_key()
+
+
+def claims(**overrides):
+    now = int(time.time())
+    payload = {
+        "aud": PROJECT,
+        "iss": f"https://securetoken.google.com/{PROJECT}",
+        "sub": "user-1",
+        "iat": now - 10,
+        "exp": now + 3600,
+    }
+    payload.update(overrides)
+    return {k: v for k, v in payload.items() if v is not None}
+
+
+def sign(kid="k1", signer=SIGNER, **overrides):
+    return jwt.encode(signer, claims(**overrides), header={"kid": kid}).decode()
+
+
+class FakeResponse:
+    def __init__(self, certs, max_age=3600):
+        self.certs = dict(certs)
+        self.headers = {"cache-control": f"public, max-age={max_age}"}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.certs
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    """Serves ``endpoint.certs`` as the certificate endpoint and counts fetches."""
+
+    class Endpoint:
+        certs = {"k1": CERT}
+        fetches = 0
+
+    def get(url, timeout):
+        Endpoint.fetches += 1
+        return FakeResponse(Endpoint.certs)
+
+    monkeypatch.setattr(tokens.httpx, "get", get)
+    return Endpoint
+
+
+def verifier(**keys):
+    def fallback(token):
+        raise AssertionError("a configured project id must not use the fallback")
+
+    return TokenVerifier(PROJECT, fallback, keys=PublicKeyCache(**keys))
+
+
+def test_valid_token_yields_its_claims_and_uid(endpoint):
+    assert verifier().verify(sign())["uid"] == "user-1"
+
+
+@pytest.mark.parametrize(
+    "overrides, error",
+    [
+        ({"exp": int(time.time()) - 60, "iat": int(time.time()) - 120}, "expired"),
+        ({"iat": int(time.time()) + 600}, "too early"),
+        ({"aud": "another-project"}, "audience"),
+        ({"iss": "https://securetoken.google.com/another-project"}, "issuer"),
+        ({"sub": None}, "subject"),
+        ({"sub": ""}, "subject"),
+        ({"sub": "x" * 129}, "subject"),
+    ],
+)
+def test_invalid_claims_are_rejected_and_not_cached(endpoint, overrides, error):
+    v = verifier()
+    token = sign(**overrides)
+    with pytest.raises(ValueError, match=error):
+        v.verify(token)
+    assert v.cache.stats()["size"] == 0
+
+
+def test_wrong_algorithm_is_rejected_before_fetching_keys(endpoint):
+    def segment(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    token = ".".join([segment({"alg": "HS256", "kid": "k1"}), segment(claims()), "c2ln"])
+    with pytest.raises(ValueError, match="algorithm"):
+        verifier().verify(token)
+    assert endpoint.fetches == 0
+
+
+def test_signature_from_another_key_is_rejected(endpoint):
+    with pytest.raises(ValueError):
+        verifier().verify(sign(signer=OTHER_SIGNER))
+
+
+def test_cache_hit_skips_verification_but_not_expiry():
+    calls = []
+
+    def fallback(token):
+        calls.append(token)
+        return {"uid": "user-1", "exp": time.time() + 0.1}
+
+    v = TokenVerifier(None, fallback)
+    assert v.verify("token")["uid"] == "user-1"
+    assert v.verify("token")["uid"] == "user-1"
+    assert len(calls) == 1 and v.cache.hits == 1
+    time.sleep(0.15)
+    v.verify("token")
+    assert len(calls) == 2
+
+
+def test_token_cache_stores_digests_and_evicts_least_recently_used():
+    cache = TokenCache(max_entries=2)
+    exp = time.time() + 60
+    for token in ("a", "b", "c"):
+        cache.set(token, {"exp": exp})
+    assert cache.get("a") is None
+    assert cache.get("c") == {"exp": exp}
+    assert "c" not in cache._entries and TokenCache.digest("c") in cache._entries
+    # Claims without a numeric exp are never cached
+    cache.set("d", {"sub": "x"})
+    assert cache.get("d") is None
+
+
+def test_unknown_kid_refetches_at_most_once_per_min_refetch(endpoint):
+    v = verifier(min_refetch=0.1)
+    v.verify(sign())
+    assert endpoint.fetches == 1
+    # Google rotates in a new key; a token signed by it arrives straight away
+    endpoint.certs = {"k1": CERT, "k2": OTHER_CERT}
+    rotated = sign(kid="k2", signer=OTHER_SIGNER)
+    with pytest.raises(ValueError):
+        v.verify(rotated)
+    # Forged kids within the window reuse the current set instead of downloading again
+    for n in range(5):
+        with pytest.raises(ValueError):
+            v.verify(sign(kid=f"forged-{n}", sub=f"user-{n}"))
+    assert endpoint.fetches == 1
+    time.sleep(0.15)
+    assert v.verify(rotated)["uid"] == "user-1"
+    assert endpoint.fetches == 2
+
+
+def test_known_kid_uses_cached_keys_without_fetching(endpoint):
+    v = verifier()
+    v.verify(sign(sub="a"))
+    v.verify(sign(sub="b"))
+    assert endpoint.fetches == 1
@@ -0,0 +1,161 @@
+"""
+Wardrobe endpoint checks against the in-memory Firestore.
+
+Run with ``python -m pytest test_wardrobe.py``.
+"""
+
+import json
+
+
+def wardrobe_docs(db, userId):
+    return [path for path in db.docs if path[:2] == ("wardrobes", userId)]
+
+
+def bulk_item(userId, n):
+    return {"userId": userId, "type": "shirt", "color": "navy", "nature": "casual", "imageUrl": f"https://example.com/{n}.jpg"}
+
+
+def test_bulk_array_over_limit_writes_nothing(api, client, monkeypatch):
+    main, _, db = api
+    monkeypatch.setattr(main, "BULK_IMPORT_MAX_ITEMS", 3)
+    monkeypatch.setattr(main, "FIRESTORE_BATCH_LIMIT", 2)
+    response = client.post("/api/wardrobe/bulk", json=[bulk_item("bulk-array", n) for n in range(4)])
+    assert response.status_code == 413
+    assert wardrobe_docs(db, "bulk-array") == []
+
+
+def test_bulk_ndjson_over_limit_reports_what_was_written(api, client, monkeypatch):
+    main, _, db = api
+    monkeypatch.setattr(main, "BULK_IMPORT_MAX_ITEMS", 3)
+    monkeypatch.setattr(main, "FIRESTORE_BATCH_LIMIT", 2)
+    body = "\n".join(json.dumps(bulk_item("bulk-ndjson", n)) for n in range(5))
+    response = client.post("/api/wardrobe/bulk", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 3 and data["truncated"] is True
+    assert [r["index"] for r in data["results"] if "id" in r] == [0, 1, 2]
+    assert data["results"][-1]["index"] == 3 and "error" in data["results"][-1]
+    assert len(wardrobe_docs(db, "bulk-ndjson")) == 3
+
+
+def test_image_upload_reports_rejected_files_next_to_accepted_jobs(api, client, monkeypatch):
+    main, _, _ = api
+    monkeypatch.setattr(main, "MAX_IMAGE_BYTES", 100)
+    files = [("files", ("small.jpg", b"x" * 10, "image/jpeg")), ("files", ("large.jpg", b"x" * 200, "image/jpeg"))]
+    response = client.post("/api/wardrobe/images", data={"userId": "upload-partial"}, files=files)
+    assert response.status_code == 202
+    small, large = response.json()["jobs"]
+    assert small["jobId"] and small["status"] == "queued"
+    assert large == {"filename": "large.jpg", "status": "rejected", "code": 413, "error": "Image exceeds 100 bytes"}
+
+
+def test_image_upload_fails_when_no_file_is_accepted(api, client, monkeypatch):
+    main, _, _ = api
+    monkeypatch.setattr(main, "MAX_IMAGE_BYTES", 100)
+    files = [("files", ("large.jpg", b"x" * 200, "image/jpeg"))]
+    response = client.post("/api/wardrobe/images", data={"userId": "upload-rejected"}, files=files)
+    assert response.status_code == 413
+
+
+def photo_bytes():
+    import io
+
+    from PIL import Image
+
+    img = Image.new("RGB", (64, 64))
+    img.putdata([(x * 4, y * 4, (x * y) % 256) for y in range(64) for x in range(64)])
+    out = io.BytesIO()
+    img.save(out, "JPEG")
+    return out.getvalue()
+
+
+def auth(userId):
+    return {"Authorization": f"Bearer mock-token-{userId}"}
+
+
+def upload_photo(client, userId, data):
+    import time
+
+    response = client.post("/api/wardrobe/images", data={"userId": userId}, files=[("files", ("photo.jpg", data, "image/jpeg"))])
+    assert response.status_code == 202
+    jobId = response.json()["jobs"][0]["jobId"]
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/wardrobe/images/{jobId}", headers=auth(userId)).json()
+        if job["status"] not in ("queued", "processing"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"image job {jobId} did not finish")
+
+
+def test_photo_can_be_uploaded_again_after_its_item_is_deleted(api, client, monkeypatch):
+    import ingest
+
+    monkeypatch.setattr(ingest, "upload_image_to_cloudinary", lambda path, folder="wardrobe": {"url": f"https://example.com/{folder}.jpg"})
+    userId, data = "dedup-reupload", photo_bytes()
+    first = upload_photo(client, userId, data)
+    assert first["status"] == "done"
+    item = {
+        "userId": userId, "type": "shirt", "color": "navy", "nature": "casual", "material": "cotton", "brand": "COS", "size": "M",
+        "imageUrl": first["result"]["url"], "imageHash": first["result"]["imageHash"],
+    }
+    itemId = client.post("/api/wardrobe", json=item).json()["id"]
+    # While the item exists the same photo is a duplicate of the item, not of the upload job
+    duplicate = upload_photo(client, userId, data)
+    assert duplicate["status"] == "duplicate" and duplicate["duplicates"][0]["duplicateOf"] == itemId
+    assert client.delete(f"/api/wardrobe/{userId}/{itemId}").json() == {"success": True}
+    assert upload_photo(client, userId, data)["status"] == "done"
+
+
+def test_image_job_is_only_shown_to_its_uploader_and_expires(api, client, monkeypatch):
+    import datetime
+
+    import ingest
+
+    main, _, db = api
+    monkeypatch.setattr(ingest, "upload_image_to_cloudinary", lambda path, folder="wardrobe": {"url": f"https://example.com/{folder}.jpg"})
+    job = upload_photo(client, "job-owner", photo_bytes())
+    path = f"/api/wardrobe/images/{job['jobId']}"
+    assert client.get(path, headers=auth("someone-else")).status_code == 403
+    assert client.get(path).status_code == 422
+    stored = db.docs[("imageJobs", job["jobId"])]
+    ttl = stored["expireAt"] - datetime.datetime.now(datetime.timezone.utc)
+    assert datetime.timedelta(hours=main.IMAGE_JOB_TTL_HOURS - 1) < ttl <= datetime.timedelta(hours=main.IMAGE_JOB_TTL_HOURS)
+    # A worker that did not run the job serves it from Firestore, with the same check and without expireAt
+    monkeypatch.setattr(main.image_pool, "get", lambda jobId: None)
+    assert client.get(path, headers=auth("someone-else")).status_code == 403
+    assert client.get(path, headers=auth("job-owner")).json() == job
+
+
+def large_wardrobe(userId, count=200):
+    from bench.server import wardrobe_item
+
+    return [{**wardrobe_item(0, n), "userId": userId, "id": f"{userId}-{n}"} for n in range(count)]
+
+
+def test_voice_prompt_keeps_the_closest_items_for_wardrobe_questions(api):
+    import asyncio
+
+    main, _, _ = api
+    items = large_wardrobe("voice-topk")
+    kept = asyncio.run(main.relevant_wardrobe_items("voice-topk", items, "black dress", 5, 300))
+    assert len(kept) == 5
+    assert all(item["type"] == "dress" or item["color"] == "black" for item in kept)
+
+
+def test_voice_prompt_falls_back_to_the_full_wardrobe_for_occasion_questions(api):
+    import asyncio
+
+    main, _, _ = api
+    items = large_wardrobe("voice-occasion")
+    # Nothing in the wardrobe matches, so the prompt builder ranks and trims the whole wardrobe instead
+    kept = asyncio.run(main.relevant_wardrobe_items("voice-occasion", items, "what should I wear to a wedding", 5, 300))
+    assert kept == items
+
+
+def test_voice_prompt_does_not_prune_a_wardrobe_that_fits_the_budget(api):
+    import asyncio
+
+    main, _, _ = api
+    items = large_wardrobe("voice-fits", count=30)
+    assert asyncio.run(main.relevant_wardrobe_items("voice-fits", items, "black dress", 5, 10000)) == items
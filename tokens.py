@@ -0,0 +1,219 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Union
+
+import httpx
+
+# Google's x509 certificates for Firebase ID tokens (same source firebase_admin uses)
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class PublicKeyCache:
+    """
+    Process-wide cache of the public certificates that sign Firebase ID tokens.
+
+    One fetch is shared by every caller. Once a set is older than
+    ``refresh_ratio`` of its ``Cache-Control: max-age`` a background thread
+    refreshes it while callers keep using the current set, so a key rotation
+    never makes a request wait on Google. Only the very first fetch, or a
+    token signed by a key id that is not in the set, fetches inline; unknown
+    key ids refetch at most once per ``min_refetch`` seconds so forged
+    headers cannot turn into a stream of downloads.
+
+    Args:
+        url: Certificate endpoint returning ``{kid: pem}``
+        refresh_ratio: Fraction of max-age after which a background refresh starts
+        timeout: HTTP timeout in seconds
+        min_refetch: Minimum seconds between inline fetches for unknown key ids
+    """
+
+    def __init__(self, url: str = FIREBASE_CERTS_URL, refresh_ratio: float = 0.8, timeout: float = 10, min_refetch: float = 60):
+        self.url = url
+        self.refresh_ratio = refresh_ratio
+        self.timeout = timeout
+        self.min_refetch = min_refetch
+        self._certs: Dict[str, str] = {}
+        self._fetched_at = 0.0
+        self._max_age = 0.0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self) -> None:
+        response = httpx.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+        certs = response.json()
+        with self._lock:
+            self._certs = certs
+            self._fetched_at = time.monotonic()
+            self._max_age = float(match.group(1)) if match else 3600.0
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self._fetch()
+        except Exception as e:
+            print("[ERROR auth] refreshing public keys:", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self, kid: Optional[str] = None) -> Dict[str, str]:
+        """
+        Return the current certificates, fetching inline only when none are usable.
+
+        Args:
+            kid: Key id the caller needs; an unknown id forces one inline refresh
+
+        Returns:
+            Mapping of key id to PEM certificate
+        """
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            usable = bool(self._certs) and age < self._max_age and (kid is None or kid in self._certs)
+            stale = usable and age >= self._max_age * self.refresh_ratio
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, name="auth-keys", daemon=True).start()
+            if usable or (self._certs and age < min(self.min_refetch, self._max_age)):
+                return self._certs
+        # Serialize inline fetches so a burst of cold requests shares one download
+        with self._fetch_lock:
+            with self._lock:
+                age = time.monotonic() - self._fetched_at
+                if self._certs and age < self._max_age and (kid is None or kid in self._certs):
+                    return self._certs
+            try:
+                self._fetch()
+            except Exception:
+                # Expired keys still verify signatures; better than failing every request while Google is unreachable
+                if self._certs and (kid is None or kid in self._certs):
+                    print("[ERROR auth] public key fetch failed, using previous keys")
+                    return self._certs
+                raise
+            return self._certs
+
+
+class TokenCache:
+    """
+    Bounded cache of verified ID-token claims, keyed by a SHA-256 digest of the token.
+
+    Raw tokens are never stored. Entries expire at the token's own ``exp``
+    claim, so a cached token is never accepted after Firebase would have
+    rejected it, and the least recently used entry is evicted beyond
+    ``max_entries``.
+
+    Args:
+        max_entries: Verified tokens kept in memory
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, token: str, claims: Dict[str, Any]) -> None:
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = (dict(claims), float(exp))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class TokenVerifier:
+    """
+    Verifies Firebase ID tokens against cached public keys, caching the results.
+
+    A cache hit costs one digest and a dict lookup. On a miss the token's
+    signature and claims are checked locally with ``google.auth.jwt`` against
+    ``PublicKeyCache`` certificates, with the same checks as
+    ``firebase_admin.auth.verify_id_token`` (audience, issuer, expiry,
+    subject). If no project id is configured the miss falls through to
+    ``fallback`` instead.
+
+    Args:
+        project_id: Firebase project id, or None to always use ``fallback`` on a miss.
+            May be a zero-argument callable, resolved once on the first miss
+        fallback: ``(token) -> claims`` verifier, normally ``auth.verify_id_token``
+        cache: Verified-claims cache
+        keys: Public key cache
+        clock_skew: Seconds of clock skew tolerated on ``iat``/``exp``
+    """
+
+    def __init__(
+        self,
+        project_id: Union[Optional[str], Callable[[], Optional[str]]],
+        fallback: Callable[[str], Dict[str, Any]],
+        cache: Optional[TokenCache] = None,
+        keys: Optional[PublicKeyCache] = None,
+        clock_skew: int = 0,
+    ):
+        self._project_id = project_id
+        self.fallback = fallback
+        self.cache = cache or TokenCache()
+        self.keys = keys or PublicKeyCache()
+        self.clock_skew = clock_skew
+
+    @property
+    def project_id(self) -> Optional[str]:
+        if callable(self._project_id):
+            self._project_id = self._project_id()
+        return self._project_id
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """
+        Return the token's claims (with ``uid``), raising ``ValueError`` if it is invalid.
+        """
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+        claims = self._verify_locally(token) if self.project_id else self.fallback(token)
+        self.cache.set(token, claims)
+        return claims
+
+    def _verify_locally(self, token: str) -> Dict[str, Any]:
+        from google.auth import jwt
+
+        header = jwt.decode_header(token)
+        if header.get("alg") != "RS256":
+            raise ValueError("Firebase ID token has incorrect algorithm")
+        certs = self.keys.get(header.get("kid"))
+        claims = jwt.decode(token, certs=certs, audience=self.project_id, clock_skew_in_seconds=self.clock_skew)
+        if claims.get("iss") != f"https://securetoken.google.com/{self.project_id}":
+            raise ValueError("Firebase ID token has incorrect issuer")
+        sub = claims.get("sub")
+        if not isinstance(sub, str) or not sub or len(sub) > 128:
+            raise ValueError("Firebase ID token has an invalid subject")
+        claims["uid"] = sub
+        return claims
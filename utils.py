@@ -1,7 +1,30 @@
-import cloudinary.uploader
 import os
+import threading
 from typing import Dict, Any, List
-import json
+from prompting import fit_wardrobe
+
+_cloudinary_lock = threading.Lock()
+_cloudinary_configured = False
+
+def cloudinary_uploader():
+    """
+    Return ``cloudinary.uploader``, importing and configuring the SDK on first use.
+
+    Processes that never touch images (most requests) skip the import at startup.
+    """
+    global _cloudinary_configured
+    import cloudinary
+    import cloudinary.uploader
+
+    with _cloudinary_lock:
+        if not _cloudinary_configured:
+            cloudinary.config(
+                cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+                api_key=os.getenv("CLOUDINARY_API_KEY"),
+                api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+            )
+            _cloudinary_configured = True
+    return cloudinary.uploader
 
 def upload_image_to_cloudinary(image_file, folder: str = "wardrobe") -> Dict[str, Any]:
     """
@@ -15,7 +38,7 @@ def upload_image_to_cloudinary(image_file, folder: str = "wardrobe") -> Dict[str
         Dict containing image URL and metadata
     """
     try:
-        result = cloudinary.uploader.upload(
+        result = cloudinary_uploader().upload(
             image_file,
             folder=folder,
             resource_type="image",
@@ -46,23 +69,25 @@ def delete_image_from_cloudinary(public_id: str) -> bool:
         True if successful, False otherwise
     """
     try:
-        result = cloudinary.uploader.destroy(public_id)
+        result = cloudinary_uploader().destroy(public_id)
         return result.get("result") == "ok"
     except Exception as e:
         print(f"Failed to delete image from Cloudinary: {str(e)}")
         return False
 
-def generate_ai_prompt(questionnaire_data: Dict[str, Any], wardrobe_items: List[Dict[str, Any]]) -> str:
+def generate_ai_prompt(questionnaire_data: Dict[str, Any], wardrobe_items: List[Dict[str, Any]], max_wardrobe_tokens: int = 2000) -> str:
     """
     Generate a comprehensive AI prompt for outfit recommendations.
     
     Args:
         questionnaire_data: User's questionnaire answers
         wardrobe_items: User's wardrobe items
+        max_wardrobe_tokens: Token budget for the compact wardrobe table
     
     Returns:
         Formatted prompt string for AI
     """
+    wardrobe_table, _ = fit_wardrobe(wardrobe_items, max_wardrobe_tokens)
     prompt = f"""
     As a fashion AI assistant, create outfit recommendations for a user based on their profile and wardrobe.
     
@@ -72,8 +97,8 @@ def generate_ai_prompt(questionnaire_data: Dict[str, Any], wardrobe_items: List[
     - Skin Tone: {questionnaire_data.get('skinTone', 'Not specified')}
     - Color Preferences: {questionnaire_data.get('colorPreferences', [])}
     
-    Current Wardrobe Items ({len(wardrobe_items)} items):
-    {json.dumps(wardrobe_items, indent=2)}
+    Current Wardrobe:
+    {wardrobe_table}
     
     Please provide 3 types of outfit recommendations:
     1. Wardrobe-only outfits (using only items from their current wardrobe)
@@ -125,32 +150,56 @@ def generate_voice_prompt(user_text: str) -> str:
     
     return prompt
 
-def validate_wardrobe_item(item_data: Dict[str, Any]) -> Dict[str, Any]:
+# Wardrobe vocabularies
+VALID_WARDROBE_TYPES = ["shirt", "pants", "dress", "skirt", "jacket", "sweater", "shoes", "accessory"]
+VALID_WARDROBE_NATURES = ["casual", "formal", "business", "party", "sport", "elegant"]
+
+def normalize_wardrobe_facets(item_data: Dict[str, Any]) -> Dict[str, str]:
     """
-    Validate and clean wardrobe item data.
+    Normalize the filterable wardrobe fields.
+    
+    Type and nature are mapped onto the valid vocabularies (with the same
+    fallbacks as validate_wardrobe_item); color, brand and material are
+    lowercased and trimmed.
     
     Args:
         item_data: Raw wardrobe item data
     
     Returns:
-        Cleaned and validated data
+        Dict with normalized type, color, nature, brand and material
     """
-    # Define valid options
-    valid_types = ["shirt", "pants", "dress", "skirt", "jacket", "sweater", "shoes", "accessory"]
-    valid_natures = ["casual", "formal", "business", "party", "sport", "elegant"]
-    
     # Clean and validate type
-    item_type = item_data.get("type", "").lower().strip()
-    if item_type not in valid_types:
+    item_type = (item_data.get("type") or "").lower().strip()
+    if item_type not in VALID_WARDROBE_TYPES:
         item_type = "accessory"  # Default fallback
     
     # Clean and validate nature
-    nature = item_data.get("nature", "").lower().strip()
-    if nature not in valid_natures:
+    nature = (item_data.get("nature") or "").lower().strip()
+    if nature not in VALID_WARDROBE_NATURES:
         nature = "casual"  # Default fallback
     
-    # Clean color
-    color = item_data.get("color", "").lower().strip()
+    return {
+        "type": item_type,
+        "color": (item_data.get("color") or "").lower().strip(),
+        "nature": nature,
+        "brand": (item_data.get("brand") or "").lower().strip(),
+        "material": (item_data.get("material") or "").lower().strip(),
+    }
+
+def validate_wardrobe_item(item_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate and clean wardrobe item data.
+    
+    Args:
+        item_data: Raw wardrobe item data
+    
+    Returns:
+        Cleaned and validated data
+    """
+    facets = normalize_wardrobe_facets(item_data)
+    item_type = facets["type"]
+    nature = facets["nature"]
+    color = facets["color"]
     
     # Validate image URL
     image_url = item_data.get("imageUrl", "")